@@ -1,17 +1,25 @@
 import os
 import json
+import hashlib
 import numpy as np
 from flask import Response
 import re
 import asyncio
+import threading
+import time
+import tempfile
 import traceback
+from functools import lru_cache
 from datetime import datetime as _dt
-from flask import Flask, request, jsonify, render_template
+try:
+    import fcntl
+except ImportError:  # Windows development machines: every process warms
+    fcntl = None
+from flask import Flask, request, jsonify, render_template, stream_with_context
 from dotenv import load_dotenv
 import pandas as pd
 
 # Azure imports
-from azure.cosmos.aio import CosmosClient
 from azure.cosmos import exceptions
 from azure.identity import ClientSecretCredential
 from azure.keyvault.secrets import SecretClient
@@ -24,34 +32,69 @@ from langchain_core.prompts import (
 )
 from langchain_ollama import OllamaLLM
 
-load_dotenv()
-
-# Azure Key Vault credentials
-client_id     = os.environ['AZURE_CLIENT_ID']
-tenant_id     = os.environ['AZURE_TENANT_ID']
-client_secret = os.environ['AZURE_CLIENT_SECRETS']
-vault_url     = os.environ['AZURE_VAULT_URL']
+from recommend_cache import cache_from_env, prompt_key
+from cosmos_memory import InMemoryContainer
+from cosmos_pool import ContainerPool, start_pool
+from record_store import RecordStore, clean_df
+from sessions import SessionStore
+from user_ids import USER_FILTER, USER_TYPE_PARAM, allocate_user_ids
+from single_flight import SingleFlight
+from llm_output import InvalidModelOutput, format_ranked, parse_combined_response
+from llm_stream import (
+    LLM_POOL, SectionBudget, UnfinishedReasoning, decode, invoke_sections, new_usage, stream_sections,
+)
+from llm_scheduler import ROUTINE, URGENT, DeadlineExceeded, QueueFull, Ticket
+from llm_batching import BatchedLLM, OllamaBackend, batcher_from_env, render_prompt
+from training_store import (
+    TRAINING_COLUMNS, FrameTrainingTable, MmapTrainingTable, load_training_frame
+)
 
-# Secret names
-secret_name1 = "Cosmo-db-URL"
-secret_name2 = "Cosmo-db-key"
+load_dotenv()
 
-credentials = ClientSecretCredential(
-    client_id=client_id,
-    client_secret=client_secret,
-    tenant_id=tenant_id,
-)
-secret_client = SecretClient(vault_url=vault_url, credential=credentials)
-secret1 = secret_client.get_secret(secret_name1)
-secret2 = secret_client.get_secret(secret_name2)
-URL = secret1.value
-KEY = secret2.value
 DATABASE_NAME     = 'User_Info_db'
 CONTAINER_NAME    = 'User_Info'
 PARTITION_KEY_PATH = '/id'
 
+# COSMOS_BACKEND=memory swaps the account for an in-memory container (local runs)
+COSMOS_BACKEND = os.environ.get('COSMOS_BACKEND', 'azure')
+
+if COSMOS_BACKEND == 'memory':
+    user_pool = ContainerPool(container=InMemoryContainer())
+else:
+    # Azure Key Vault credentials
+    client_id     = os.environ['AZURE_CLIENT_ID']
+    tenant_id     = os.environ['AZURE_TENANT_ID']
+    client_secret = os.environ['AZURE_CLIENT_SECRETS']
+    vault_url     = os.environ['AZURE_VAULT_URL']
+
+    # Secret names
+    secret_name1 = "Cosmo-db-URL"
+    secret_name2 = "Cosmo-db-key"
+
+    credentials = ClientSecretCredential(
+        client_id=client_id,
+        client_secret=client_secret,
+        tenant_id=tenant_id,
+    )
+    secret_client = SecretClient(vault_url=vault_url, credential=credentials)
+    secret1 = secret_client.get_secret(secret_name1)
+    secret2 = secret_client.get_secret(secret_name2)
+    URL = secret1.value
+    KEY = secret2.value
+    user_pool = ContainerPool(URL, KEY, DATABASE_NAME, CONTAINER_NAME)
+
+# one long-lived client on a background loop serves every user route
+cosmos = start_pool(user_pool)
+
+# signed login tokens and the users they resolve to (set SESSION_SECRET)
+sessions = SessionStore()
+
 app = Flask(__name__)
 
+# Hospital tables are loaded once and reloaded only when their file changes
+records = RecordStore()
+records.load_all()
+
 def parse_visit_date(date_str: str) -> _dt.date:
     for fmt in ("%m/%d/%Y", "%#m/%#d/%Y", "%m/%d/%y", "%#m/%#d/%y"):
         try:
@@ -66,336 +109,376 @@ def parse_date_only(date_str, fmt="%m/%d/%Y"):
     except Exception:
         return None
 
-def clean_df(df):
-    df.columns = df.columns.str.strip()
-    for col in df.select_dtypes(include=['object']).columns:
-        df[col] = df[col].str.strip()
-    return df
+# — Cosmos async helpers (shared client, run on the cosmos loop) —
+BULK_IMPORT_LIMIT = 1000
+
+def new_user_doc(user_id: int, name: str, password: str, email: str, role: str, department: str) -> dict:
+    return {
+        'id': str(user_id),
+        'type': 'user',
+        'name': name,
+        'password': password,
+        'email': email,
+        'role': role,
+        'department': department
+    }
 
-# — Cosmos async helpers (unchanged) —
 async def add_user_async(name: str, password: str, email: str, role: str, department: str):
     try:
-        async with CosmosClient(URL, credential=KEY) as client:
-            db = client.get_database_client(DATABASE_NAME)
-            container = db.get_container_client(CONTAINER_NAME)
-
-            # Compute new numeric ID
-            query = "SELECT c.id FROM c"
-            items = container.query_items(query=query, partition_key=None)
-            max_id = 0
-            async for item in items:
-                id_str = item.get('id')
-                if id_str and id_str.isdigit():
-                    max_id = max(max_id, int(id_str))
-            new_id = max_id + 1
-
-            user_doc = {
-                'id': str(new_id),
-                'name': name,
-                'password': password,
-                'email': email,
-                'role': role,
-                'department': department
-            }
-            await container.upsert_item(user_doc)
-
-            return {
-                "status": "success",
-                "user_id": new_id,
-                "username": name,
-                "role": role,
-                "department": department
-            }
+        container = await user_pool.container()
+        new_id = (await allocate_user_ids(container))[0]
+
+        user_doc = new_user_doc(new_id, name, password, email, role, department)
+        await container.upsert_item(user_doc)
+        await index_user_email(container, user_doc)
+
+        return {
+            "status": "success",
+            "user_id": new_id,
+            "username": name,
+            "role": role,
+            "department": department
+        }
     except exceptions.CosmosHttpResponseError as e:
         return {"status": "error", "message": str(e)}
 
-async def validate_user_async(password: str, email: str):
+async def add_users_async(users: list, concurrency: int = 16):
+    """Bulk import: one counter bump for the whole block of ids."""
     try:
-        async with CosmosClient(URL, credential=KEY) as client:
-            db = client.get_database_client(DATABASE_NAME)
-            container = db.get_container_client(CONTAINER_NAME)
-
-            query = "SELECT * FROM c WHERE c.password = @pwd AND c.email = @mail"
-            parameters = [
-                {"name": "@pwd", "value": password},
-                {"name": "@mail", "value": email}
+        container = await user_pool.container()
+        ids = await allocate_user_ids(container, len(users))
+        docs = [
+            new_user_doc(
+                user_id, u.get('name'), u.get('password'), u.get('email'),
+                u.get('role', 'user'), u.get('department', 'General')
+            )
+            for user_id, u in zip(ids, users)
+        ]
+        gate = asyncio.Semaphore(concurrency)
+
+        async def write(doc):
+            async with gate:
+                await container.upsert_item(doc)
+                await index_user_email(container, doc)
+
+        await asyncio.gather(*(write(doc) for doc in docs))
+        return {
+            "status": "success",
+            "users": [
+                {"user_id": int(d['id']), "username": d['name'], "role": d['role'], "department": d['department']}
+                for d in docs
             ]
-            items = container.query_items(query=query, parameters=parameters, partition_key=None)
-            async for item in items:
-                return {
-                    'userid':     item['id'],
-                    'username':   item['name'],
-                    'password':   item['password'],
-                    'email':      item['email'],
-                    'role':       item.get('role', 'user'),
-                    'department': item.get('department', 'Unknown')
-                }
-            return None
+        }
     except exceptions.CosmosHttpResponseError as e:
         return {"status": "error", "message": str(e)}
 
-async def delete_user_async(user_id: str):
+def email_index_id(email: str) -> str:
+    # ids cannot hold every character an address can, so key on a digest
+    return 'email-' + hashlib.sha256(email.strip().lower().encode('utf-8')).hexdigest()
+
+def user_view(item: dict) -> dict:
+    return {
+        'userid':     item['id'],
+        'username':   item['name'],
+        'password':   item['password'],
+        'email':      item['email'],
+        'role':       item.get('role', 'user'),
+        'department': item.get('department', 'Unknown')
+    }
+
+async def index_user_email(container, user_doc: dict):
+    index_id = email_index_id(user_doc['email'])
+    await container.upsert_item({'id': index_id, 'type': 'email_index', 'user_id': user_doc['id']})
+
+async def read_user_async(user_id: str):
+    """Point read by id (the partition key); None if the user does not exist."""
+    container = await user_pool.container()
     try:
-        async with CosmosClient(URL, credential=KEY) as client:
-            db = client.get_database_client(DATABASE_NAME)
-            container = db.get_container_client(CONTAINER_NAME)
+        return await container.read_item(item=user_id, partition_key=user_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+async def validate_user_async(password: str, email: str):
+    try:
+        container = await user_pool.container()
+        # email -> id index document, then the user document: two point reads
+        index_id = email_index_id(email or '')
+        try:
+            index = await container.read_item(item=index_id, partition_key=index_id)
+        except exceptions.CosmosResourceNotFoundError:
+            index = None
+        if index is not None:
+            item = await read_user_async(index['user_id'])
+            if item is None or item.get('password') != password:
+                return None
+            return user_view(item)
+
+        # users created before the index existed: query once, then backfill
+        query = f"SELECT * FROM c WHERE c.password = @pwd AND c.email = @mail AND {USER_FILTER}"
+        parameters = [
+            {"name": "@pwd", "value": password},
+            {"name": "@mail", "value": email},
+            USER_TYPE_PARAM
+        ]
+        items = container.query_items(query=query, parameters=parameters, partition_key=None)
+        async for item in items:
+            await index_user_email(container, item)
+            return user_view(item)
+        return None
+    except exceptions.CosmosHttpResponseError as e:
+        return {"status": "error", "message": str(e)}
 
-            await container.delete_item(item=user_id, partition_key=user_id)
-            return {"status": "success", "deleted_user_id": user_id}
+async def delete_user_async(user_id: str):
+    try:
+        container = await user_pool.container()
+        item = await read_user_async(user_id)
+        await container.delete_item(item=user_id, partition_key=user_id)
+        if item is not None and item.get('email'):
+            index_id = email_index_id(item['email'])
+            try:
+                await container.delete_item(item=index_id, partition_key=index_id)
+            except exceptions.CosmosResourceNotFoundError:
+                pass
+        return {"status": "success", "deleted_user_id": user_id}
     except exceptions.CosmosHttpResponseError as e:
         if hasattr(e, 'status_code') and e.status_code == 404:
             return {"status": "failure", "message": f"User with id {user_id} not found."}
         return {"status": "error", "message": str(e)}
 
 
-# — CSV-based retrieval —
+# — CSV-based retrieval (served from the resident record store) —
 def get_registration_records(mr_code):
-    df = pd.read_csv('mr_registiration.csv', dtype={'MR_CODE': str})
-    df = clean_df(df)
-    df = df.replace({np.nan: None})
-
-    # 4) Filter
-    filtered = df[(df['MR_CODE'] == mr_code)]
-
-    return filtered.to_dict(orient='records')
-
-def get_presenting_complain_records(mr_code, mr_visit_date):
-    df = pd.read_csv('presinting_complain.csv', dtype={'MR_CODE': str, 'MR_VISIT_DATE': str})
-    df = clean_df(df)
-
-    # Parse visit-date into a date object
-    df['VISIT_DATE_ONLY'] = (
-        pd.to_datetime(
-            df['MR_VISIT_DATE'].str.split().str[0],
-            format='%m/%d/%Y',
-            errors='coerce'
-        )
-        .dt.date
-    )
-
+    return records.rows('registration', mr_code).to_dict(orient='records')
 
-    # Normalize input date
+def get_visit_records(table, mr_code, mr_visit_date):
     mr_visit_date_obj = parse_date_only(mr_visit_date)
     if mr_visit_date_obj is None:
         return []
+    return records.rows(table, mr_code, mr_visit_date_obj).to_dict(orient='records')
 
-    df = df.replace({np.nan: None})
-
-    filtered = df[
-        (df['MR_CODE'] == mr_code) &
-        (df['VISIT_DATE_ONLY'] == mr_visit_date_obj)
-        ]
-    return filtered.to_dict(orient='records')
+def get_presenting_complain_records(mr_code, mr_visit_date):
+    return get_visit_records('presenting_complain', mr_code, mr_visit_date)
 
 def get_vitals_records(mr_code, mr_visit_date):
-    df = pd.read_csv(
-        'vitals.csv',
-        dtype={'MR_CODE': str, 'MR_VISITDATE': str}
-    )
-    df = clean_df(df)
-
-    df['VISIT_DATE_ONLY'] = (
-        pd.to_datetime(
-            df['MR_VISITDATE'].str.split().str[0],
-            format='%m/%d/%Y',
-            errors='coerce'
-        )
-        .dt.date
-    )
-    mr_visit_date_obj = parse_date_only(mr_visit_date)
-
-    if mr_visit_date_obj is None:
-        return []
-
-    df = df.replace({np.nan: None})
-
-
-    filtered = df[
-        (df['MR_CODE'] == mr_code) &
-        (df['VISIT_DATE_ONLY'] == mr_visit_date_obj)
-        ]
-    print(filtered)
-    return filtered.to_dict(orient='records')
+    return get_visit_records('vitals', mr_code, mr_visit_date)
 
 def get_diagnoses_records(mr_code, mr_visit_date):
-    df = pd.read_csv(
-        'Diagnosis.csv',
-        dtype={'MR_CODE': str, 'MR_VISIT_DATE': str}
-    )
-    df = clean_df(df)
-
-    df['VISIT_DATE_ONLY'] = (
-        pd.to_datetime(
-            df['MR_VISIT_DATE'].str.split().str[0],
-            format='%m/%d/%Y',
-            errors='coerce'
-        )
-        .dt.date
-    )
-
-    mr_visit_date_obj = parse_date_only(mr_visit_date)
-
-    if mr_visit_date_obj is None:
-        return []
-
-    df = df.replace({np.nan: None})
-
-
-
-    filtered = df[
-        (df['MR_CODE'] == mr_code) &
-        (df['VISIT_DATE_ONLY'] == mr_visit_date_obj)
-        ]
-    return filtered.to_dict(orient='records')
+    return get_visit_records('diagnoses', mr_code, mr_visit_date)
 
 def get_lab_request_records(mr_code, mr_visit_date):
-    df = pd.read_csv('lab_request.csv', dtype={'MR_CODE': str, 'MR_VISIT_DATE': str})
-
-    df = clean_df(df)
+    return get_visit_records('lab_request', mr_code, mr_visit_date)
 
-    df['VISIT_DATE_ONLY'] = (
-        pd.to_datetime(
-            df['MR_VISIT_DATE'].str.split().str[0],
-            format='%m/%d/%Y',
-            errors='coerce'
-        )
-        .dt.date
-    )
-
-    mr_visit_date_obj = parse_date_only(mr_visit_date)
-
-    if mr_visit_date_obj is None:
-        return []
-
-    df = df.replace({np.nan: None})
-
-    filtered = df[(df['MR_CODE'] == mr_code) & (df['VISIT_DATE_ONLY'] == mr_visit_date_obj)]
-    return filtered.to_dict(orient='records')
+def lab_results_for_requests(lrs_nos, mr_visit_date_obj):
+    # results for these LRS_NOs inserted on the visit date
+    return records.rows_many('lab_result', lrs_nos.unique(), mr_visit_date_obj).to_dict(orient='records')
 
 def get_lab_result_records(mr_code, mr_visit_date):
-    # Get request numbers
-    lr_df = pd.read_csv(
-        'lab_request.csv',
-        dtype={'MR_CODE': str, 'MR_VISIT_DATE': str, 'LRS_NO': str}
-    )
-    # strip whitespace
-    lr_df['MR_CODE'] = lr_df['MR_CODE'].str.strip()
-    lr_df['MR_VISIT_DATE'] = lr_df['MR_VISIT_DATE'].str.strip()
-    lr_df['LRS_NO'] = lr_df['LRS_NO'].str.strip()
-    # extract & parse date-only
-    lr_df['VISIT_DATE_ONLY'] = pd.to_datetime(
-        lr_df['MR_VISIT_DATE'].str.split().str[0],
-        format='%m/%d/%Y',
-        errors='coerce'
-    ).dt.date
-
-    # normalize inputs
+    """Results for the visit's lab requests; None (as before) when the date
+    does not parse or the visit has no lab request."""
     mr_code_str = str(mr_code).strip()
     mr_visit_date_obj = parse_date_only(mr_visit_date)
+    if mr_visit_date_obj is None:
+        return None
 
-    # filter lab_request on code + date
-    matching_lrs = lr_df.loc[
-        (lr_df['MR_CODE'] == mr_code_str) &
-        (lr_df['VISIT_DATE_ONLY'] == mr_visit_date_obj),
-        'LRS_NO'
-    ]
+    # request numbers for this code + date
+    matching_lrs = records.rows('lab_request', mr_code_str, mr_visit_date_obj)['LRS_NO']
 
     if matching_lrs.empty:
         print(f"No lab request found, cannot retrieve lab results for "
               f"MR_CODE={mr_code_str}, MR_VISIT_DATE={mr_visit_date_obj}.")
-        return
+        return None
 
-    # 2) Read & clean lab_result.csv
-    df = pd.read_csv(
-        'lab_result.csv',
-        dtype={'LRS_NO': str, 'INSERT_DT': str}
-    )
-    df = clean_df(df)
-    df['LRS_NO'] = df['LRS_NO'].str.strip()
-    df['INSERT_DT'] = df['INSERT_DT'].str.strip()
-    # extract & parse date-only
-    df['INSERT_DATE_ONLY'] = pd.to_datetime(
-        df['INSERT_DT'].str.split().str[0],
-        format='%m/%d/%Y',
-        errors='coerce'
-    ).dt.date
+    return lab_results_for_requests(matching_lrs, mr_visit_date_obj)
 
-    mr_visit_date_obj = parse_date_only(mr_visit_date)
+def get_medication_records(mr_code):
+    return records.rows('medication', mr_code).to_dict(orient='records')
 
+def get_visit_summary(mr_code, mr_visit_date):
+    """All seven record panels for one visit, from a single date parse."""
+    mr_visit_date_obj = parse_date_only(mr_visit_date)
     if mr_visit_date_obj is None:
-        return []
-
-    df = df.replace({np.nan: None})
-
-    # filter for both LRS_NO match and same insert date
-    filtered = df.loc[
-        df['LRS_NO'].isin(matching_lrs) &
-        (df['INSERT_DATE_ONLY'] == mr_visit_date_obj)
-        ]
-    return filtered.to_dict(orient='records')
+        return None
 
-def get_medication_records(mr_code):
-    df = pd.read_csv(
-        'medication.csv',
-        dtype={'MR_CODE': str}
-    )
-    df = clean_df(df)
+    def visit_rows(table):
+        return records.rows(table, mr_code, mr_visit_date_obj)
+
+    lab_requests = visit_rows('lab_request')
+    return {
+        'registration':        get_registration_records(mr_code),
+        'presenting_complain': visit_rows('presenting_complain').to_dict(orient='records'),
+        'vitals':              visit_rows('vitals').to_dict(orient='records'),
+        'diagnoses':           visit_rows('diagnoses').to_dict(orient='records'),
+        'lab_requests':        lab_requests.to_dict(orient='records'),
+        'lab_results':         lab_results_for_requests(lab_requests['LRS_NO'], mr_visit_date_obj),
+        'medications':         get_medication_records(mr_code),
+    }
+
+
+
+# — Batch retrieval —
+MAX_BATCH_KEYS = 1000
+
+def split_batch(rows, counts):
+    out, start = [], 0
+    for count in counts:
+        out.append(rows[start:start + count])
+        start += count
+    return out
+
+def parse_batch_keys(items, by_visit=True):
+    keys = []
+    for item in items:
+        mr_code = str(item.get('mr_code', '')).strip()
+        visit_date = str(item.get('visit_date', '')).strip()
+        date_obj = parse_date_only(visit_date) if by_visit else None
+        keys.append((mr_code, visit_date, date_obj))
+    return keys
+
+def batch_results(keys, record_lists):
+    return [
+        {'mr_code': mr_code, 'visit_date': visit_date, 'records': rows}
+        for (mr_code, visit_date, _), rows in zip(keys, record_lists)
+    ]
 
+def get_batch_records(table, items, by_visit=True):
+    keys = parse_batch_keys(items, by_visit)
+    # a key with an unparseable date matches nothing, like the single routes
+    groups = [[] if by_visit and d is None else [(code, d)] for code, _, d in keys]
+    rows, counts = records.rows_batch(table, groups)
+    return batch_results(keys, split_batch(rows.to_dict(orient='records'), counts))
 
-    df = df.replace({np.nan: None})
+def get_batch_lab_result_records(items):
+    keys = parse_batch_keys(items)
+    groups = [[] if d is None else [(code, d)] for code, _, d in keys]
+    requests, counts = records.rows_batch('lab_request', groups)
 
+    result_groups = []
+    for (_, _, d), lrs_nos in zip(keys, split_batch(requests['LRS_NO'].tolist(), counts)):
+        result_groups.append([(lrs, d) for lrs in dict.fromkeys(lrs_nos)])
+    rows, counts = records.rows_batch('lab_result', result_groups)
+    return batch_results(keys, split_batch(rows.to_dict(orient='records'), counts))
 
-    # 5) Filter on MR_CODE + date-only
-    filtered = df[
-        (df['MR_CODE'] == mr_code)
-        ]
-    return filtered.to_dict(orient='records')
+BATCH_ROUTES = {
+    'registration_records':        lambda items: get_batch_records('registration', items, by_visit=False),
+    'presenting_complain_records': lambda items: get_batch_records('presenting_complain', items),
+    'vitals_records':              lambda items: get_batch_records('vitals', items),
+    'diagnoses_records':           lambda items: get_batch_records('diagnoses', items),
+    'lab_request_records':         lambda items: get_batch_records('lab_request', items),
+    'lab_result_records':          get_batch_lab_result_records,
+    'medication_records':          lambda items: get_batch_records('medication', items, by_visit=False),
+}
 
 
 
 # — Department guidance —
+# ward guidance in the system prompt, by user department
+DEPARTMENT_GUIDANCE = {
+    '19 A': 'You work in 19A Department , so the most likely Diagnosis should be among these : ACHALESIA CARDIA, ACUTE APPENDICITIS, ADHESIVE OBSTRUCTION, ARM WITH RVF, INGUINAL HERNIA, TEV, UNDESCENDED TESTES, BAND OBSTRUCTION, BILIARY ATRESIA, CHOLEDOCHAL CYST, CHOLELITHIASIS, CONCEALED PENIS, CYSTIC HYGROMA, DUODENAL PERFORATION, ENTERIC PERFORATION, ESOPHAGEAL ATRESIA, ESOPHAGEAL STRICTURE, TRAUMA, FOREIGN BODY ASPIRATION, HEMANGIOMA, HX DISEASE, HYPOSPADIAS, IMPACTED URETHRAL STONE, INFECTED WOUND, INTESTINAL OBSTRUCTION ADHESIONS, INTUSSUSCEPTION, TORTICOLIS, VUJO, MESENTERIC CYST, MEATAL STENOSIS, ABSCESS, OVARIAN CYST, PNEUNONIA, PRIMARY PERITONITIS, PUJO, RECTAL POLYP, EPIDIDYMO-ORCHITIS, STOMA CLOSURE, SUB ACUTE INTESTINAL OBSTRUCTION, THYROGLOSSAL CYST, UG SINUS, VAGINAL ATRESIA, VESICAL CALCULI .',
+    'SICU': 'You work in the Surgical ICU',
+    '19 B': 'You work in ward 19 B, so the most likely Diagnosis should be among these : ACUTE EXACERBATION OF ASTHMA, INFANTILE HYPERTROPHIC PYLORIC STENOSIS, ARM, Cyst, UNKNOWN POISONING/DRUG OVER DOSE, ILEAL ARESIA, HYDROCEPHSLUS, RTA, THALESEMIA, Hirchsprung Disease, Foreign Body Aspiration, Stomal Diarrhea, Right Testicular Mass, BLEEDING DISORDER, ALL, HEPATITIS, Dog Bite, Omphalitis, Malrotation, Rectal Polyp, Ovarian Mass, Tongue Tie, SEPTIC SHOCK, VENTRICULITIS, UTI, Posterior Urethral Value, Worm Infestation, Midgut Volvolus, PREES SYNDROME, Congenital Diaphragmatic Hernia, Circumcision then Developed Phimosis, Post Appendiceal Pain + Menstraul Pain, Esophageal Stricture, Cystic Hygroma, Torsion of Appendicular Testis + Epididymorchitis, INTESTINAL OBSTRUCTION , Didelphys + Vagineal Septum + Obstructive Uropathy, Tracheal Stenosis, Mesenteric Adenitis, Functional Constipation + Fecal Loading 2` to Constipation, Left Gluteal Discharging Sinus, Post Circumcision Meatoplasty, Non Obstructing Pelvi-Ureteric Junction Calculus + Mild Hydroureter, Left Posterior Thigh Cellulitis, K/C Cloacal Malformation With Ambigous Genitalia, Left Sided Perianal Swelling, Lymphoproliferative Disease, Occipital Complex Mass, Cervical Lymphadenopathy, UG Sinus + Left Solitary Kidney, Wound Infection, Colonic Atresia, Pyogenic Granuloma on Left Side of Scalp',
+    'ITU': 'You work in the ITU Department, so the most likely Diagnosis should be among these : Left CDH, Cloacal Malformation, Meconium ileus, INTRAVENTICULAR HEMMORHAGE/MENINGITIS, Right Irreducible Inguinal Hernia, IRON DECIFIENCY ANEMIA, Suspected Hirchsprung Disease, Right Undescended Testis, INFENTILE LEUKEMIA, Omphalocele Minor With POMD, FOCAL FATTY INFILTRATION IN LIVER, Proximal Small Bowel Atresia with Rectal Atresia',
+    'BURN': 'You work in the Burn Unit',
+    'MEDICAL UNIT I': 'You’re on Medical Unit I, so the most likely Diagnosis should be among these : ACUTE GASTORENTERITIS, MEASLES e PNEUMONIA/ENCEPHALITIS, ENTERIC FEVER/TYPHOID, URINARY TRACT INFECTION, METABOLIC FITS/SEIZURE DISORDER?, AKI e ACUTE GASTROENTERITIS, DOWN SYNDROME/BRONCHOPNEUMONIA?, TERATOMA, BRONCHIOLITIS, PNEUMONIA e SEPSIS, ALL e CHICKEN POX, ACUTE LEUKEMIA(JML), LT SIDED PLEURAL EFFUSION, ACUTE LIVER FAILURE, EMPYSEMA THORACIC, BRONCHOPNEUMONIA, ACUTE FEBRILE ILLUS, K/C OF THALASSEMIA, MENINGOENCEPHALITIS, NEONATAL CHOLESTASIS SEC TO, MENINGITIS/ENCEPHALITIS, LYMPHOMA, AML, K/C THALASSEMIA MAJOR e BRONCHOPNEUMONIA, FEBRILE FITS, ANEMIA SEC TO??, LT HIP SEPTIC ARTHRITIS, OSTEOPETROSIS, GANGLIONEUROMA?, NEONATAL CHOLESTASIS SEC TO, CP CHILD e ASPIRATION PNEUMONIA, VIRAL ENCEPHALIYS, ABDOMINAL TB, CEREBRAL PALSY/PNEUMONIA?, AUTOIMMUNE HEMOLYTIC ANEMIA, LOBAR PNEUMONIA, ANEMIC FAILURE, GLANZMAN THROMBASTHENIA, METABOLIC FITS/MENINGITIS?, GBS, ACUTE VIRAL HEPATITIS, PANCYTOPENIA SEC TO BRONCHOPNEUMONIA, B/L PNEUMOTHORAX SEC TO TB, BILLIARY ATRESIA/FACTOR X DEFICIENCY?, SNAKE POISONING, PCM+ACUTE VIRAL HEPATITES, APLASTIC ANEMIA?/PANCYTOPENIA SEC TO?, SEPTIC SHOCK?/3RD DEGREE BURN?, LYMPHOPROLIFERATIVE DISORDER?/APLASTIC ANEMIA, CYSTIC FIBROSIS, CHD e COMPLICATION/BRAIN ABSCESS, BRAIN ABCESS, SSPE e ASPIRATION PNEUMONIA, SEPTIC ARTHRITIS/OLIGOARTICULAR (JIA), CP e PNEUMONIA, BLEEDING DISORDER SEC TO PLATELET FUNCTION DISORDER, BLEACH INGESTION TOXIC EFFECTS OF ALKALI, PETROLEUM INGESTION POISONING, CHOLERA, ALL/MUMPS, REACTIVE AIRWAY DISEASE, POST BURNS COMPLICATION/ANEMIC FAILURE?, SEPSIS e SEPTIC SHOCK, POST MEASLES e PNEUMONIA, POST MENINGITIS SEQUALE, ACUTE KIDNEY INJURY, PULMONARY TB, PYOGENIC MENINGITS, CHD e MYOCARDITIS, ROAD TRAFFIC ACCIDENT, RICKETS/DELAYED MILESTONES, RT SIDED EMPYEMA, BULBAR PALSY SEC TO HSV ENCEPHALITIS, RT SIDED PLURAL EFFUSION, RUPTIUD LIVER ABCESS, CHD CONGENITAL HEART DISEASE, SCID/PCM, SEPSIS/RT SIDED CELLULITIS, FAILURE TO THRIVE, HEPATIC FAILURE, CHRONIC LIVER DISEASE, HIV COMPLICATION, HIE III/MENINGITIS, HYDROCEPHLOUS/MENINGITIS?, K/C OF DOWN SYNDROME+CHD, K/C OF SEIZURE DISORDER, CHD e BRONCHOPNEUMONIA, ACUTE MYOCARDITIS, MYOCARDITIS/BRONCHOPNEUMONIA?, CLD?, GAUCHER DISEASE e PLEURAL EFFUSION, NEPHROTIC SYNDROME/CCF?, PROTEIN CALORIE MALNUTRITION/SEPSIS?, PERI ORBITAL CELLULTIS, PNEUMOTHORAX, POSTENIOR FOSSA MASS IN BRAIN, RHEMATIC HEART DISEASE, SEPSIS/SJS, STATUS ASTHMATICUS, JOUBERT SYNDROME?, LT EVENTRATION OF DIAPHRAM.',
+    'MEDICAL UNIT II': 'You’re on Medical Unit II, so the most likely Diagnosis should be among these : B 12 DEFICIENCY, ANEMIA, AFB TO GBS, AKI SEC TO AGE, ACUTE PANCREATITIS, AMOEBIC LIVER ABCESS, APLASTIC ANEMIA, ASPIRATION PNEUMONIA, ASTHAMA, AGE, BUDD CHAIR SYNDROME, CELLULITIS, CELLULITIS ON BOTH ARM, CHD E MEASLES E PNEUMONIA, CHD, CHIKEN POX, CHOLERA, BENZODIAZEPINE POISONING, APBPA/HIE, CELLULITIS OF RIGHT LEG & RIGHT FOREARM/BLEEDING DISORDER, CHD E PNEUMONIA, CHRONIC LIVER DISEASE, CKD, CKD GRADE 2, CKD/SLE, COMPLICATEDPNEUMONIA, CP CHILD, CP CHIL E PNEUMONIA, CP E SEIZURE DISORDER, DENGUE, DISSEMENATED TB, DOWN SYNDROME, DYSENTRY, EPILEPSY, ENCEPHALITIS, ENTERIC FEVER, FANCONE ANEMIA, FTT, FOOT GANGEROUS, FTT/SEPSIS, GASTROENTERITIS, GASTROENTERITIS BACTERIAL, HEMOLYTIC ANEMIA, HYPOCALEMIA, HEPATIC ENCEPHALOPATHY, HIE, HIV+BRONCHOPNEUMONIA, HSP, HYDROCEPHALOUS/MENINGITIS, HYPOCALEMIC FITS, HYPOCALEMIC PARALYSIS, HEMOPHILIA, K/C OF ALL, K/C OF AML, K/C OF CML, K/C OF RETINOBLASTOMA, K/C OF SSPE, LEFT SIDED CONGENITAL/DIAPHGMATIC HERBNIA/PNEUMONIA, LEFT SIDED EMPYEMA, LEFT SIDED PLUERAL EMPEYMA, LIVER ABSCESS/RIGHT PLUERAL EFFUSION, MALARIA, MENINGEOENCEPHALITIS, MENINGITIS, MYOCARDITIS, ORGANICPHOSPHARUS POISONING, PANCYTOPENIA, SUSP GLANZEMONN THROMBOSTHERIA, PME, PARASITIC TWIN/BED SORES GRADE 2, PCM, PCM/SEPSIS, PDA HIGH PRESSURE, PETRUSIS, PNEUMONIA, PHYORYGITIC, PLUERAL EMPYEMA, PLUERAL EFFUSION, MEASLES, MEASLES E PNEUMONIA, MEASLES COMPLICATED BY PNEUMONIA, MEASLES E COMPLICATION, POST MEASLES PNEUMONIA, POST MEASLES ENCEPHALITIS, PULMONARY HYPERTENSION, REACTIVE AIRWAY DISEASE, RDS, SEPSIS, SEPTIC SHOCK, SEVERE SEPSIS, SSPE, SNAKE BITE POISONING, RIGHT EMPYEMA 2 TO TB, RIGHT SIDED LOBAR PNEUMONIA, SAM (KWORSHIORKOR) E ACUTE GASTROENTERITIS, SICKLE THALESEMIA, SUSP DIPHTERIA, HLH, SEPTIC ARTHRITIS, SUSP ENTERIC, SUSP MENINGITIS, SUSP TESATOMA, SYNDROMIC, TB E PNEUMONIA, TB MENINGITIS, TB/URTI, TETANUS, TTP/MALARIA FALCIPARIM, TUBERCLOSIS, TUBERCLOSIS MENINGITIS, LEFT KNEE ARTHRITIS, UTI, CEREBRAL PALSY, SUSP CELIAC DISEASE, VIVAX MALARIA, SEIZURE DISORDER, VIRAL MENINGITIS, NON .',
+    'MEDICAL UNIT III': 'You’re on Medical Unit III, co the most likely Diagnosis should be among these : AUTOIMUE DISORDER, CHD, CHRONIC SUPPURATIVE OTITIS MEDIA, CYSTIC FIBROSIS, CONGENITAL HEART DISEASE (CYANOTIC), DIARRHEA, DISSOCIATED DISORDER, ENTERIC FEVER, EMPYEMA, ERYTHEMA MUITIFORME, EARLY ONSET SEPSIS, HYPOVOLUMIC SHOCK, HYPOXIC ISCHEMIC ENCEPHALOPATHY, ITP, LEUKEMIA, LOW GRADE GLIOMA, LYMPHOPROLIFERATIVE DISORDER, malabsorption syndrome, METABOLIC FITS, MEASLES/ PNEUMONIA, MENINGOENCEPHALITIS, MENINGIOMYELOCELE, MECONIUM ASPIRATION SYNDROME, MICROCEPHALY, NEUROGENIC BLADDER, NEONATAL JAUNDICE, pleural effusion, PNEUMONIA, PRE B ALL, RESPIRAYORY AIR DISEASE, sepsis/septic shock, snake poisoning, STEVEN JOHNSON SYNDROME, TBM, typhoid, TORCH infection, TETANUS, UTI',
+    'NICU': 'You work in the Neonatal ICU, so the most likely Diagnosis should be among these : LATE ONSET SEPSIS, RESPIRATORY DISTRESS SYNDROME, TRANSIENT TACHYPNEA OF NEW BORN, LBW',
+    'GASTRO': 'You work in the Gastroenterology Unit',
+}
+DEFAULT_GUIDANCE = 'You work in pediatric oncology.'
+
 def get_dept_text(department: str) -> str:
-    dept = department
-    if dept == '19 A':
-        dept_text = 'You work in 19A Department , so the most likely Diagnosis should be among these : ACHALESIA CARDIA, ACUTE APPENDICITIS, ADHESIVE OBSTRUCTION, ARM WITH RVF, INGUINAL HERNIA, TEV, UNDESCENDED TESTES, BAND OBSTRUCTION, BILIARY ATRESIA, CHOLEDOCHAL CYST, CHOLELITHIASIS, CONCEALED PENIS, CYSTIC HYGROMA, DUODENAL PERFORATION, ENTERIC PERFORATION, ESOPHAGEAL ATRESIA, ESOPHAGEAL STRICTURE, TRAUMA, FOREIGN BODY ASPIRATION, HEMANGIOMA, HX DISEASE, HYPOSPADIAS, IMPACTED URETHRAL STONE, INFECTED WOUND, INTESTINAL OBSTRUCTION ADHESIONS, INTUSSUSCEPTION, TORTICOLIS, VUJO, MESENTERIC CYST, MEATAL STENOSIS, ABSCESS, OVARIAN CYST, PNEUNONIA, PRIMARY PERITONITIS, PUJO, RECTAL POLYP, EPIDIDYMO-ORCHITIS, STOMA CLOSURE, SUB ACUTE INTESTINAL OBSTRUCTION, THYROGLOSSAL CYST, UG SINUS, VAGINAL ATRESIA, VESICAL CALCULI .'
-        return dept_text
-    elif dept == 'SICU':
-        dept_text = 'You work in the Surgical ICU'
-        return dept_text
-    elif dept == '19 B':
-         dept_text = 'You work in ward 19 B, so the most likely Diagnosis should be among these : ACUTE EXACERBATION OF ASTHMA, INFANTILE HYPERTROPHIC PYLORIC STENOSIS, ARM, Cyst, UNKNOWN POISONING/DRUG OVER DOSE, ILEAL ARESIA, HYDROCEPHSLUS, RTA, THALESEMIA, Hirchsprung Disease, Foreign Body Aspiration, Stomal Diarrhea, Right Testicular Mass, BLEEDING DISORDER, ALL, HEPATITIS, Dog Bite, Omphalitis, Malrotation, Rectal Polyp, Ovarian Mass, Tongue Tie, SEPTIC SHOCK, VENTRICULITIS, UTI, Posterior Urethral Value, Worm Infestation, Midgut Volvolus, PREES SYNDROME, Congenital Diaphragmatic Hernia, Circumcision then Developed Phimosis, Post Appendiceal Pain + Menstraul Pain, Esophageal Stricture, Cystic Hygroma, Torsion of Appendicular Testis + Epididymorchitis, INTESTINAL OBSTRUCTION , Didelphys + Vagineal Septum + Obstructive Uropathy, Tracheal Stenosis, Mesenteric Adenitis, Functional Constipation + Fecal Loading 2` to Constipation, Left Gluteal Discharging Sinus, Post Circumcision Meatoplasty, Non Obstructing Pelvi-Ureteric Junction Calculus + Mild Hydroureter, Left Posterior Thigh Cellulitis, K/C Cloacal Malformation With Ambigous Genitalia, Left Sided Perianal Swelling, Lymphoproliferative Disease, Occipital Complex Mass, Cervical Lymphadenopathy, UG Sinus + Left Solitary Kidney, Wound Infection, Colonic Atresia, Pyogenic Granuloma on Left Side of Scalp'
-         return dept_text
-    elif dept == 'ITU':
-        dept_text = 'You work in the ITU Department, so the most likely Diagnosis should be among these : Left CDH, Cloacal Malformation, Meconium ileus, INTRAVENTICULAR HEMMORHAGE/MENINGITIS, Right Irreducible Inguinal Hernia, IRON DECIFIENCY ANEMIA, Suspected Hirchsprung Disease, Right Undescended Testis, INFENTILE LEUKEMIA, Omphalocele Minor With POMD, FOCAL FATTY INFILTRATION IN LIVER, Proximal Small Bowel Atresia with Rectal Atresia'
-        return dept_text
-    elif dept == 'BURN':
-        dept_text = 'You work in the Burn Unit'
-        return dept_text
-    elif dept == 'MEDICAL UNIT I':
-        dept_text = 'You’re on Medical Unit I, so the most likely Diagnosis should be among these : ACUTE GASTORENTERITIS, MEASLES e PNEUMONIA/ENCEPHALITIS, ENTERIC FEVER/TYPHOID, URINARY TRACT INFECTION, METABOLIC FITS/SEIZURE DISORDER?, AKI e ACUTE GASTROENTERITIS, DOWN SYNDROME/BRONCHOPNEUMONIA?, TERATOMA, BRONCHIOLITIS, PNEUMONIA e SEPSIS, ALL e CHICKEN POX, ACUTE LEUKEMIA(JML), LT SIDED PLEURAL EFFUSION, ACUTE LIVER FAILURE, EMPYSEMA THORACIC, BRONCHOPNEUMONIA, ACUTE FEBRILE ILLUS, K/C OF THALASSEMIA, MENINGOENCEPHALITIS, NEONATAL CHOLESTASIS SEC TO, MENINGITIS/ENCEPHALITIS, LYMPHOMA, AML, K/C THALASSEMIA MAJOR e BRONCHOPNEUMONIA, FEBRILE FITS, ANEMIA SEC TO??, LT HIP SEPTIC ARTHRITIS, OSTEOPETROSIS, GANGLIONEUROMA?, NEONATAL CHOLESTASIS SEC TO, CP CHILD e ASPIRATION PNEUMONIA, VIRAL ENCEPHALIYS, ABDOMINAL TB, CEREBRAL PALSY/PNEUMONIA?, AUTOIMMUNE HEMOLYTIC ANEMIA, LOBAR PNEUMONIA, ANEMIC FAILURE, GLANZMAN THROMBASTHENIA, METABOLIC FITS/MENINGITIS?, GBS, ACUTE VIRAL HEPATITIS, PANCYTOPENIA SEC TO BRONCHOPNEUMONIA, B/L PNEUMOTHORAX SEC TO TB, BILLIARY ATRESIA/FACTOR X DEFICIENCY?, SNAKE POISONING, PCM+ACUTE VIRAL HEPATITES, APLASTIC ANEMIA?/PANCYTOPENIA SEC TO?, SEPTIC SHOCK?/3RD DEGREE BURN?, LYMPHOPROLIFERATIVE DISORDER?/APLASTIC ANEMIA, CYSTIC FIBROSIS, CHD e COMPLICATION/BRAIN ABSCESS, BRAIN ABCESS, SSPE e ASPIRATION PNEUMONIA, SEPTIC ARTHRITIS/OLIGOARTICULAR (JIA), CP e PNEUMONIA, BLEEDING DISORDER SEC TO PLATELET FUNCTION DISORDER, BLEACH INGESTION TOXIC EFFECTS OF ALKALI, PETROLEUM INGESTION POISONING, CHOLERA, ALL/MUMPS, REACTIVE AIRWAY DISEASE, POST BURNS COMPLICATION/ANEMIC FAILURE?, SEPSIS e SEPTIC SHOCK, POST MEASLES e PNEUMONIA, POST MENINGITIS SEQUALE, ACUTE KIDNEY INJURY, PULMONARY TB, PYOGENIC MENINGITS, CHD e MYOCARDITIS, ROAD TRAFFIC ACCIDENT, RICKETS/DELAYED MILESTONES, RT SIDED EMPYEMA, BULBAR PALSY SEC TO HSV ENCEPHALITIS, RT SIDED PLURAL EFFUSION, RUPTIUD LIVER ABCESS, CHD CONGENITAL HEART DISEASE, SCID/PCM, SEPSIS/RT SIDED CELLULITIS, FAILURE TO THRIVE, HEPATIC FAILURE, CHRONIC LIVER DISEASE, HIV COMPLICATION, HIE III/MENINGITIS, HYDROCEPHLOUS/MENINGITIS?, K/C OF DOWN SYNDROME+CHD, K/C OF SEIZURE DISORDER, CHD e BRONCHOPNEUMONIA, ACUTE MYOCARDITIS, MYOCARDITIS/BRONCHOPNEUMONIA?, CLD?, GAUCHER DISEASE e PLEURAL EFFUSION, NEPHROTIC SYNDROME/CCF?, PROTEIN CALORIE MALNUTRITION/SEPSIS?, PERI ORBITAL CELLULTIS, PNEUMOTHORAX, POSTENIOR FOSSA MASS IN BRAIN, RHEMATIC HEART DISEASE, SEPSIS/SJS, STATUS ASTHMATICUS, JOUBERT SYNDROME?, LT EVENTRATION OF DIAPHRAM.'
-        return dept_text
-    elif dept == 'MEDICAL UNIT II':
-        dept_text = 'You’re on Medical Unit II, so the most likely Diagnosis should be among these : B 12 DEFICIENCY, ANEMIA, AFB TO GBS, AKI SEC TO AGE, ACUTE PANCREATITIS, AMOEBIC LIVER ABCESS, APLASTIC ANEMIA, ASPIRATION PNEUMONIA, ASTHAMA, AGE, BUDD CHAIR SYNDROME, CELLULITIS, CELLULITIS ON BOTH ARM, CHD E MEASLES E PNEUMONIA, CHD, CHIKEN POX, CHOLERA, BENZODIAZEPINE POISONING, APBPA/HIE, CELLULITIS OF RIGHT LEG & RIGHT FOREARM/BLEEDING DISORDER, CHD E PNEUMONIA, CHRONIC LIVER DISEASE, CKD, CKD GRADE 2, CKD/SLE, COMPLICATEDPNEUMONIA, CP CHILD, CP CHIL E PNEUMONIA, CP E SEIZURE DISORDER, DENGUE, DISSEMENATED TB, DOWN SYNDROME, DYSENTRY, EPILEPSY, ENCEPHALITIS, ENTERIC FEVER, FANCONE ANEMIA, FTT, FOOT GANGEROUS, FTT/SEPSIS, GASTROENTERITIS, GASTROENTERITIS BACTERIAL, HEMOLYTIC ANEMIA, HYPOCALEMIA, HEPATIC ENCEPHALOPATHY, HIE, HIV+BRONCHOPNEUMONIA, HSP, HYDROCEPHALOUS/MENINGITIS, HYPOCALEMIC FITS, HYPOCALEMIC PARALYSIS, HEMOPHILIA, K/C OF ALL, K/C OF AML, K/C OF CML, K/C OF RETINOBLASTOMA, K/C OF SSPE, LEFT SIDED CONGENITAL/DIAPHGMATIC HERBNIA/PNEUMONIA, LEFT SIDED EMPYEMA, LEFT SIDED PLUERAL EMPEYMA, LIVER ABSCESS/RIGHT PLUERAL EFFUSION, MALARIA, MENINGEOENCEPHALITIS, MENINGITIS, MYOCARDITIS, ORGANICPHOSPHARUS POISONING, PANCYTOPENIA, SUSP GLANZEMONN THROMBOSTHERIA, PME, PARASITIC TWIN/BED SORES GRADE 2, PCM, PCM/SEPSIS, PDA HIGH PRESSURE, PETRUSIS, PNEUMONIA, PHYORYGITIC, PLUERAL EMPYEMA, PLUERAL EFFUSION, MEASLES, MEASLES E PNEUMONIA, MEASLES COMPLICATED BY PNEUMONIA, MEASLES E COMPLICATION, POST MEASLES PNEUMONIA, POST MEASLES ENCEPHALITIS, PULMONARY HYPERTENSION, REACTIVE AIRWAY DISEASE, RDS, SEPSIS, SEPTIC SHOCK, SEVERE SEPSIS, SSPE, SNAKE BITE POISONING, RIGHT EMPYEMA 2 TO TB, RIGHT SIDED LOBAR PNEUMONIA, SAM (KWORSHIORKOR) E ACUTE GASTROENTERITIS, SICKLE THALESEMIA, SUSP DIPHTERIA, HLH, SEPTIC ARTHRITIS, SUSP ENTERIC, SUSP MENINGITIS, SUSP TESATOMA, SYNDROMIC, TB E PNEUMONIA, TB MENINGITIS, TB/URTI, TETANUS, TTP/MALARIA FALCIPARIM, TUBERCLOSIS, TUBERCLOSIS MENINGITIS, LEFT KNEE ARTHRITIS, UTI, CEREBRAL PALSY, SUSP CELIAC DISEASE, VIVAX MALARIA, SEIZURE DISORDER, VIRAL MENINGITIS, NON .'
-        return dept_text
-    elif dept == 'MEDICAL UNIT III':
-        dept_text = 'You’re on Medical Unit III, co the most likely Diagnosis should be among these : AUTOIMUE DISORDER, CHD, CHRONIC SUPPURATIVE OTITIS MEDIA, CYSTIC FIBROSIS, CONGENITAL HEART DISEASE (CYANOTIC), DIARRHEA, DISSOCIATED DISORDER, ENTERIC FEVER, EMPYEMA, ERYTHEMA MUITIFORME, EARLY ONSET SEPSIS, HYPOVOLUMIC SHOCK, HYPOXIC ISCHEMIC ENCEPHALOPATHY, ITP, LEUKEMIA, LOW GRADE GLIOMA, LYMPHOPROLIFERATIVE DISORDER, malabsorption syndrome, METABOLIC FITS, MEASLES/ PNEUMONIA, MENINGOENCEPHALITIS, MENINGIOMYELOCELE, MECONIUM ASPIRATION SYNDROME, MICROCEPHALY, NEUROGENIC BLADDER, NEONATAL JAUNDICE, pleural effusion, PNEUMONIA, PRE B ALL, RESPIRAYORY AIR DISEASE, sepsis/septic shock, snake poisoning, STEVEN JOHNSON SYNDROME, TBM, typhoid, TORCH infection, TETANUS, UTI'
-        return dept_text
-    elif dept == 'NICU':
-        dept_text = 'You work in the Neonatal ICU, so the most likely Diagnosis should be among these : LATE ONSET SEPSIS, RESPIRATORY DISTRESS SYNDROME, TRANSIENT TACHYPNEA OF NEW BORN, LBW'
-        return dept_text
-    elif dept == 'GASTRO':
-        dept_text = 'You work in the Gastroenterology Unit'
-        return dept_text
-    else:
-        dept_text = 'You work in pediatric oncology.'
-        return dept_text
+    return DEPARTMENT_GUIDANCE.get(department, DEFAULT_GUIDANCE)
 
 # — LLM setup —
-df_training = pd.read_csv(
-    'cleaned_unified_training_table.csv',
-    parse_dates=["MR_REG_DATE", "MR_DOB", "VISIT_DATE"]
+# Set TRAINING_MMAP to the prefix written by training_store.py to share one
+# memory-mapped copy of the training table across worker processes.
+TRAINING_MMAP = os.environ.get('TRAINING_MMAP')
+
+if TRAINING_MMAP:
+    training_table = MmapTrainingTable(TRAINING_MMAP, TRAINING_COLUMNS)
+else:
+    df_training = load_training_frame(TRAINING_COLUMNS + ['VISIT_DATE'])
+    training_table = FrameTrainingTable(df_training, TRAINING_COLUMNS)
+MODEL_NAME = "deepseek-r1:7b"
+# how long Ollama keeps the model (and its cached prompt prefixes) loaded
+LLM_KEEP_ALIVE = os.environ.get('LLM_KEEP_ALIVE', '30m')
+# LLM_BACKEND=ollama|llamacpp|fake micro-batches concurrent calls across
+# patients (see llm_batching); the default sends one OllamaLLM call each
+llm_batcher = batcher_from_env(MODEL_NAME)
+
+def make_llm(**options):
+    if llm_batcher is None:
+        return OllamaLLM(model=MODEL_NAME, keep_alive=LLM_KEEP_ALIVE, **options)
+    return BatchedLLM(llm_batcher, **options)
+
+# — Decode budgets —
+# deepseek-r1 reasons inside <think>...</think> before it answers; that text
+# is discarded but still decoded. Each section may decode think_tokens of
+# reasoning plus answer_tokens of answer (num_predict), and its answer ends
+# where a sixth ranked item would start. Reasoning past think_tokens is cut
+# off and the section asked again for the answer alone (see
+# llm_stream.decode). Override per section with e.g.
+# LLM_BUDGETS='{"diagnoses": [1536, 384]}' (think, answer).
+RANKED_STOP = ('\n6.', '\n6)', '\n**6.')
+SECTION_BUDGETS = {
+    'diagnoses':    SectionBudget(1024, 384, RANKED_STOP),
+    'lab_requests': SectionBudget(768, 256, RANKED_STOP),
+    'medications':  SectionBudget(768, 320, RANKED_STOP),
+}
+for _name, (_think, _answer) in json.loads(os.environ.get('LLM_BUDGETS', '{}')).items():
+    SECTION_BUDGETS[_name] = SectionBudget(int(_think), int(_answer), RANKED_STOP)
+# the combined prompt reasons once for all three lists
+COMBINED_BUDGET = SectionBudget(
+    max(b.think_tokens for b in SECTION_BUDGETS.values()),
+    sum(b.answer_tokens for b in SECTION_BUDGETS.values()),
 )
-llm = OllamaLLM(model="deepseek-r1:7b")
+# LLM_NO_THINK=1 asks the model not to reason at all (Ollama's `think: false`)
+LLM_NO_THINK = os.environ.get('LLM_NO_THINK', '0') == '1'
+_reasoning = {'reasoning': False} if LLM_NO_THINK else {}
+
+section_llms = {
+    name: make_llm(num_predict=budget.num_predict, **_reasoning) for name, budget in SECTION_BUDGETS.items()
+}
+# answer a section whose reasoning ran past its budget
+force_llms = {
+    name: make_llm(num_predict=budget.answer_tokens, stop=list(budget.stop), reasoning=False)
+    for name, budget in SECTION_BUDGETS.items()
+}
+# constrained to JSON output for the combined prompt
+llm_json = make_llm(format="json", num_predict=COMBINED_BUDGET.num_predict, **_reasoning)
+
+# 'sections' sends three prompts; 'combined' sends one prompt for all three
+# lists and falls back to 'sections' if its JSON does not validate.
+RECOMMEND_MODE = os.environ.get('RECOMMEND_MODE', 'sections')
+
+# finished recommendations, see recommend_cache.cache_from_env for settings
+recommend_cache = cache_from_env()
+# identical in-flight recommendations share one model generation
+recommend_flights = SingleFlight()
+
+# model calls from these departments are queued ahead of routine wards
+PRIORITY_DEPARTMENTS = {
+    d.strip() for d in os.environ.get('LLM_PRIORITY_DEPARTMENTS', 'SICU,NICU,ITU').split(',') if d.strip()
+}
+# seconds a recommendation may take, queueing included; requests may ask for less
+LLM_DEADLINE = float(os.environ.get('LLM_DEADLINE', '180'))
+
+def request_timeout(data: dict):
+    """The request's own `timeout` in seconds, or None; ValueError unless positive."""
+    if data.get('timeout') is None:
+        return None
+    try:
+        timeout = float(data['timeout'])
+    except (TypeError, ValueError):
+        raise ValueError("timeout must be a number of seconds") from None
+    if not timeout > 0:
+        raise ValueError("timeout must be positive")
+    return timeout
+
+def recommendation_ticket(department: str, timeout: float = None) -> Ticket:
+    priority = URGENT if department in PRIORITY_DEPARTMENTS else ROUTINE
+    timeout = LLM_DEADLINE if timeout is None else min(LLM_DEADLINE, max(1.0, timeout))
+    return Ticket(priority, timeout)
 
 SYSTEM_BASE = (
     "You are OPTIMUS, a personal healthcare assistant doctor. "
@@ -403,6 +486,7 @@ SYSTEM_BASE = (
     "If you are less than 80% sure, suggest something outside the list; otherwise stick to it."
 )
 
+@lru_cache(maxsize=None)
 def build_prompts(dept_text: str):
     system = SystemMessagePromptTemplate.from_template(SYSTEM_BASE.format(dept_text))
     diag = ChatPromptTemplate.from_messages([
@@ -425,16 +509,101 @@ def build_prompts(dept_text: str):
     ])
     return diag, lab, med
 
-def clean_response(text: str) -> str:
-    return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL).strip()
+COMBINED_INSTRUCTION = (
+    "For this patient only, recommend the TOP 5 possible DIAGNOSES, the TOP 5 LAB REQUESTS "
+    "and the TOP 5 MEDICATIONS, each ranked from most to least likely. "
+    "Answer with a single JSON object and nothing else, in exactly this shape:\n"
+    '{{"diagnoses": ["..."], "lab_requests": ["..."], "medications": ["..."]}}'
+    "\n\n{patient_data}"
+)
+
+@lru_cache(maxsize=None)
+def build_combined_prompt(dept_text: str):
+    system = SystemMessagePromptTemplate.from_template(SYSTEM_BASE.format(dept_text))
+    return ChatPromptTemplate.from_messages([
+        system,
+        HumanMessagePromptTemplate.from_template(COMBINED_INSTRUCTION)
+    ])
+
+def combined_messages(dept_text: str, patient_data_str: str):
+    return build_combined_prompt(dept_text).format_prompt(patient_data=patient_data_str).to_messages()
+
+def invoke_combined(messages, ticket: Ticket):
+    """One prompt for all three lists; None if the answer fails validation."""
+    ticket.tokens['combined'] = new_usage()
+    run = lambda: ''.join(decode(llm_json, messages, ticket.tokens['combined'], COMBINED_BUDGET))
+    try:
+        raw = ticket.result(LLM_POOL.submit(run, ticket=ticket))
+        sections = parse_combined_response(raw)
+    except (InvalidModelOutput, UnfinishedReasoning) as e:
+        app.logger.warning("Combined recommendation rejected (%s); using per-section prompts", e)
+        return None
+    return {name: format_ranked(items) for name, items in sections.items()}
+
+# — Department prompt prefixes —
+# LLM_WARM=1 prefills the urgent wards' (PRIORITY_DEPARTMENTS) shared prompt
+# prefix on the model server at startup. Ollama and llama.cpp keep the KV
+# cache of the last prompt in each parallel slot, and a new prompt reuses it
+# as far as they share a prefix; so only as many prefixes as the server has
+# slots survive, and only until live requests take those slots. Off by
+# default. One process per host warms (LLM_WARM_MARKER records when); the
+# other workers skip it for LLM_WARM_FRESH seconds.
+LLM_WARM = os.environ.get('LLM_WARM', '0') == '1'
+LLM_WARM_MARKER = os.environ.get('LLM_WARM_MARKER', os.path.join(tempfile.gettempdir(), 'optimus-prompt-warm'))
+LLM_WARM_FRESH = float(os.environ.get('LLM_WARM_FRESH', '600'))
+
+def department_prefix(dept_text: str, render=render_prompt) -> str:
+    """Rendered text every section prompt of the department starts with."""
+    diag_p, lab_p, med_p = build_prompts(dept_text)
+    rendered = [render(p.format_prompt(patient_data='').to_messages()) for p in (diag_p, lab_p, med_p)]
+    return os.path.commonprefix(rendered)
+
+def claim_warm_up(marker: str, fresh: float) -> bool:
+    """True for the one process that should warm: none has within `fresh` seconds."""
+    try:
+        f = open(marker, 'a+')
+    except OSError:
+        return True
+    with f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        try:
+            if time.time() - float(f.read().strip()) < fresh:
+                return False
+        except ValueError:
+            pass
+        f.seek(0)
+        f.truncate()
+        f.write(str(time.time()))
+        return True
+
+def warm_department_prompts(backend):
+    """Prefill each urgent ward's prompt prefix on the model server once."""
+    texts = list(dict.fromkeys(DEPARTMENT_GUIDANCE[d] for d in PRIORITY_DEPARTMENTS if d in DEPARTMENT_GUIDANCE))
+    started = time.perf_counter()
+    try:
+        for text in texts:
+            backend.warm(department_prefix(text, backend.render))
+        app.logger.info("Warmed %d department prompt prefixes in %.1fs", len(texts), time.perf_counter() - started)
+    except Exception as e:
+        app.logger.warning("Prompt prefix warm-up failed: %s", e)
+
+# every department's templates are compiled once, up front
+for _dept_text in [*DEPARTMENT_GUIDANCE.values(), DEFAULT_GUIDANCE]:
+    build_prompts(_dept_text)
+    build_combined_prompt(_dept_text)
+
+if LLM_WARM and claim_warm_up(LLM_WARM_MARKER, LLM_WARM_FRESH):
+    _warm_backend = llm_batcher.backend if llm_batcher is not None else OllamaBackend(
+        MODEL_NAME, os.environ.get('LLM_BACKEND_URL', 'http://localhost:11434'), keep_alive=LLM_KEEP_ALIVE
+    )
+    threading.Thread(target=warm_department_prompts, args=(_warm_backend,),
+                     name='prompt-warm', daemon=True).start()
 
 def fetch_training_records(mr_code: str, visit_date: str) -> list:
     visit_dt = parse_visit_date(visit_date)
-    sub = df_training[
-        (df_training['MR_CODE'].astype(str) == str(mr_code)) &
-        (df_training['VISIT_DATE'].dt.date == visit_dt)
-    ]
-    return sub[['MR_CODE', 'MR_SEX', 'AGE_AT_VISIT', 'PRESENTING_COMPLAIN']].to_dict(orient='records')
+    return training_table.lookup(str(mr_code), visit_dt)
 
 
 
@@ -444,18 +613,30 @@ def fetch_training_records(mr_code: str, visit_date: str) -> list:
 @app.route('/add_user', methods=['POST'])
 def add_user():
     data = request.json
-    result = asyncio.run(add_user_async(
+    result = cosmos.run(add_user_async(
         data.get('name'), data.get('password'), data.get('email'),
         data.get('role', 'user'), data.get('department', 'General')
     ))
     return jsonify(result)
 
+@app.route('/add_users', methods=['POST'])
+def add_users():
+    users = (request.json or {}).get('users')
+    if not isinstance(users, list) or not users or not all(isinstance(u, dict) for u in users):
+        return jsonify({"status": "failure", "message": "users must be a non-empty list"}), 400
+    if len(users) > BULK_IMPORT_LIMIT:
+        return jsonify({"status": "failure", "message": f"At most {BULK_IMPORT_LIMIT} users per import"}), 400
+    result = cosmos.run(add_users_async(users))
+    return jsonify(result), 200 if result.get('status') == 'success' else 500
+
 @app.route('/validate_user', methods=['POST'])
 def validate_user():
     data = request.json
-    result = asyncio.run(validate_user_async(data.get('password'), data.get('email')))
+    result = cosmos.run(validate_user_async(data.get('password'), data.get('email')))
     if result and result.get('userid'):
-        return jsonify({"status": "success", "user": result})
+        token = sessions.issue(result)
+        # the app keeps the user map and sends its token back to /recommend
+        return jsonify({"status": "success", "user": {**result, "token": token}, "token": token})
     return jsonify({"status": "failure", "message": "Invalid credentials"}), 401
 
 @app.route('/delete_user', methods=['DELETE'])
@@ -463,40 +644,136 @@ def delete_user():
     data = request.json
     if not data.get('user_id'):
         return jsonify({"status": "failure", "message": "user_id is required"}), 400
-    result = asyncio.run(delete_user_async(data['user_id']))
+    result = cosmos.run(delete_user_async(data['user_id']))
+    if result.get('status') == 'success':
+        sessions.revoke_user(data['user_id'])
     status = 200 if result.get('status') == 'success' else 404
     return jsonify(result), status
 
+def session_user(token: str):
+    """User for a session token: cached, else one point read; None if invalid."""
+    claims = sessions.verify(token)
+    if claims is None:
+        return None
+    user = sessions.get(claims)
+    if user is None:
+        item = cosmos.run(read_user_async(claims['uid']))
+        if item is None:
+            return None
+        user = user_view(item)
+        sessions.remember(claims, user)
+    return user
+
+def request_token(data: dict):
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        return auth[len('Bearer '):].strip()
+    user = data.get('user')
+    return data.get('token') or (user.get('token') if isinstance(user, dict) else None)
+
+def recommendation_context(data: dict):
+    """Authenticate and gather (dept_text, patient_data) and the scheduling
+    ticket, or return an error response."""
+    try:
+        timeout = request_timeout(data)
+    except ValueError as e:
+        return None, None, (jsonify({'status': 'failure', 'message': str(e)}), 400)
+    token = request_token(data)
+    if token:
+        user = session_user(token)
+        if not user:
+            return None, None, (jsonify({'status': 'failure', 'message': 'Session expired or invalid'}), 401)
+    else:
+        # a client-built `user` map is no longer trusted: send the token from
+        # /validate_user, or email and password to be checked again
+        if isinstance(data.get('user'), dict) and not data.get('email'):
+            app.logger.warning("Rejected /recommend with a user map but no session token")
+            return None, None, (jsonify({'status': 'failure', 'message': 'Session token required'}), 401)
+        user = cosmos.run(validate_user_async(data.get('password', ''), data.get('email', '')))
+    if not user or not user.get('userid'):
+        return None, None, (jsonify({'status': 'failure', 'message': 'Invalid credentials'}), 401)
+
+    # patient data
+    records = fetch_training_records(data.get('mr_code', ''), data.get('visit_date', ''))
+    patient_data_str = json.dumps(records, default=str, indent=2)
+    department = user.get('department', '')
+    return (get_dept_text(department), patient_data_str), recommendation_ticket(department, timeout), None
+
+def section_prompts(dept_text: str, patient_data_str: str) -> dict:
+    diag_p, lab_p, med_p = build_prompts(dept_text)
+    return {
+        'diagnoses':    diag_p.format_prompt(patient_data=patient_data_str).to_messages(),
+        'lab_requests': lab_p.format_prompt(patient_data=patient_data_str).to_messages(),
+        'medications':  med_p.format_prompt(patient_data=patient_data_str).to_messages(),
+    }
+
+def run_sections(prompts: dict, ticket: Ticket) -> dict:
+    return invoke_sections(section_llms, prompts, ticket, SECTION_BUDGETS, force_llms)
+
+def log_decoded(ticket: Ticket):
+    """Log a request's decoded tokens per prompt, to tune SECTION_BUDGETS."""
+    if ticket.tokens:
+        total = sum(usage['tokens'] for usage in ticket.tokens.values())
+        app.logger.info("Decoded %d tokens: %s", total, json.dumps(ticket.tokens))
+
+def recommendation_job(context, mode: str, ticket: Ticket):
+    """Cache key and a zero-argument function producing the three sections."""
+    prompts = section_prompts(*context)
+    if mode != 'combined':
+        # the three sections run concurrently on the LLM scheduler
+        return prompt_key(MODEL_NAME, prompts), lambda: run_sections(prompts, ticket)
+
+    combined = combined_messages(*context)
+    def run():
+        return invoke_combined(combined, ticket) or run_sections(prompts, ticket)
+    return prompt_key(MODEL_NAME, {'combined': combined}), run
+
+def cached_sections(key: str, run, ticket: Ticket, refresh: bool = False):
+    """Return (sections, cached); `refresh` skips the lookup but stores the result.
+
+    Concurrent misses for the same key share one generation; a request
+    waiting on another's gives up at its own deadline (DeadlineExceeded).
+    """
+    if recommend_cache is not None and not refresh:
+        sections = recommend_cache.get(key)
+        if sections is not None:
+            return sections, True
+
+    def generate():
+        sections = run()
+        if recommend_cache is not None:
+            recommend_cache.put(key, sections)
+        return sections
+
+    sections, _ = recommend_flights.do(key, generate, wait=ticket.result)
+    return sections, False
+
+def queue_headers(ticket: Ticket) -> dict:
+    if ticket.queue_depth is None:
+        return {}
+    return {'X-Queue-Depth': str(ticket.queue_depth), 'X-Queue-Wait-Ms': str(round(ticket.wait * 1000))}
+
+def busy_response(e: QueueFull):
+    body = {'status': 'busy', 'message': str(e), 'retry_after': e.retry_after, 'queue': LLM_POOL.stats()}
+    return jsonify(body), 429, {'Retry-After': str(e.retry_after)}
+
 @app.route('/recommend', methods=['POST'])
 def recommend_route():
     data = request.json or {}
-    print(data)
+    # the body carries the session token and the client's user map: log neither
+    app.logger.debug("Recommend request: mr_code=%s visit_date=%s", data.get('mr_code'), data.get('visit_date'))
     try:
-        # authenticate
-        user = data.get('user')
-        if not (isinstance(user, dict) and user.get('userid')):
-            user = asyncio.run(validate_user_async(data.get('password', ''), data.get('email', '')))
-        if not user:
-            return jsonify({'status': 'failure', 'message': 'Invalid credentials'}), 401
-
-        # patient data
-        records = fetch_training_records(data.get('mr_code', ''), data.get('visit_date', ''))
-        patient_data_str = json.dumps(records, default=str, indent=2)
+        context, ticket, error = recommendation_context(data)
+        if error:
+            return error
 
-        # build and call LLM prompts
-        dept_text      = get_dept_text(user.get('department', ''))
-        diag_p, lab_p, med_p = build_prompts(dept_text)
+        key, run = recommendation_job(context, data.get('mode', RECOMMEND_MODE), ticket)
+        sections, cached = cached_sections(key, run, ticket, refresh=bool(data.get('refresh')))
+        log_decoded(ticket)
 
-        diagnoses    = clean_response(llm.invoke(diag_p.format_prompt(patient_data=patient_data_str).to_messages()))
-        lab_requests = clean_response(llm.invoke(lab_p.format_prompt(patient_data=patient_data_str).to_messages()))
-        medications  = clean_response(llm.invoke(med_p.format_prompt(patient_data=patient_data_str).to_messages()))
-
-        result = {
-            'status':       'success',
-            'diagnoses':    diagnoses,
-            'lab_requests': lab_requests,
-            'medications':  medications
-        }
+        result = {'status': 'success', **sections, 'cached': cached}
+        if ticket.queue_depth is not None:
+            result['queue'] = ticket.info()
         payload = [result]
 
         # This will always produce a correct JSON array
@@ -506,12 +783,124 @@ def recommend_route():
         return Response(
             response=body,
             status=200,
-            mimetype='application/json'
+            mimetype='application/json',
+            headers=queue_headers(ticket)
         )
+    except QueueFull as e:
+        return busy_response(e)
+    except DeadlineExceeded as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 504
     except Exception as e:
         traceback.print_exc()
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+def sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+@app.route('/recommend/stream', methods=['POST'])
+def recommend_stream_route():
+    """Server-sent events: `delta` chunks, one `section` per finished
+    section (in completion order), then `done`. An `error` event without a
+    section failed the whole request; `done` then has status 'error' and
+    lists the `failed` sections."""
+    data = request.json or {}
+    try:
+        context, ticket, error = recommendation_context(data)
+        if error:
+            return error
+        prompts = section_prompts(*context)
+        key = prompt_key(MODEL_NAME, prompts)
+        refresh = bool(data.get('refresh'))
+        cached = None
+        if recommend_cache is not None and not refresh:
+            cached = recommend_cache.get(key)
+        if cached is None:
+            # reject before the stream starts; a race past this check ends in an error event
+            LLM_POOL.check(len(prompts), ticket.priority)
+    except QueueFull as e:
+        return busy_response(e)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    def done(finished, cached=False, **extra):
+        # sections without an answer failed, whether alone or with the whole request
+        failed = [name for name in prompts if name not in finished]
+        status = {'status': 'error', 'failed': failed} if failed else {'status': 'success'}
+        return sse('done', {**status, 'cached': cached, **extra})
+
+    def replay(sections, cached):
+        for section, text in sections.items():
+            yield sse('section', {'section': section, 'text': text})
+        yield done(sections, cached)
+
+    def generate():
+        if cached is not None:
+            yield from replay(cached, True)
+            return
+
+        flight, leader = recommend_flights.begin(key)
+        if not leader:
+            # same visit already generating: wait for it (until our deadline) instead of re-running
+            try:
+                sections = ticket.result(flight)
+            except Exception as e:
+                yield sse('error', {'section': None, 'text': str(e)})
+                yield done({})
+                return
+            yield from replay(sections, False)
+            return
+
+        finished, errors = {}, []
+        try:
+            for kind, section, text in stream_sections(section_llms, prompts, ticket, SECTION_BUDGETS, force_llms):
+                if kind == 'section':
+                    finished[section] = text
+                elif kind == 'error':
+                    errors.append(f"{section}: {text}")
+                yield sse(kind, {'section': section, 'text': text})
+        except QueueFull as e:
+            errors.append(str(e))
+            yield sse('error', {'section': None, 'text': str(e), 'retry_after': e.retry_after})
+        except DeadlineExceeded as e:
+            errors.append(str(e))
+            yield sse('error', {'section': None, 'text': str(e)})
+        finally:
+            if errors or len(finished) < len(prompts):
+                recommend_flights.finish(key, error=RuntimeError('; '.join(errors) or 'stream aborted'))
+            else:
+                sections = {name: finished[name] for name in prompts}
+                if recommend_cache is not None:
+                    recommend_cache.put(key, sections)
+                recommend_flights.finish(key, sections)
+            log_decoded(ticket)
+        yield done(finished, queue=ticket.info())
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/recommend/queue', methods=['GET'])
+def recommend_queue_route():
+    stats = LLM_POOL.stats()
+    if llm_batcher is not None:
+        stats['batching'] = llm_batcher.stats()
+    return jsonify(stats)
+
+@app.route('/recommend/cache_stats', methods=['GET'])
+def recommend_cache_stats_route():
+    flights = {
+        'in_flight': recommend_flights.in_flight(),
+        'generations': recommend_flights.leaders,
+        'coalesced': recommend_flights.followers,
+    }
+    if recommend_cache is None:
+        return jsonify({'enabled': False, 'single_flight': flights})
+    return jsonify({'enabled': True, **recommend_cache.stats(), 'single_flight': flights})
+
 
 @app.route('/registration_records', methods=['GET'])
 def registration_records_route():
@@ -574,6 +963,28 @@ def medication_records_route():
         return jsonify(error="No records found."), 404
     return jsonify(records)
 
+@app.route('/<panel>/batch', methods=['POST'])
+def batch_records_route(panel):
+    if panel not in BATCH_ROUTES:
+        return jsonify(error=f"Unknown record route: {panel}"), 404
+    items = (request.json or {}).get('keys')
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        return jsonify(error="keys must be a list of {mr_code, visit_date} objects."), 400
+    if len(items) > MAX_BATCH_KEYS:
+        return jsonify(error=f"At most {MAX_BATCH_KEYS} keys per batch."), 400
+    return jsonify(BATCH_ROUTES[panel](items))
+
+@app.route('/visit_summary', methods=['GET'])
+def visit_summary_route():
+    mr_code = request.args.get('mr_code', '').strip()
+    visit_date = request.args.get('visit_date', '').strip()
+    summary = get_visit_summary(mr_code, visit_date)
+    if summary is None:
+        return jsonify(error="Invalid visit_date."), 400
+    if not any(summary.values()):
+        return jsonify(error="No records found."), 404
+    return jsonify(summary)
+
 
 
 
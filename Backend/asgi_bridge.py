@@ -0,0 +1,177 @@
+"""Serve a WSGI app over ASGI with a bounded thread pool per route class.
+
+The event loop only accepts connections and moves bytes. Each request
+runs the WSGI app on the pool its path maps to, so slow routes (model
+calls) can only occupy their own pool's threads. Requests beyond a pool's
+size wait on the loop without holding a thread; the other pools keep
+serving. Streaming responses are read one chunk per pool call, in the
+same contextvars context each time.
+"""
+import io
+import sys
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+
+
+def wsgi_environ(scope: dict, body: bytes) -> dict:
+    """PEP 3333 environ for an ASGI http scope and its complete body."""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    if body and 'CONTENT_LENGTH' not in environ:
+        environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+class PoolStats:
+    """Requests running on and waiting for one pool."""
+
+    def __init__(self):
+        self.running = 0
+        self.waiting = 0
+        self.served = 0
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'running': self.running, 'waiting': self.waiting, 'served': self.served}
+
+
+class PooledWSGI:
+    """ASGI app running `wsgi_app` on the pool `route_pool(path)` names.
+
+    `pools` maps a pool name to its thread count. `route_pool(path)` returns
+    a pool name, or None for `default`.
+    """
+
+    def __init__(self, wsgi_app, pools: dict, route_pool=None, default: str = None):
+        self.wsgi_app = wsgi_app
+        self.route_pool = route_pool or (lambda path: None)
+        self.default = default or next(iter(pools))
+        self.sizes = dict(pools)
+        self.pools = {
+            name: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f'asgi-{name}')
+            for name, size in pools.items()
+        }
+        # a pool runs at most `size` requests; the rest wait here, not in a thread
+        self._slots = {name: asyncio.Semaphore(size) for name, size in pools.items()}
+        self.stats = {name: PoolStats() for name in pools}
+
+    def pool_for(self, path: str) -> str:
+        return self.route_pool(path) or self.default
+
+    def pool_stats(self) -> dict:
+        return {name: {'threads': self.sizes[name], **s.snapshot()} for name, s in self.stats.items()}
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+
+        name = self.pool_for(scope['path'])
+        stats = self.stats[name]
+        with stats._lock:
+            stats.waiting += 1
+        async with self._slots[name]:
+            with stats._lock:
+                stats.waiting -= 1
+                stats.running += 1
+            try:
+                await self._respond(self.pools[name], wsgi_environ(scope, b''.join(body)), send)
+            finally:
+                with stats._lock:
+                    stats.running -= 1
+                    stats.served += 1
+
+    async def _respond(self, pool, environ, send):
+        loop = asyncio.get_running_loop()
+        # every call for this response runs in one context, whichever thread
+        # takes it, so a generator's context managers (stream_with_context) hold
+        context = contextvars.copy_context()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return write
+
+        def write(data):
+            raise NotImplementedError("the WSGI write() callable is not supported")
+
+        def first_chunk():
+            result = self.wsgi_app(environ, start_response)
+            chunks = iter(result)
+            return result, chunks, next(chunks, _DONE)
+
+        result, chunks, chunk = await loop.run_in_executor(pool, context.run, first_chunk)
+        try:
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': started['headers']})
+            while chunk is not _DONE:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(pool, context.run, next, chunks, _DONE)
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            # runs stream_with_context's cleanup, also when the client went away
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(pool, context.run, result.close)
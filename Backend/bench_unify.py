@@ -0,0 +1,224 @@
+"""Benchmark the unification pipeline against the original row-wise script.
+
+    python bench_unify.py --patients 20000            # synthetic tables
+    python bench_unify.py --data /path/to/csvs        # real source CSVs
+
+Loads the sources once, times the previous implementation
+(`legacy_unify`, kept verbatim below) against the vectorized `main.unify`
+on them (and `main.unify_parallel` with `--workers`), times the
+partitioned `main.build_chunked` end to end, and checks every variant
+writes a byte-identical CSV.
+"""
+import os
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+
+import pandas as pd
+
+import main
+
+
+# — Previous implementation —
+
+def legacy_unify(reg, pres, vitals, diag, lr, lres, med):
+    df = (
+        pres.merge(reg, on='MR_CODE', how='left')
+            .rename(columns={'MR_VISIT_DATE': 'VISIT_DATE'})
+    )
+    df['AGE_AT_VISIT'] = ((df['VISIT_DATE'] - df['MR_DOB']).dt.days / 365.25).round(1)
+
+    vitals = vitals.rename(columns=main.VITALS_RENAME)
+    df = df.merge(
+        vitals[['MR_CODE','VISIT_DATE',
+                'BP_SYSTOLIC','BP_DIASTOLIC','TEMP','PULSE',
+                'RESP_RATE','HEIGHT','WEIGHT','O2_SAT','PAIN_SCORE']],
+        on=['MR_CODE','VISIT_DATE'], how='left'
+    )
+
+    diag = diag.rename(columns={'MR_VISIT_DATE':'VISIT_DATE'})
+    df = df.merge(
+        diag[['MR_CODE','VISIT_DATE',
+              'MED_REC_DIAG','MED_REC_FIAN_DIAG',
+              'MED_REC_SUM_REMARKS','MED_REC_NEXT_PLN_CODE']],
+        on=['MR_CODE','VISIT_DATE'], how='left'
+    ).rename(columns=main.DIAG_RENAME)
+
+    lr_group = (
+        lr
+        .groupby(['MR_CODE','MR_VISIT_DATE'])['LAB_TEST']
+        .agg(lambda x: '; '.join(x.dropna().astype(str)))
+        .reset_index()
+        .rename(columns={'MR_VISIT_DATE':'VISIT_DATE',
+                         'LAB_TEST':'LAB_REQUESTS'})
+    )
+
+    lres_comb = (
+        lr.merge(lres, on='LRS_NO', how='left', suffixes=('_REQ','_RES'))
+          .assign(LAB_TEST_REQ=lambda d: d['LAB_TEST_REQ'].astype(str))
+    )
+    lres_comb['RESULT_STR'] = lres_comb.apply(
+        lambda row: f"{row['LAB_TEST_REQ']}:{row['PARAMETER']}={row['RESULT']}"
+                    if pd.notna(row['PARAMETER']) and pd.notna(row['RESULT'])
+                    else None,
+        axis=1
+    )
+    lres_group = (
+        lres_comb
+        .groupby(['MR_CODE','MR_VISIT_DATE'])['RESULT_STR']
+        .agg(lambda x: '; '.join(x.dropna().astype(str)))
+        .reset_index()
+        .rename(columns={'MR_VISIT_DATE':'VISIT_DATE',
+                         'RESULT_STR':'LAB_RESULTS'})
+    )
+
+    df = df.merge(lr_group, on=['MR_CODE','VISIT_DATE'], how='left')
+    df = df.merge(lres_group, on=['MR_CODE','VISIT_DATE'], how='left')
+
+    med = med.copy()
+    med['MR_REG_DT_TIME'] = pd.to_datetime(med['MR_REG_DT_TIME'], errors='coerce')
+    med['VISIT_DATE']     = med['MR_REG_DT_TIME'].dt.floor('d')
+
+    def format_med(group):
+        return '; '.join(
+            f"{row['ITEM_NAME']}|{row['DOSAGE']}|{row['INT_CODE']}"
+            for _, row in group.iterrows()
+            if pd.notna(row['ITEM_NAME'])
+        )
+
+    med_series = (
+        med
+        .groupby(['MR_CODE','VISIT_DATE'])[['ITEM_NAME','DOSAGE','INT_CODE']]
+        .apply(format_med)
+    )
+    med_group = med_series.to_frame('MEDICATIONS').reset_index()
+
+    df['VISIT_DATE']       = pd.to_datetime(df['VISIT_DATE'])
+    med_group['VISIT_DATE'] = pd.to_datetime(med_group['VISIT_DATE'])
+    df = df.merge(med_group, on=['MR_CODE','VISIT_DATE'], how='left')
+
+    return df[main.FINAL_COLS]
+
+
+# — Synthetic source tables —
+
+def write_synthetic(folder, patients, seed=0):
+    rng = random.Random(seed)
+    days = pd.date_range('2022-01-01', periods=700, freq='D')
+    tests = ['CBC', 'LFT', 'RFT', 'ESR', 'CRP', 'TSH']
+    drugs = ['PARACETAMOL', 'AMOXICILLIN', 'IBUPROFEN', 'ORS', 'CEFIXIME']
+
+    reg, pres, vitals, diag, lr, lres, med = ([] for _ in range(7))
+    lrs_no = 0
+    for i in range(patients):
+        code = 100000 + i
+        reg.append([code, '1/1/2020', rng.choice('MF'), f'{rng.randint(1, 12)}/1/{rng.randint(2005, 2021)}'])
+        for day in rng.sample(list(days), rng.randint(1, 4)):
+            stamp = f'{day.month}/{day.day}/{day.year} 12:00:00 AM'
+            pres.append([code, stamp, 'fever', f'{rng.randint(1, 7)} days'])
+            if rng.random() < 0.8:
+                vitals.append([code, stamp, stamp, rng.randint(90, 140), rng.randint(60, 90),
+                               round(rng.uniform(36, 40), 1), rng.randint(60, 140), rng.randint(12, 40),
+                               rng.randint(50, 180), rng.randint(3, 90), rng.randint(88, 100),
+                               rng.randint(0, 10)])
+            if rng.random() < 0.9:
+                diag.append([code, stamp, stamp, f'DX{rng.randint(1, 300)}', f'FDX{rng.randint(1, 300)}',
+                             'remarks', rng.choice(['NP1', 'NP2', ''])])
+            for test in rng.sample(tests, rng.randint(0, 3)):
+                lrs_no += 1
+                lr.append([code, stamp, lrs_no, test])
+                for param in ('HB', 'WBC')[:rng.randint(0, 2)]:
+                    lres.append([lrs_no, f'{day.month}/{day.day}/{day.year} 1:00:00 PM',
+                                 param, round(rng.uniform(1, 20), 2), test])
+            for drug in rng.sample(drugs, rng.randint(0, 2)):
+                med.append([code, stamp, f'{day.month}/{day.day}/{day.year} 9:00:00 AM',
+                            drug, rng.choice(['5ml', '250mg', '']), rng.randint(1, 3)])
+
+    # blanks only in the last row: a chunked read sees these columns as int
+    # in every block but the last, the whole-table read as float throughout
+    for row in vitals[-1:]:
+        row[-1] = ''
+    for row in med[-1:]:
+        row[-1] = ''
+
+    tables = {
+        "mr_registiration.csv": (['MR_CODE', 'MR_REG_DATE', 'MR_SEX', 'MR_DOB'], reg),
+        "presinting_complain.csv": (['MR_CODE', 'MR_VISIT_DATE', 'PRESENTING_COMPLAIN', 'PRE_COM_DURATION'], pres),
+        "vitals.csv": (['MR_CODE', 'MR_VISITDATE', 'VITAL_DATE', 'VITAL_BP_SIS', 'VITAL_DYS', 'VITAL_TEMP',
+                        'VITAL_PULSE', 'VITAL_RES_RATE', 'VITAL_HEIGHT', 'VITAL_WEIGHT', 'VITAL_O2_SAT',
+                        'VITAL_PAIN'], vitals),
+        "Diagnosis.csv": (['MR_CODE', 'MR_VISIT_DATE', 'MR_DATE_TIME', 'MED_REC_DIAG', 'MED_REC_FIAN_DIAG',
+                           'MED_REC_SUM_REMARKS', 'MED_REC_NEXT_PLN_CODE'], diag),
+        "lab_request.csv": (['MR_CODE', 'MR_VISIT_DATE', 'LRS_NO', 'LAB_TEST'], lr),
+        "LAB_RRESULT_ENTERY.csv": (['LRS_NO', 'INSERT_DT', 'PARAMETER', 'RESULT', 'LAB_TEST'], lres),
+        "medication.csv": (['MR_CODE', 'INSERT_DT', 'MR_REG_DT_TIME', 'ITEM_NAME', 'DOSAGE', 'INT_CODE'], med),
+    }
+    for filename, (columns, rows) in tables.items():
+        pd.DataFrame(rows, columns=columns).to_csv(os.path.join(folder, filename), index=False)
+
+
+# — Runner —
+
+def timed(label, fn, out_path):
+    start = time.perf_counter()
+    df = fn()
+    elapsed = time.perf_counter() - start
+    df.to_csv(out_path, index=False)
+    with open(out_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    print(f"{label:<12} {elapsed:8.2f}s  rows={len(df):<9} sha256={digest[:16]}")
+    return elapsed, digest
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', help='folder with the source CSVs (default: synthetic)')
+    parser.add_argument('--patients', type=int, default=20_000)
+    parser.add_argument('--chunks', type=int, default=8)
+    parser.add_argument('--chunksize', type=int, default=50_000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='also time main.unify_parallel with this many processes')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench-unify-') as scratch:
+        data = args.data
+        if data is None:
+            data = scratch
+            write_synthetic(data, args.patients)
+        os.chdir(data)
+
+        start = time.perf_counter()
+        sources = main.load_sources()
+        print(f"{'load':<12} {time.perf_counter() - start:8.2f}s")
+        legacy_sources = dict(sources)
+        legacy_sources['presenting_complain'] = sources['presenting_complain'].drop(columns=main.ROW)
+
+        results = {
+            'legacy': timed('legacy', lambda: legacy_unify(*legacy_sources.values()),
+                            os.path.join(scratch, 'legacy.csv')),
+            'vectorized': timed('vectorized', lambda: main.finish([main.unify(sources)]),
+                                os.path.join(scratch, 'vectorized.csv')),
+            'chunked': timed('chunked*', lambda: main.build(args.chunks, args.chunksize, scratch),
+                             os.path.join(scratch, 'chunked.csv')),
+        }
+        if args.workers > 1:
+            partitions = main.split_sources(sources, args.workers * main.PARTITIONS_PER_WORKER)
+            results['parallel'] = timed(
+                f'{args.workers} workers', lambda: main.finish(main.unify_parallel(partitions, args.workers)),
+                os.path.join(scratch, 'parallel.csv')
+            )
+        print("(* includes reading and partitioning the sources)")
+
+    base, digest = results['legacy']
+    for label, (elapsed, other) in results.items():
+        if label != 'legacy':
+            same = 'identical' if other == digest else 'DIFFERENT'
+            print(f"{label}: {base / elapsed:.1f}x vs legacy, output {same}")
+    if any(d != digest for _, d in results.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main_bench()
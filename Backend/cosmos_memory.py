@@ -0,0 +1,122 @@
+"""In-memory stand-in for an async Cosmos DB container.
+
+Implements the subset of `azure.cosmos.aio.ContainerProxy` the user
+routes use, so they can run locally and in tests without an account:
+
+    pool = ContainerPool(container=InMemoryContainer())
+
+Queries support `SELECT * | c.a, c.b FROM c [WHERE <clause> AND ...]`,
+where a clause is `c.x = @p`, `[NOT] IS_DEFINED(c.x)`, or a parenthesised
+OR of those.
+"""
+import re
+import copy
+import uuid
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+SELECT_RE = re.compile(
+    r'^\s*SELECT\s+(?P<fields>.+?)\s+FROM\s+c(?:\s+WHERE\s+(?P<where>.+?))?\s*$',
+    re.IGNORECASE | re.DOTALL
+)
+CONDITION_RE = re.compile(r'^\s*c\.(\w+)\s*=\s*(@\w+)\s*$')
+DEFINED_RE = re.compile(r'^\s*(NOT\s+)?IS_DEFINED\(\s*c\.(\w+)\s*\)\s*$', re.IGNORECASE)
+
+
+def not_found(item_id):
+    return exceptions.CosmosResourceNotFoundError(
+        status_code=404, message=f"Entity with the specified id {item_id} does not exist."
+    )
+
+
+class InMemoryContainer:
+    def __init__(self, items=None):
+        self._items = {}
+        for item in items or []:
+            self._store(dict(item))
+
+    def _store(self, item):
+        item['_etag'] = uuid.uuid4().hex
+        self._items[item['id']] = item
+        return copy.deepcopy(item)
+
+    async def upsert_item(self, body, **kwargs):
+        return self._store(copy.deepcopy(body))
+
+    async def create_item(self, body, **kwargs):
+        if body['id'] in self._items:
+            raise exceptions.CosmosResourceExistsError(
+                status_code=409, message=f"Entity with the specified id {body['id']} already exists."
+            )
+        return self._store(copy.deepcopy(body))
+
+    async def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        item_id = item if isinstance(item, str) else item['id']
+        if item_id not in self._items:
+            raise not_found(item_id)
+        if match_condition == MatchConditions.IfNotModified and self._items[item_id]['_etag'] != etag:
+            raise exceptions.CosmosAccessConditionFailedError(
+                status_code=412, message="Operation cannot be performed because one of the specified precondition is not met."
+            )
+        return self._store(copy.deepcopy(body))
+
+    async def read_item(self, item, partition_key, **kwargs):
+        if item not in self._items:
+            raise not_found(item)
+        return copy.deepcopy(self._items[item])
+
+    async def delete_item(self, item, partition_key, **kwargs):
+        if item not in self._items:
+            raise not_found(item)
+        del self._items[item]
+
+    def query_items(self, query, parameters=None, partition_key=None, **kwargs):
+        match = SELECT_RE.match(query)
+        if not match:
+            raise ValueError(f"Unsupported query for InMemoryContainer: {query}")
+        values = {p['name']: p['value'] for p in parameters or []}
+        conditions = []
+        if match.group('where'):
+            for clause in re.split(r'\s+AND\s+', match.group('where'), flags=re.IGNORECASE):
+                clause = clause.strip()
+                if clause.startswith('(') and clause.endswith(')'):
+                    clause = clause[1:-1]
+                terms = re.split(r'\s+OR\s+', clause, flags=re.IGNORECASE)
+                conditions.append([_term(term, values) for term in terms])
+
+        fields = match.group('fields').strip()
+        projection = None if fields == '*' else [f.strip()[2:] for f in fields.split(',')]
+        rows = [
+            copy.deepcopy(item) for item in list(self._items.values())
+            if all(any(test(item) for test in terms) for terms in conditions)
+        ]
+        if projection is not None:
+            rows = [{f: row[f] for f in projection if f in row} for row in rows]
+        return _AsyncItems(rows)
+
+
+def _term(term, values):
+    cond = CONDITION_RE.match(term)
+    if cond:
+        field, value = cond.group(1), values[cond.group(2)]
+        return lambda item: field in item and item[field] == value
+    defined = DEFINED_RE.match(term)
+    if defined:
+        negate, field = bool(defined.group(1)), defined.group(2)
+        return lambda item: (field in item) != negate
+    raise ValueError(f"Unsupported condition for InMemoryContainer: {term}")
+
+
+class _AsyncItems:
+    def __init__(self, rows):
+        self._rows = iter(rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._rows)
+        except StopIteration:
+            raise StopAsyncIteration
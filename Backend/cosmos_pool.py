@@ -0,0 +1,71 @@
+"""Long-lived Cosmos DB access for the Flask routes.
+
+Flask views are synchronous, so instead of `asyncio.run` per request (a
+new event loop, client, TLS handshake and metadata fetch every time) all
+Cosmos coroutines run on one background event loop that owns a single
+`CosmosClient`. Its HTTP session keeps connections pooled between calls.
+"""
+import atexit
+import asyncio
+import threading
+
+from azure.cosmos.aio import CosmosClient
+
+
+class LoopThread:
+    """An event loop running forever on a daemon thread."""
+
+    def __init__(self, name: str = 'cosmos-loop'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro, timeout: float = None):
+        """Run a coroutine on the loop from any thread and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+
+class ContainerPool:
+    """Hands out one shared container client, created on first use.
+
+    Pass `container=` to use a stand-in (e.g. `cosmos_memory.InMemoryContainer`)
+    instead of a real account.
+    """
+
+    def __init__(self, url=None, key=None, database=None, container_name=None, container=None):
+        self.url = url
+        self.key = key
+        self.database = database
+        self.container_name = container_name
+        self._client = None
+        self._container = container
+        self._lock = None
+
+    async def container(self):
+        if self._container is not None:
+            return self._container
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._container is None:
+                self._client = CosmosClient(self.url, credential=self.key)
+                db = self._client.get_database_client(self.database)
+                self._container = db.get_container_client(self.container_name)
+        return self._container
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self._container = None
+
+
+def start_pool(pool: ContainerPool, timeout: float = 30) -> LoopThread:
+    """Start the loop for `pool` and close its client at interpreter exit."""
+    loop = LoopThread()
+    atexit.register(lambda: loop.run(pool.close(), timeout))
+    return loop
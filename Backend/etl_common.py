@@ -0,0 +1,21 @@
+"""Helpers shared by the table build (main.py) and the trainer (train_model.py)."""
+import hashlib
+
+
+def as_text(series):
+    """str() of every value, as an f-string renders it ('nan' for missing)."""
+    return series.astype(str).where(series.notna(), 'nan')
+
+
+def file_digest(path, size, start=0):
+    """sha256 of `size` bytes of `path` from `start` (by default its first bytes)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while size > 0:
+            block = f.read(min(size, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            size -= len(block)
+    return digest.hexdigest()
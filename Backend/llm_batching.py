@@ -0,0 +1,399 @@
+"""Micro-batching of model calls across concurrent requests.
+
+`MicroBatcher` holds calls for up to `window` seconds (or until
+`max_batch` are pending). It sends calls that share the same options to
+a backend as one batch. Each call is a `BatchCall` that the caller
+iterates for the text as it is decoded. Backends implement
+`generate_batch(calls, options)`, feeding each call its chunks with
+`emit` and ending it with `finish(tokens)`:
+
+- `OllamaBackend` streams each prompt from its own /api/generate
+  request; the requests decode together in the server's
+  OLLAMA_NUM_PARALLEL slots;
+- `LlamaCppBackend` streams one multi-prompt /completion request to a
+  llama.cpp server started with `--parallel N`;
+- `FakeBackend` answers locally after a simulated batch latency and
+  records the batch sizes, for tests and benchmarks.
+
+A caller that stops reading `close()`s its call, as llm_stream's stop
+filter and reasoning watchdog do. Ollama then drops that request and
+stops decoding it. A llama.cpp batch is one request, so the server keeps
+decoding a closed prompt until its `num_predict` or a stop sequence; app.py
+sets `num_predict` from each section's budget, which bounds a runaway
+reasoning trace there server-side.
+
+Backends also implement `warm(prefix)`, a one-token generation that
+leaves `prefix` in the KV cache of one of the server's parallel slots.
+Both servers reuse a slot's cache for a new prompt as far as the two share
+a prefix, until another prompt takes the slot.
+
+Each backend renders a message list with `render(messages)`. Ollama's
+/api/generate applies the model's chat template itself, so it gets the
+text langchain's OllamaLLM sends (`get_buffer_string`). llama.cpp's raw
+/completion does not, so `LlamaCppBackend` has the server template the
+messages (/apply-template) first.
+`BatchedLLM` offers the `invoke`/`stream` calls the routes use, and takes
+OllamaLLM's `num_predict`, `stop` and `reasoning` options. `invoke`
+answers are `Completion` strings carrying the server's decoded-token count.
+"""
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from langchain_core.messages import convert_to_openai_messages, get_buffer_string
+
+from llm_stream import THINK_CLOSE, THINK_OPEN
+
+
+def render_prompt(messages) -> str:
+    return messages if isinstance(messages, str) else get_buffer_string(messages)
+
+
+class Completion(str):
+    """A whole answer; `tokens` is how many tokens the server decoded for it."""
+
+    def __new__(cls, text: str, tokens: int = None):
+        completion = super().__new__(cls, text)
+        completion.tokens = tokens
+        return completion
+
+
+class BatchCall:
+    """One prompt of a batch, read by iterating it as the backend decodes.
+
+    The backend calls `emit` with each chunk and ends with `finish(tokens)`
+    or `fail(error)`; `tokens` is then the server's decoded-token count.
+    """
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.tokens = None
+        self.cancelled = False
+        self.done = False
+        self.failed = False
+        self._chunks = queue.Queue()
+
+    def emit(self, text: str):
+        if text and not self.done:
+            self._chunks.put(text)
+
+    def finish(self, tokens: int = None):
+        if not self.done:
+            self.done = True
+            self._chunks.put(_End(tokens))
+
+    def fail(self, error: Exception):
+        if not self.done:
+            self.done = self.failed = True
+            self._chunks.put(error)
+
+    def close(self):
+        """The reader is done: backends stop forwarding, and decoding where they can."""
+        self.cancelled = True
+
+    def __iter__(self):
+        while True:
+            chunk = self._chunks.get()
+            if isinstance(chunk, _End):
+                self.tokens = chunk.tokens
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def result(self) -> Completion:
+        text = ''.join(self)
+        return Completion(text, self.tokens)
+
+
+class _End:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+
+# — Backends —
+
+class OllamaBackend:
+    def __init__(self, model: str, base_url: str = 'http://localhost:11434',
+                 max_parallel: int = 8, timeout: float = 600, keep_alive: str = None):
+        self.model = model
+        self.base_url = base_url.rstrip('/')
+        self.keep_alive = keep_alive
+        self._client = httpx.Client(timeout=timeout)
+        self._pool = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='ollama')
+
+    def render(self, messages) -> str:
+        return render_prompt(messages)
+
+    def _body(self, prompt: str, options: dict, stream: bool) -> dict:
+        body = {'model': self.model, 'prompt': prompt, 'stream': stream}
+        if options.get('format'):
+            body['format'] = options['format']
+        if options.get('reasoning') is not None:
+            body['think'] = options['reasoning']
+        decode = {}
+        if options.get('num_predict') is not None:
+            decode['num_predict'] = options['num_predict']
+        if options.get('stop'):
+            decode['stop'] = list(options['stop'])
+        if decode:
+            body['options'] = decode
+        if self.keep_alive is not None:
+            body['keep_alive'] = self.keep_alive
+        return body
+
+    def _stream(self, call: BatchCall, options: dict):
+        thinking = False
+        try:
+            with self._client.stream('POST', f'{self.base_url}/api/generate',
+                                     json=self._body(call.prompt, options, True)) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if call.cancelled:
+                        break  # closing the response cancels the generation
+                    if not line:
+                        continue
+                    part = json.loads(line)
+                    # with `think` set, reasoning arrives in its own field:
+                    # tag it as deepseek-r1 does inline
+                    if part.get('thinking'):
+                        if not thinking:
+                            call.emit(THINK_OPEN)
+                            thinking = True
+                        call.emit(part['thinking'])
+                    if part.get('response'):
+                        if thinking:
+                            call.emit(THINK_CLOSE)
+                            thinking = False
+                        call.emit(part['response'])
+                    if part.get('done'):
+                        call.finish(part.get('eval_count'))
+            call.finish()
+        except Exception as e:
+            call.fail(e)
+
+    def warm(self, prefix: str):
+        """Prefill `prefix` so the runner keeps its KV cache for later prompts."""
+        response = self._client.post(f'{self.base_url}/api/generate',
+                                     json=self._body(prefix, {'num_predict': 1}, False))
+        response.raise_for_status()
+
+    def generate_batch(self, calls: list, options: dict):
+        for future in [self._pool.submit(self._stream, call, options) for call in calls]:
+            future.result()
+
+
+class LlamaCppBackend:
+    def __init__(self, base_url: str = 'http://localhost:8080', n_predict: int = -1, timeout: float = 600):
+        self.base_url = base_url.rstrip('/')
+        self.n_predict = n_predict
+        self._client = httpx.Client(timeout=timeout)
+
+    def render(self, messages) -> str:
+        """The messages in the model's own chat template, as the server applies it."""
+        if isinstance(messages, str):
+            messages = [{'role': 'user', 'content': messages}]
+        else:
+            messages = convert_to_openai_messages(messages)
+        response = self._client.post(f'{self.base_url}/apply-template', json={'messages': messages})
+        response.raise_for_status()
+        return response.json()['prompt']
+
+    @staticmethod
+    def _thinking(prompt: str, reasoning) -> tuple:
+        """(prompt, opened): deepseek-r1's template may itself end with <think>,
+        so its answers lack the opening tag; reasoning=False closes the block
+        empty, as Ollama's `think: false` does."""
+        opened = prompt.rstrip().endswith(THINK_OPEN)
+        if reasoning is False:
+            return prompt + ('' if opened else THINK_OPEN) + f'\n\n{THINK_CLOSE}\n\n', False
+        return prompt, opened
+
+    def generate_batch(self, calls: list, options: dict):
+        prompts, opened = zip(*(self._thinking(call.prompt, options.get('reasoning')) for call in calls))
+        body = {'prompt': list(prompts), 'n_predict': options.get('num_predict') or self.n_predict,
+                'cache_prompt': True, 'stream': True}
+        if options.get('stop'):
+            body['stop'] = list(options['stop'])
+        if options.get('format') == 'json':
+            body['json_schema'] = {'type': 'object'}
+        for call, tag in zip(calls, opened):
+            if tag:
+                call.emit(THINK_OPEN)
+        with self._client.stream('POST', f'{self.base_url}/completion', json=body) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith('data: '):
+                    continue
+                try:
+                    part = json.loads(line[len('data: '):])
+                except ValueError:
+                    continue
+                call = calls[part.get('index', 0)]
+                if not call.cancelled:
+                    call.emit(part.get('content', ''))
+                if part.get('stop'):
+                    call.finish(part.get('tokens_predicted'))
+                # prompts share the request: it can only end once every one is closed or done
+                if all(c.done or c.cancelled for c in calls):
+                    break
+
+    def warm(self, prefix: str):
+        """Prefill `prefix` into a slot; `cache_prompt` reuses it for prompts sharing it."""
+        response = self._client.post(f'{self.base_url}/completion',
+                                     json={'prompt': prefix, 'n_predict': 1, 'cache_prompt': True})
+        response.raise_for_status()
+
+
+class FakeBackend:
+    """Starts answering after `latency + per_prompt * len(batch)` seconds and
+    streams each reply a word at a time, `per_token` seconds apart."""
+
+    def __init__(self, latency: float = 0.05, per_prompt: float = 0.005, reply=None, per_token: float = 0):
+        self.latency = latency
+        self.per_prompt = per_prompt
+        self.per_token = per_token
+        self.reply = reply or (lambda prompt, options: f"echo: {prompt[-80:]}")
+        self.batches = []
+        self.warmed = []
+        self.cancelled = 0
+        self._lock = threading.Lock()
+
+    def render(self, messages) -> str:
+        return render_prompt(messages)
+
+    def generate_batch(self, calls: list, options: dict):
+        with self._lock:
+            self.batches.append(len(calls))
+        time.sleep(self.latency + self.per_prompt * len(calls))
+        replies = [self.reply(call.prompt, options).split(' ') for call in calls]
+        # the prompts of a batch decode side by side, a word each per step
+        for step in range(max(map(len, replies))):
+            for call, words in zip(calls, replies):
+                if call.done:
+                    continue
+                if call.cancelled:
+                    with self._lock:
+                        self.cancelled += 1
+                    call.finish(step)
+                    continue
+                last = step == len(words) - 1
+                call.emit(words[step] if last else words[step] + ' ')
+                if last:
+                    call.finish(len(words))
+            time.sleep(self.per_token)
+
+    def warm(self, prefix: str):
+        with self._lock:
+            self.warmed.append(prefix)
+
+
+# — Batching —
+
+class MicroBatcher:
+    def __init__(self, backend, window: float = 0.02, max_batch: int = 8, max_inflight: int = 4):
+        self.backend = backend
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._cond = threading.Condition()
+        self._dispatch = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix='llm-batch')
+        self._counts = {'batches': 0, 'calls': 0, 'largest': 0, 'failed': 0}
+        threading.Thread(target=self._collect, name='llm-batcher', daemon=True).start()
+
+    def submit(self, messages, **options) -> BatchCall:
+        call = BatchCall(self.backend.render(messages))
+        key = tuple(sorted(options.items()))
+        with self._cond:
+            self._pending.append((key, call))
+            self._cond.notify()
+        return call
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                closes = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = closes - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                # calls with the first call's options, oldest first
+                key = self._pending[0][0]
+                batch = [item for item in self._pending if item[0] == key][:self.max_batch]
+                taken = {id(item) for item in batch}
+                self._pending = [item for item in self._pending if id(item) not in taken]
+            self._dispatch.submit(self._run, dict(key), batch)
+
+    def _run(self, options: dict, batch: list):
+        calls = [call for _, call in batch]
+        try:
+            self.backend.generate_batch(calls, options)
+        except Exception as e:
+            for call in calls:
+                call.fail(e)
+        for call in calls:
+            call.fail(RuntimeError("The backend ended the batch without finishing this prompt"))
+        with self._cond:
+            self._counts['batches'] += 1
+            self._counts['calls'] += len(batch)
+            self._counts['largest'] = max(self._counts['largest'], len(batch))
+            self._counts['failed'] += sum(call.failed for call in calls)
+
+    def stats(self) -> dict:
+        with self._cond:
+            counts = dict(self._counts)
+            pending = len(self._pending)
+        mean = counts['calls'] / counts['batches'] if counts['batches'] else 0.0
+        return {'backend': type(self.backend).__name__, 'window_ms': round(self.window * 1000),
+                'max_batch': self.max_batch, 'pending': pending, **counts, 'mean_batch': round(mean, 2)}
+
+
+class BatchedLLM:
+    """Stand-in for OllamaLLM whose calls go through a MicroBatcher.
+
+    `stream` yields text as the backend decodes it; closing the stream
+    early closes the call.
+    """
+
+    def __init__(self, batcher: MicroBatcher, **options):
+        self.batcher = batcher
+        # options key the batch, so they must be hashable
+        self.options = {key: tuple(value) if isinstance(value, list) else value
+                        for key, value in options.items() if value is not None}
+
+    def invoke(self, messages) -> str:
+        return self.batcher.submit(messages, **self.options).result()
+
+    def stream(self, messages):
+        call = self.batcher.submit(messages, **self.options)
+        try:
+            yield from call
+        finally:
+            call.close()
+
+
+def batcher_from_env(model: str):
+    """The MicroBatcher LLM_BACKEND names, or None for per-call OllamaLLM ('langchain')."""
+    kind = os.environ.get('LLM_BACKEND', 'langchain')
+    if kind == 'langchain':
+        return None
+    url = os.environ.get('LLM_BACKEND_URL')
+    max_batch = int(os.environ.get('LLM_BATCH_MAX', '8'))
+    if kind == 'ollama':
+        backend = OllamaBackend(model, url or 'http://localhost:11434', max_parallel=max_batch,
+                                keep_alive=os.environ.get('LLM_KEEP_ALIVE', '30m'))
+    elif kind == 'llamacpp':
+        backend = LlamaCppBackend(url or 'http://localhost:8080')
+    elif kind == 'fake':
+        backend = FakeBackend()
+    else:
+        raise ValueError(f"Unknown LLM_BACKEND: {kind}")
+    window = float(os.environ.get('LLM_BATCH_WINDOW_MS', '20')) / 1000
+    return MicroBatcher(backend, window=window, max_batch=max_batch)
@@ -0,0 +1,55 @@
+import json
+
+from llm_stream import clean_response
+
+SECTIONS = ('diagnoses', 'lab_requests', 'medications')
+MAX_ITEMS = 5
+
+
+class InvalidModelOutput(ValueError):
+    pass
+
+
+def extract_json_object(text: str) -> dict:
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end <= start:
+        raise InvalidModelOutput("no JSON object in model output")
+    try:
+        value = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise InvalidModelOutput(f"malformed JSON: {e}") from e
+    if not isinstance(value, dict):
+        raise InvalidModelOutput("model output is not a JSON object")
+    return value
+
+
+def ranked_items(value, section: str) -> list:
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        raise InvalidModelOutput(f"{section} is not a list")
+    items = []
+    for item in value:
+        if isinstance(item, dict):
+            # {"name": ..., "reason": ...} style entries
+            item = item.get('name') or next(iter(item.values()), '')
+        item = str(item).strip()
+        if item:
+            items.append(item)
+    if not items:
+        raise InvalidModelOutput(f"{section} is empty")
+    return items[:MAX_ITEMS]
+
+
+def parse_combined_response(text: str) -> dict:
+    """Validate the single-prompt JSON answer into the three ranked lists."""
+    data = extract_json_object(clean_response(text))
+    missing = [s for s in SECTIONS if s not in data]
+    if missing:
+        raise InvalidModelOutput(f"missing sections: {', '.join(missing)}")
+    return {section: ranked_items(data[section], section) for section in SECTIONS}
+
+
+def format_ranked(items: list) -> str:
+    # same shape as the per-section answers: a ranked Markdown list
+    return '\n'.join(f"{rank}. {item}" for rank, item in enumerate(items, 1))
@@ -0,0 +1,219 @@
+"""Admission control and priority scheduling for model calls.
+
+`LLMScheduler` runs at most `concurrency` calls at once. Calls that find
+no free worker wait in a queue of at most `max_queue` calls, ordered by
+priority and then arrival. A request's calls are admitted together or
+not at all. When the queue is full, a request either pushes out queued
+requests of a lower priority or is rejected at once with `QueueFull`,
+which carries a Retry-After estimate. Each request holds a `Ticket` with
+its priority and deadline. Calls still queued at the deadline are dropped
+with `DeadlineExceeded`, and waiting on a result stops there too.
+"""
+import math
+import time
+import heapq
+import itertools
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+URGENT = 0
+ROUTINE = 1
+# assumed duration of one call until a real one has been timed
+DEFAULT_SERVICE_SECONDS = 10.0
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int, queued: int):
+        super().__init__(f"Model queue is full ({queued} calls waiting); retry in {retry_after}s")
+        self.retry_after = retry_after
+        self.queued = queued
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Ticket:
+    """Priority and deadline shared by one request's calls, how they queued
+    and how many tokens they decoded."""
+
+    def __init__(self, priority: int = ROUTINE, timeout: float = None):
+        self.priority = priority
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.queue_depth = None
+        self.wait = 0.0
+        self.tokens = {}
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def result(self, future: Future):
+        """`future.result()`, giving up at the deadline."""
+        try:
+            return future.result(self.remaining())
+        except FutureTimeout:
+            raise DeadlineExceeded("Deadline passed while waiting for the model") from None
+
+    def info(self) -> dict:
+        return {
+            'priority': 'urgent' if self.priority == URGENT else 'routine',
+            'queue_depth': self.queue_depth,
+            'wait_ms': round(self.wait * 1000),
+            **({'decoded_tokens': self.tokens} if self.tokens else {}),
+        }
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    fn: object = field(compare=False)
+    args: tuple = field(compare=False)
+    ticket: Ticket = field(compare=False)
+    future: Future = field(compare=False)
+    queued_at: float = field(compare=False)
+
+
+class LLMScheduler:
+    def __init__(self, concurrency: int, max_queue: int = 64, name: str = 'llm'):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._counts = dict.fromkeys(('admitted', 'rejected', 'evicted', 'expired', 'completed'), 0)
+        self._avg_wait = 0.0
+        self._avg_service = None
+        for i in range(concurrency):
+            threading.Thread(target=self._work, name=f'{name}-{i}', daemon=True).start()
+
+    # — Admission —
+
+    def submit(self, fn, *args, ticket: Ticket = None) -> Future:
+        return self.submit_many([(fn, *args)], ticket)[0]
+
+    def submit_many(self, calls, ticket: Ticket = None) -> list:
+        """Queue every `(fn, *args)` call, or none of them (raises QueueFull)."""
+        ticket = ticket or Ticket()
+        with self._cond:
+            victims = self._victims(len(calls), ticket.priority)
+            if victims is None:
+                self._counts['rejected'] += 1
+                raise QueueFull(self._retry_after(len(self._queue)), len(self._queue))
+            if victims:
+                self._evict(victims)
+            ticket.queue_depth = len(self._queue)
+            now = time.monotonic()
+            jobs = [
+                _Job(ticket.priority, next(self._seq), call[0], tuple(call[1:]), ticket, Future(), now)
+                for call in calls
+            ]
+            for job in jobs:
+                heapq.heappush(self._queue, job)
+            self._counts['admitted'] += len(jobs)
+            self._cond.notify(len(jobs))
+        return [job.future for job in jobs]
+
+    def check(self, slots: int, priority: int = ROUTINE):
+        """Raise QueueFull now if `slots` calls at `priority` would not be admitted."""
+        with self._cond:
+            if self._victims(slots, priority) is None:
+                self._counts['rejected'] += 1
+                raise QueueFull(self._retry_after(len(self._queue)), len(self._queue))
+
+    def _victims(self, slots: int, priority: int):
+        """Queued jobs to drop so `slots` more fit, or None if they cannot.
+
+        Only requests of a lower priority are dropped, the most recent of the
+        lowest priority first, and always all of a request's queued calls.
+        """
+        free = self.max_queue - len(self._queue)
+        if free >= slots:
+            return []
+        chosen, seen = [], set()
+        for job in sorted(self._queue, reverse=True):
+            if job.priority <= priority:
+                break
+            if id(job.ticket) in seen:
+                continue
+            seen.add(id(job.ticket))
+            group = [j for j in self._queue if j.ticket is job.ticket]
+            chosen.extend(group)
+            free += len(group)
+            if free >= slots:
+                return chosen
+        return None
+
+    def _evict(self, victims):
+        dropped = {id(job) for job in victims}
+        self._queue = [job for job in self._queue if id(job) not in dropped]
+        heapq.heapify(self._queue)
+        self._counts['evicted'] += len(victims)
+        retry_after = self._retry_after(len(self._queue))
+        for job in victims:
+            job.future.set_exception(QueueFull(retry_after, len(self._queue)))
+
+    def _retry_after(self, queued: int) -> int:
+        service = self._avg_service or DEFAULT_SERVICE_SECONDS
+        return max(1, math.ceil(service * (queued + 1) / self.concurrency))
+
+    # — Workers —
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job = heapq.heappop(self._queue)
+                started = time.monotonic()
+                if job.ticket.deadline is not None and started > job.ticket.deadline:
+                    self._counts['expired'] += 1
+                    job.future.set_exception(DeadlineExceeded("Deadline passed while queued for the model"))
+                    continue
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                self._running += 1
+                wait = started - job.queued_at
+                job.ticket.wait = max(job.ticket.wait, wait)
+                self._avg_wait += 0.1 * (wait - self._avg_wait)
+            try:
+                result = job.fn(*job.args)
+            except BaseException as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+            finally:
+                service = time.monotonic() - started
+                with self._cond:
+                    self._running -= 1
+                    self._counts['completed'] += 1
+                    self._avg_service = service if self._avg_service is None else (
+                        self._avg_service + 0.1 * (service - self._avg_service)
+                    )
+
+    # — Visibility —
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self) -> dict:
+        with self._cond:
+            by_priority = {'urgent': 0, 'routine': 0}
+            for job in self._queue:
+                by_priority['urgent' if job.priority == URGENT else 'routine'] += 1
+            return {
+                'concurrency': self.concurrency,
+                'running': self._running,
+                'queued': len(self._queue),
+                'queued_by_priority': by_priority,
+                'max_queue': self.max_queue,
+                **self._counts,
+                'avg_wait_ms': round(self._avg_wait * 1000),
+                'avg_service_ms': None if self._avg_service is None else round(self._avg_service * 1000),
+                'retry_after': self._retry_after(len(self._queue)),
+            }
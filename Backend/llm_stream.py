@@ -0,0 +1,236 @@
+import os
+import re
+import queue
+from dataclasses import dataclass
+
+from llm_scheduler import DeadlineExceeded, LLMScheduler, Ticket
+
+# Shared scheduler for model calls; Ollama only decodes these in parallel
+# when the server is started with OLLAMA_NUM_PARALLEL > 1. At most LLM_QUEUE
+# calls wait for a worker; see llm_scheduler for priorities and deadlines.
+LLM_WORKERS = int(os.environ.get('LLM_WORKERS', '6'))
+LLM_QUEUE = int(os.environ.get('LLM_QUEUE', '64'))
+LLM_POOL = LLMScheduler(LLM_WORKERS, LLM_QUEUE)
+
+THINK_OPEN = '<think>'
+THINK_CLOSE = '</think>'
+# appended to a prompt whose reasoning the watchdog cut off
+FORCE_ANSWER = "\n\nDo not reason any further. Reply now with the ranked list only."
+
+
+class UnfinishedReasoning(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class SectionBudget:
+    """Decode limits for one section: reasoning tokens, answer tokens, and
+    the sequences at which the visible answer ends."""
+    think_tokens: int
+    answer_tokens: int
+    stop: tuple = ()
+
+    @property
+    def num_predict(self) -> int:
+        return self.think_tokens + self.answer_tokens
+
+
+def clean_response(text: str) -> str:
+    return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL).strip()
+
+
+class ThinkStripper:
+    """Incremental `clean_response`: drops <think>...</think> from a token stream.
+
+    Tags may be split across chunks, so a possible tag prefix at the end of
+    a chunk is held back until the next chunk decides it.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.hidden = []
+        self.thinking = False
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        out = []
+        while True:
+            tag = THINK_CLOSE if self.thinking else THINK_OPEN
+            pos = self.buffer.find(tag)
+            if pos >= 0:
+                if self.thinking:
+                    self.hidden = []
+                else:
+                    out.append(self.buffer[:pos])
+                self.buffer = self.buffer[pos + len(tag):]
+                self.thinking = not self.thinking
+                continue
+            keep = partial_suffix(self.buffer, tag)
+            done, self.buffer = self.buffer[:len(self.buffer) - keep], self.buffer[len(self.buffer) - keep:]
+            (self.hidden if self.thinking else out).append(done)
+            return ''.join(out)
+
+    def flush(self) -> str:
+        # an unterminated <think> is kept verbatim, as clean_response would
+        rest = self.buffer
+        if self.thinking:
+            rest = THINK_OPEN + ''.join(self.hidden) + rest
+        self.buffer, self.hidden, self.thinking = '', [], False
+        return rest
+
+
+class StopFilter:
+    """Ends streamed text at the first stop sequence, holding back a possible
+    partial one at the end of a chunk."""
+
+    def __init__(self, stops=()):
+        self.stops = stops
+        self.buffer = ''
+        self.stopped = False
+
+    def feed(self, text: str) -> str:
+        if self.stopped:
+            return ''
+        self.buffer += text
+        hits = [pos for pos in (self.buffer.find(stop) for stop in self.stops) if pos >= 0]
+        if hits:
+            done, self.buffer, self.stopped = self.buffer[:min(hits)], '', True
+            return done
+        keep = max((partial_suffix(self.buffer, stop) for stop in self.stops), default=0)
+        done, self.buffer = self.buffer[:len(self.buffer) - keep], self.buffer[len(self.buffer) - keep:]
+        return done
+
+    def flush(self) -> str:
+        rest, self.buffer = self.buffer, ''
+        return rest
+
+
+def partial_suffix(text: str, tag: str) -> int:
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+def force_answer_messages(messages):
+    if isinstance(messages, str):
+        return messages + FORCE_ANSWER
+    *head, last = messages
+    return [*head, last.model_copy(update={'content': last.content + FORCE_ANSWER})]
+
+
+def decode(llm, messages, usage: dict, budget: SectionBudget = None, force_llm=None):
+    """Yield the visible text of one generation, adding its decoded tokens to `usage`.
+
+    Tokens are counted one per streamed chunk, as Ollama, llama.cpp and
+    llm_batching's BatchedLLM stream them.
+    The answer ends at the first of `budget.stop`, closing the stream. A
+    watchdog also closes it once reasoning passes `budget.think_tokens`.
+    Reasoning that was cut off, or that ran to the end of the generation,
+    is never returned: `force_llm` is asked for the answer instead, and
+    without one UnfinishedReasoning is raised.
+    """
+    stripper = ThinkStripper()
+    stops = StopFilter(budget.stop if budget else ())
+    stream = llm.stream(messages)
+    thought = 0
+    try:
+        for chunk in stream:
+            thinking = stripper.thinking
+            text = stripper.feed(chunk)
+            hidden = int(thinking or stripper.thinking)
+            usage['tokens'] += 1
+            usage['think_tokens'] += hidden
+            thought += hidden
+            text = stops.feed(text)
+            if text:
+                yield text
+            if stops.stopped:
+                return
+            if budget is not None and stripper.thinking and thought > budget.think_tokens:
+                break
+    finally:
+        stream.close()
+    if stripper.thinking:
+        if force_llm is None:
+            raise UnfinishedReasoning(f"The model was still reasoning after {thought} tokens")
+        usage['forced'] = True
+        yield from decode(force_llm, force_answer_messages(messages), usage, budget)
+        return
+    text = stops.feed(stripper.flush()) + stops.flush()
+    if text:
+        yield text
+
+
+def new_usage() -> dict:
+    return {'tokens': 0, 'think_tokens': 0, 'forced': False}
+
+
+def invoke_sections(llms: dict, prompts: dict, ticket: Ticket = None,
+                    budgets: dict = None, force_llms: dict = None) -> dict:
+    """Run every section prompt concurrently and return the cleaned answers.
+
+    `llms`, `budgets` and `force_llms` map a section to its model, its
+    SectionBudget and the model that answers once its reasoning is cut
+    off. Decoded tokens per section go to `ticket.tokens`.
+    Raises llm_scheduler.QueueFull if the sections cannot all be queued.
+    """
+    ticket = ticket or Ticket()
+    budgets, force_llms = budgets or {}, force_llms or {}
+    for name in prompts:
+        ticket.tokens[name] = new_usage()
+
+    def run(name, messages):
+        chunks = decode(llms[name], messages, ticket.tokens[name], budgets.get(name), force_llms.get(name))
+        return ''.join(chunks).strip()
+
+    calls = [(run, name, messages) for name, messages in prompts.items()]
+    futures = dict(zip(prompts, LLM_POOL.submit_many(calls, ticket)))
+    return {name: ticket.result(future) for name, future in futures.items()}
+
+
+def stream_sections(llms: dict, prompts: dict, ticket: Ticket = None,
+                    budgets: dict = None, force_llms: dict = None):
+    """Run section prompts concurrently, yielding events as text arrives.
+
+    Yields ('delta', section, text) for visible text, then ('section',
+    section, answer) once a section is complete or ('error', section,
+    message) if it failed. Sections finish in whatever order the model
+    completes them. Arguments are as for `invoke_sections`. QueueFull is
+    raised before the first event if the sections cannot all be queued.
+    """
+    ticket = ticket or Ticket()
+    budgets, force_llms = budgets or {}, force_llms or {}
+    for name in prompts:
+        ticket.tokens[name] = new_usage()
+    events = queue.Queue()
+
+    def run(name, messages):
+        parts = []
+        try:
+            chunks = decode(llms[name], messages, ticket.tokens[name], budgets.get(name), force_llms.get(name))
+            for text in chunks:
+                parts.append(text)
+                events.put(('delta', name, text))
+            events.put(('section', name, ''.join(parts).strip()))
+        except Exception as e:
+            events.put(('error', name, str(e)))
+
+    def dropped(name, future):
+        # dropped by the scheduler before it ran (deadline or eviction)
+        if future.exception() is not None:
+            events.put(('error', name, str(future.exception())))
+
+    futures = LLM_POOL.submit_many([(run, name, messages) for name, messages in prompts.items()], ticket)
+    for name, future in zip(prompts, futures):
+        future.add_done_callback(lambda f, name=name: dropped(name, f))
+
+    remaining = len(prompts)
+    while remaining:
+        try:
+            kind, name, text = events.get(timeout=ticket.remaining())
+        except queue.Empty:
+            raise DeadlineExceeded("Deadline passed while streaming from the model") from None
+        if kind != 'delta':
+            remaining -= 1
+        yield kind, name, text
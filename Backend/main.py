@@ -1,36 +1,94 @@
+"""Build unified_training_table.csv from the hospital source tables.
+
+    python main.py                       # whole tables in memory
+    python main.py --chunks 16           # bounded memory, MR_CODE partitions
+    python main.py --workers 32          # partitions unified in a process pool
+    python main.py --incremental         # upsert visits touched by new rows
+
+With `--chunks N` every source is streamed once in `--chunksize` row
+blocks and each block is split by a hash of MR_CODE (lab results follow
+their request's LRS_NO) into N partitions spilled to a scratch directory;
+a first pass over each CSV fixes the column types every block is read with.
+Partitions are unified one at a time, so peak memory is one partition's
+joins plus the finished output, and rows are put back in the order the
+whole-table run produces.
+
+`--workers N` hash-partitions the loaded tables the same way (N x 4
+partitions, or the `--chunks` partitions) and unifies them in a pool of
+N processes; the output is identical to the serial run.
+
+`--incremental` keeps, in `<out>.state/`, a watermark per source CSV (its
+size and digests of its first and last 64 KiB), an index from MR_CODE
+(LRS_NO for lab results) to the byte range of every source record, and
+the byte offset of every output row. A run reads only the bytes appended
+since then, works out which (MR_CODE, VISIT_DATE) groups they feed, reads
+just those patients' records through the index, and rewrites the output
+from the first changed row on; new visits are appended. A rewritten (not
+appended) source, appended rows that would change a column's type, or
+missing state trigger a full rebuild; `--full` forces one.
+"""
+import io
+import os
+import json
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
+from etl_common import as_text, file_digest
+from snapshot import has_snapshot, read_typed
+
+OUTPUT = "unified_training_table.csv"
+ROW = '_PRES_ROW'
+PARTITIONS_PER_WORKER = 4
 
-reg   = pd.read_csv("mr_registiration.csv",
-                    parse_dates=['MR_REG_DATE', 'MR_DOB'])
-pres  = pd.read_csv("presinting_complain.csv",
-                    parse_dates=['MR_VISIT_DATE'])
-vitals= pd.read_csv("vitals.csv",
-                    parse_dates=['MR_VISITDATE', 'VITAL_DATE'])
-diag  = pd.read_csv("Diagnosis.csv",
-                    parse_dates=['MR_VISIT_DATE', 'MR_DATE_TIME'])
-lr    = pd.read_csv("lab_request.csv",
-                    parse_dates=['MR_VISIT_DATE'])
-lres  = pd.read_csv("LAB_RRESULT_ENTERY.csv",
-                    parse_dates=['INSERT_DT'],
-                    low_memory=False)
-med   = pd.read_csv("medication.csv",
-                    parse_dates=['INSERT_DT'],
-                    low_memory=False)
-
-for df_source in (reg, pres, vitals, diag, lr, med):
-    df_source['MR_CODE'] = df_source['MR_CODE'].astype(str)
-
-lr['LRS_NO']   = lr['LRS_NO'].astype(str)
-lres['LRS_NO'] = lres['LRS_NO'].astype(str)
-
-df = (
-    pres.merge(reg, on='MR_CODE', how='left')
-        .rename(columns={'MR_VISIT_DATE': 'VISIT_DATE'})
-)
-df['AGE_AT_VISIT'] = ((df['VISIT_DATE'] - df['MR_DOB']).dt.days / 365.25).round(1)
-
-vitals = vitals.rename(columns={
+# name: (csv path, columns used here, read_csv keyword arguments)
+SOURCES = {
+    'registration': (
+        "mr_registiration.csv",
+        ['MR_CODE', 'MR_REG_DATE', 'MR_SEX', 'MR_DOB'],
+        dict(parse_dates=['MR_REG_DATE', 'MR_DOB'])
+    ),
+    'presenting_complain': (
+        "presinting_complain.csv",
+        ['MR_CODE', 'MR_VISIT_DATE', 'PRESENTING_COMPLAIN', 'PRE_COM_DURATION'],
+        dict(parse_dates=['MR_VISIT_DATE'])
+    ),
+    'vitals': (
+        "vitals.csv",
+        ['MR_CODE', 'MR_VISITDATE', 'VITAL_BP_SIS', 'VITAL_DYS', 'VITAL_TEMP',
+         'VITAL_PULSE', 'VITAL_RES_RATE', 'VITAL_HEIGHT', 'VITAL_WEIGHT',
+         'VITAL_O2_SAT', 'VITAL_PAIN'],
+        dict(parse_dates=['MR_VISITDATE', 'VITAL_DATE'])
+    ),
+    'diagnoses': (
+        "Diagnosis.csv",
+        ['MR_CODE', 'MR_VISIT_DATE', 'MED_REC_DIAG', 'MED_REC_FIAN_DIAG',
+         'MED_REC_SUM_REMARKS', 'MED_REC_NEXT_PLN_CODE'],
+        dict(parse_dates=['MR_VISIT_DATE', 'MR_DATE_TIME'])
+    ),
+    'lab_request': (
+        "lab_request.csv",
+        ['MR_CODE', 'MR_VISIT_DATE', 'LRS_NO', 'LAB_TEST'],
+        dict(parse_dates=['MR_VISIT_DATE'])
+    ),
+    'lab_result_entry': (
+        "LAB_RRESULT_ENTERY.csv",
+        ['LRS_NO', 'LAB_TEST', 'PARAMETER', 'RESULT'],
+        dict(parse_dates=['INSERT_DT'], low_memory=False)
+    ),
+    'medication': (
+        "medication.csv",
+        ['MR_CODE', 'MR_REG_DT_TIME', 'ITEM_NAME', 'DOSAGE', 'INT_CODE'],
+        dict(parse_dates=['INSERT_DT'], low_memory=False)
+    ),
+}
+
+VITALS_RENAME = {
     'MR_VISITDATE':'VISIT_DATE',
     'VITAL_BP_SIS':'BP_SYSTOLIC',
     'VITAL_DYS':'BP_DIASTOLIC',
@@ -41,81 +99,15 @@ vitals = vitals.rename(columns={
     'VITAL_WEIGHT':'WEIGHT',
     'VITAL_O2_SAT':'O2_SAT',
     'VITAL_PAIN':'PAIN_SCORE'
-})
-df = df.merge(
-    vitals[['MR_CODE','VISIT_DATE',
-            'BP_SYSTOLIC','BP_DIASTOLIC','TEMP','PULSE',
-            'RESP_RATE','HEIGHT','WEIGHT','O2_SAT','PAIN_SCORE']],
-    on=['MR_CODE','VISIT_DATE'], how='left'
-)
-
-diag = diag.rename(columns={'MR_VISIT_DATE':'VISIT_DATE'})
-df = df.merge(
-    diag[['MR_CODE','VISIT_DATE',
-          'MED_REC_DIAG','MED_REC_FIAN_DIAG',
-          'MED_REC_SUM_REMARKS','MED_REC_NEXT_PLN_CODE']],
-    on=['MR_CODE','VISIT_DATE'], how='left'
-).rename(columns={
+}
+DIAG_RENAME = {
     'MED_REC_DIAG':'DIAGNOSIS',
     'MED_REC_FIAN_DIAG':'FINAL_DIAGNOSIS',
     'MED_REC_SUM_REMARKS':'REMARKS',
     'MED_REC_NEXT_PLN_CODE':'NEXT_PLAN'
-})
-
-
-lr_group = (
-    lr
-    .groupby(['MR_CODE','MR_VISIT_DATE'])['LAB_TEST']
-    .agg(lambda x: '; '.join(x.dropna().astype(str)))
-    .reset_index()
-    .rename(columns={'MR_VISIT_DATE':'VISIT_DATE',
-                     'LAB_TEST':'LAB_REQUESTS'})
-)
-
-lres_comb = (
-    lr.merge(lres, on='LRS_NO', how='left', suffixes=('_REQ','_RES'))
-      .assign(LAB_TEST_REQ=lambda d: d['LAB_TEST_REQ'].astype(str))
-)
-lres_comb['RESULT_STR'] = lres_comb.apply(
-    lambda row: f"{row['LAB_TEST_REQ']}:{row['PARAMETER']}={row['RESULT']}"
-                if pd.notna(row['PARAMETER']) and pd.notna(row['RESULT'])
-                else None,
-    axis=1
-)
-lres_group = (
-    lres_comb
-    .groupby(['MR_CODE','MR_VISIT_DATE'])['RESULT_STR']
-    .agg(lambda x: '; '.join(x.dropna().astype(str)))
-    .reset_index()
-    .rename(columns={'MR_VISIT_DATE':'VISIT_DATE',
-                     'RESULT_STR':'LAB_RESULTS'})
-)
-
-df = df.merge(lr_group, on=['MR_CODE','VISIT_DATE'], how='left')
-df = df.merge(lres_group, on=['MR_CODE','VISIT_DATE'], how='left')
-
-med['MR_REG_DT_TIME'] = pd.to_datetime(med['MR_REG_DT_TIME'], errors='coerce')
-med['VISIT_DATE']     = med['MR_REG_DT_TIME'].dt.floor('d')
-
-def format_med(group):
-    return '; '.join(
-        f"{row['ITEM_NAME']}|{row['DOSAGE']}|{row['INT_CODE']}"
-        for _, row in group.iterrows()
-        if pd.notna(row['ITEM_NAME'])
-    )
-
-med_series = (
-    med
-    .groupby(['MR_CODE','VISIT_DATE'])[['ITEM_NAME','DOSAGE','INT_CODE']]
-    .apply(format_med)
-)
-med_group = med_series.to_frame('MEDICATIONS').reset_index()
+}
 
-df['VISIT_DATE']       = pd.to_datetime(df['VISIT_DATE'])
-med_group['VISIT_DATE'] = pd.to_datetime(med_group['VISIT_DATE'])
-df = df.merge(med_group, on=['MR_CODE','VISIT_DATE'], how='left')
-
-final_cols = [
+FINAL_COLS = [
     'MR_CODE','MR_REG_DATE','MR_SEX','MR_DOB','VISIT_DATE','AGE_AT_VISIT',
     'PRESENTING_COMPLAIN','PRE_COM_DURATION',
     'BP_SYSTOLIC','BP_DIASTOLIC','TEMP','PULSE','RESP_RATE',
@@ -123,7 +115,846 @@ final_cols = [
     'DIAGNOSIS','FINAL_DIAGNOSIS','REMARKS','NEXT_PLAN',
     'LAB_REQUESTS','LAB_RESULTS','MEDICATIONS'
 ]
-unified_df = df[final_cols]
-unified_df.to_csv("unified_training_table.csv", index=False)
 
-print("✅ unified_training_table.csv generated successfully.")
+
+# — Loading —
+
+def load_source(name, path, columns, prefer_snapshot=True, **csv_kwargs):
+    # typed Parquet snapshot (projected to the columns used here) if present
+    if prefer_snapshot and has_snapshot(name):
+        return read_typed(name, columns=columns)
+    return pd.read_csv(path, **csv_kwargs)
+
+
+def iter_source(name, chunksize):
+    """Blocks of one source table: the whole snapshot, or CSV row chunks
+    typed as the whole table would be."""
+    path, columns, csv_kwargs = SOURCES[name]
+    if has_snapshot(name):
+        yield read_typed(name, columns=columns)
+        return
+    yield from read_csv_typed(name, scan_types(name, chunksize), chunksize=chunksize)
+
+
+def normalize_keys(name, df):
+    if 'MR_CODE' in df.columns:
+        df['MR_CODE'] = df['MR_CODE'].astype(str)
+    if 'LRS_NO' in df.columns:
+        df['LRS_NO'] = df['LRS_NO'].astype(str)
+    return df
+
+
+def load_raw_sources(prefer_snapshot=True):
+    return {
+        name: load_source(name, path, columns, prefer_snapshot, **csv_kwargs)
+        for name, (path, columns, csv_kwargs) in SOURCES.items()
+    }
+
+
+def prepare_sources(raw):
+    sources = {name: normalize_keys(name, df) for name, df in raw.items()}
+    pres = sources['presenting_complain']
+    pres[ROW] = np.arange(len(pres))
+    return sources
+
+
+def load_sources(prefer_snapshot=True):
+    return prepare_sources(load_raw_sources(prefer_snapshot))
+
+
+# — Column types —
+# pandas infers a CSV column's type from the rows it reads: a column with
+# blanks only in the last rows is float there but int in every earlier
+# chunk, and renders '1.0' against '1'. Chunked and incremental reads
+# re-apply the type the whole-table read infers, as recorded here.
+
+def column_kind(kinds):
+    """'float', 'text' or None (no change needed) for a column whose blocks
+    were read with these numpy dtype kinds."""
+    if kinds <= {'i', 'u'} or kinds == {'b'}:
+        return None
+    if kinds <= {'i', 'u', 'f'}:
+        return 'float'
+    return 'text'
+
+
+def column_types(df, name):
+    """Column kinds to re-apply when a subset of the table is read later."""
+    dates = set(SOURCES[name][2].get('parse_dates', []))
+    kinds = {}
+    for column, dtype in df.dtypes.items():
+        if column in dates or column == ROW:
+            continue
+        kind = column_kind({dtype.kind})
+        if kind:
+            kinds[column] = kind
+    return kinds
+
+
+def scan_types(name, chunksize):
+    """column_types of the whole CSV, from one chunked pass over the columns used."""
+    path, columns, csv_kwargs = SOURCES[name]
+    dates = set(csv_kwargs.get('parse_dates', []))
+    options = {k: v for k, v in csv_kwargs.items() if k != 'parse_dates'}
+    seen = {}
+    for block in pd.read_csv(path, usecols=lambda c: c in columns and c not in dates,
+                             chunksize=chunksize, **options):
+        for column, dtype in block.dtypes.items():
+            seen.setdefault(column, set()).add(dtype.kind)
+    return {column: kind for column, kind in ((c, column_kind(k)) for c, k in seen.items()) if kind}
+
+
+def widened(df, name, types):
+    """Columns of `df` (read with `types`' text columns as str) whose type is
+    wider than `types` records, so the whole table would now read differently."""
+    return [
+        column for column, kind in column_types(df, name).items()
+        if kind != types.get(column) and types.get(column) != 'text'
+    ]
+
+
+def apply_types(name, types, block):
+    floats = [c for c, kind in types.items() if kind == 'float' and c in block]
+    if floats:
+        block[floats] = block[floats].astype('float64')
+    return normalize_keys(name, block)
+
+
+def read_csv_raw(name, types, source=None, **kwargs):
+    path, _, csv_kwargs = SOURCES[name]
+    text = {c: str for c, kind in types.items() if kind == 'text'}
+    return pd.read_csv(source or path, dtype=text, **csv_kwargs, **kwargs)
+
+
+def read_csv_typed(name, types, source=None, **kwargs):
+    """Read (part of) a source CSV with the given column types, so a subset
+    renders exactly as it does inside the whole table."""
+    reader = read_csv_raw(name, types, source, **kwargs)
+    if kwargs.get('chunksize'):
+        return (apply_types(name, types, block) for block in reader)
+    return apply_types(name, types, reader)
+
+
+# — Unification —
+
+def join_groups(values, keys):
+    """'; '.join of the non-null values per key, in row order."""
+    frame = keys.assign(_TEXT=values)
+    frame = frame[values.notna()]
+    return (
+        frame.groupby(list(keys.columns), sort=False)['_TEXT']
+             .agg('; '.join)
+    )
+
+
+def unify(sources):
+    reg, pres, vitals, diag, lr, lres, med = (
+        sources[name] for name in SOURCES
+    )
+
+    df = (
+        pres.merge(reg, on='MR_CODE', how='left')
+            .rename(columns={'MR_VISIT_DATE': 'VISIT_DATE'})
+    )
+    df['AGE_AT_VISIT'] = ((df['VISIT_DATE'] - df['MR_DOB']).dt.days / 365.25).round(1)
+
+    vitals = vitals.rename(columns=VITALS_RENAME)
+    df = df.merge(
+        vitals[['MR_CODE','VISIT_DATE',
+                'BP_SYSTOLIC','BP_DIASTOLIC','TEMP','PULSE',
+                'RESP_RATE','HEIGHT','WEIGHT','O2_SAT','PAIN_SCORE']],
+        on=['MR_CODE','VISIT_DATE'], how='left'
+    )
+
+    diag = diag.rename(columns={'MR_VISIT_DATE':'VISIT_DATE'})
+    df = df.merge(
+        diag[['MR_CODE','VISIT_DATE',
+              'MED_REC_DIAG','MED_REC_FIAN_DIAG',
+              'MED_REC_SUM_REMARKS','MED_REC_NEXT_PLN_CODE']],
+        on=['MR_CODE','VISIT_DATE'], how='left'
+    ).rename(columns=DIAG_RENAME)
+
+    visit_keys = lr[['MR_CODE', 'MR_VISIT_DATE']]
+    lr_group = (
+        join_groups(as_text(lr['LAB_TEST']).where(lr['LAB_TEST'].notna()), visit_keys)
+        .rename('LAB_REQUESTS')
+        .reset_index()
+        .rename(columns={'MR_VISIT_DATE':'VISIT_DATE'})
+    )
+
+    lres_comb = lr.merge(lres, on='LRS_NO', how='left', suffixes=('_REQ','_RES'))
+    result_str = (
+        as_text(lres_comb['LAB_TEST_REQ']) + ':'
+        + as_text(lres_comb['PARAMETER']) + '='
+        + as_text(lres_comb['RESULT'])
+    ).where(lres_comb['PARAMETER'].notna() & lres_comb['RESULT'].notna())
+    lres_group = (
+        join_groups(result_str, lres_comb[['MR_CODE', 'MR_VISIT_DATE']])
+        .rename('LAB_RESULTS')
+        .reset_index()
+        .rename(columns={'MR_VISIT_DATE':'VISIT_DATE'})
+    )
+
+    df = df.merge(lr_group, on=['MR_CODE','VISIT_DATE'], how='left')
+    df = df.merge(lres_group, on=['MR_CODE','VISIT_DATE'], how='left')
+
+    med_visit = pd.DataFrame({
+        'MR_CODE': med['MR_CODE'],
+        'VISIT_DATE': pd.to_datetime(med['MR_REG_DT_TIME'], errors='coerce').dt.floor('d'),
+    })
+    med_str = (
+        as_text(med['ITEM_NAME']) + '|'
+        + as_text(med['DOSAGE']) + '|'
+        + as_text(med['INT_CODE'])
+    ).where(med['ITEM_NAME'].notna())
+    med_group = join_groups(med_str, med_visit).rename('MEDICATIONS').reset_index()
+
+    df['VISIT_DATE']        = pd.to_datetime(df['VISIT_DATE'])
+    med_group['VISIT_DATE'] = pd.to_datetime(med_group['VISIT_DATE'])
+    df = df.merge(med_group, on=['MR_CODE','VISIT_DATE'], how='left')
+
+    return df[FINAL_COLS + [ROW]]
+
+
+def finish(parts, keep_row=False):
+    """Concatenate unified partitions back into presenting-complaint order."""
+    columns = FINAL_COLS + [ROW] if keep_row else FINAL_COLS
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    order = np.argsort(df[ROW].to_numpy(), kind='stable')
+    return df.iloc[order][columns].reset_index(drop=True)
+
+
+# — MR_CODE partitions —
+
+def partition_of(codes, parts):
+    """Stable hash partition of MR_CODE values (same across processes)."""
+    hashed = pd.util.hash_pandas_object(codes.astype(str), index=False).to_numpy()
+    return (hashed % np.uint64(parts)).astype(np.int64)
+
+
+def result_routes(requests, parts):
+    """LRS_NO -> partition of the request, so results follow their request."""
+    return pd.DataFrame({
+        'LRS_NO': requests['LRS_NO'].to_numpy(),
+        '_PART': partition_of(requests['MR_CODE'], parts),
+    }).drop_duplicates()
+
+
+def route_results(results, routes):
+    # a result belongs to every partition holding its request
+    results = results.merge(routes, on='LRS_NO', how='inner', sort=False)
+    return results, results.pop('_PART').to_numpy()
+
+
+def split_sources(sources, parts):
+    """Hash-partition loaded sources by MR_CODE."""
+    split = [{} for _ in range(parts)]
+    for name, df in sources.items():
+        if name == 'lab_result_entry':
+            df, part = route_results(df, result_routes(sources['lab_request'], parts))
+        else:
+            part = partition_of(df['MR_CODE'], parts)
+        for p in range(parts):
+            split[p][name] = df[part == p]
+    return split
+
+
+def spill_partitions(workdir, parts, chunksize):
+    """Stream every source once, writing each block's rows to their partition."""
+    row_offset = 0
+    routes = []
+    for name in SOURCES:
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+        for i, block in enumerate(iter_source(name, chunksize)):
+            block = normalize_keys(name, block)
+            if i == 0:
+                block.iloc[:0].to_pickle(os.path.join(workdir, name, 'schema.pkl'))
+            if name == 'presenting_complain':
+                block[ROW] = np.arange(row_offset, row_offset + len(block))
+                row_offset += len(block)
+            if name == 'lab_result_entry':
+                if isinstance(routes, list):
+                    routes = pd.concat(
+                        routes or [pd.DataFrame({'LRS_NO': [], '_PART': []})]
+                    ).drop_duplicates()
+                block, part = route_results(block, routes)
+            else:
+                part = partition_of(block['MR_CODE'], parts)
+            if name == 'lab_request':
+                routes.append(result_routes(block, parts))
+            for p in np.unique(part):
+                block[part == p].to_pickle(os.path.join(workdir, name, f'{p}-{i:06d}.pkl'))
+
+
+def load_partition(workdir, p):
+    sources = {}
+    for name in SOURCES:
+        folder = os.path.join(workdir, name)
+        blocks = sorted(f for f in os.listdir(folder) if f.startswith(f'{p}-'))
+        frames = [pd.read_pickle(os.path.join(folder, f)) for f in blocks]
+        sources[name] = (
+            pd.concat(frames, ignore_index=True) if frames
+            else pd.read_pickle(os.path.join(folder, 'schema.pkl'))
+        )
+    if ROW not in sources['presenting_complain']:
+        sources['presenting_complain'][ROW] = pd.Series(dtype='int64')
+    return sources
+
+
+# — Worker processes —
+
+# partitions handed to forked workers by index instead of being pickled
+_FORKED = None
+
+
+def _unify_forked(p):
+    return unify(_FORKED[p])
+
+
+def _unify_spilled(job):
+    return unify(load_partition(*job))
+
+
+def pool_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+
+def unify_parallel(partitions, workers):
+    """Unify in-memory partitions in a process pool, in partition order."""
+    global _FORKED
+    ctx = pool_context()
+    with ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+        if ctx.get_start_method() != 'fork':
+            return list(pool.map(unify, partitions))
+        _FORKED = partitions
+        try:
+            return list(pool.map(_unify_forked, range(len(partitions))))
+        finally:
+            _FORKED = None
+
+
+def build_chunked(parts, chunksize, workdir=None, workers=1):
+    scratch = tempfile.mkdtemp(prefix='unify-', dir=workdir)
+    try:
+        spill_partitions(scratch, parts, chunksize)
+        jobs = [(scratch, p) for p in range(parts)]
+        if workers > 1:
+            with ProcessPoolExecutor(workers, mp_context=pool_context()) as pool:
+                return finish(list(pool.map(_unify_spilled, jobs)))
+        return finish([_unify_spilled(job) for job in jobs])
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def build(chunks=1, chunksize=200_000, workdir=None, workers=1):
+    if chunks > 1:
+        return build_chunked(chunks, chunksize, workdir, workers)
+    sources = load_sources()
+    if workers > 1:
+        # a few partitions per worker so one heavy partition does not straggle
+        return finish(unify_parallel(split_sources(sources, workers * PARTITIONS_PER_WORKER), workers))
+    return finish([unify(sources)])
+
+
+# — Incremental rebuild —
+#
+# `<out>.state/` holds, besides state.json:
+#   <table>.<key>.hash.npy / .npy   hashed MR_CODE (or LRS_NO) of every source
+#                                   record, sorted, with its record number and
+#                                   byte range; written by a full rebuild
+#   <table>.<key>.tail              the same entries for records appended since,
+#                                   unsorted (the first `tails[...]` are valid)
+#   rows.bin / starts.bin           presenting-complaint row and byte offset of
+#                                   every output row (int64, first `rows` valid)
+
+STATE_VERSION = 3
+# bytes at the start and end of a source CSV compared to detect a rewrite
+MARK_WINDOW = 1 << 16
+SCAN_BLOCK = 1 << 24
+
+# appended rows of these tables touch the visit (MR_CODE, <date column>)
+VISIT_COLUMNS = {
+    'presenting_complain': 'MR_VISIT_DATE',
+    'vitals': 'MR_VISITDATE',
+    'diagnoses': 'MR_VISIT_DATE',
+    'lab_request': 'MR_VISIT_DATE',
+}
+# columns source records are looked up by
+INDEX_KEYS = {name: ('MR_CODE',) for name in SOURCES}
+INDEX_KEYS['lab_request'] = ('MR_CODE', 'LRS_NO')
+INDEX_KEYS['lab_result_entry'] = ('LRS_NO',)
+
+ENTRY = np.dtype([('record', '<i8'), ('start', '<i8'), ('end', '<i8')])
+TAIL_ENTRY = np.dtype([('hash', '<u8'), ('record', '<i8'), ('start', '<i8'), ('end', '<i8')])
+
+
+def state_dir(out):
+    return out + '.state'
+
+
+def source_mark(name):
+    """Watermark of a source CSV: its size and digests of its first and last
+    MARK_WINDOW bytes, which an append leaves as they were."""
+    path = SOURCES[name][0]
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - 1))
+        newline = f.read(1) in (b'\n', b'')
+    tail = max(0, size - MARK_WINDOW)
+    return {
+        'offset': size,
+        'head': file_digest(path, min(size, MARK_WINDOW)),
+        'tail': file_digest(path, size - tail, start=tail),
+        'newline': newline,
+    }
+
+
+def only_appended(name, mark):
+    """True when the CSV has only grown by whole lines since `mark`."""
+    path = SOURCES[name][0]
+    size = os.path.getsize(path)
+    if size < mark['offset'] or (size > mark['offset'] and not mark['newline']):
+        return False
+    tail = max(0, mark['offset'] - MARK_WINDOW)
+    return (file_digest(path, min(mark['offset'], MARK_WINDOW)) == mark['head']
+            and file_digest(path, mark['offset'] - tail, start=tail) == mark['tail'])
+
+
+def record_bounds(f, start, stop):
+    """(start, end) byte offsets of the CSV records in f[start:stop].
+
+    A newline inside a quoted field does not end a record, and blank lines
+    (which read_csv skips) are dropped, so row i of read_csv is record i.
+    """
+    ends, before = [], []
+    quoted, last = 0, 0
+    f.seek(start)
+    pos = start
+    while pos < stop:
+        data = np.frombuffer(f.read(min(SCAN_BLOCK, stop - pos)), dtype=np.uint8)
+        if not len(data):
+            break
+        # parity of the quotes so far; uint8 wraps at 256, which keeps parity
+        parity = (np.cumsum(data == ord('"'), dtype=np.uint8) + quoted) & 1
+        found = np.flatnonzero((data == ord('\n')) & (parity == 0))
+        ends.append(found + pos + 1)
+        before.append(np.where(found > 0, data[found - 1], last))
+        quoted, last = int(parity[-1]), int(data[-1])
+        pos += len(data)
+    ends = np.concatenate(ends) if ends else np.empty(0, dtype=np.int64)
+    before = np.concatenate(before) if before else np.empty(0, dtype=np.uint8)
+    if pos > (ends[-1] if len(ends) else start):
+        ends, before = np.append(ends, pos), np.append(before, 0)
+    starts = np.concatenate([[start], ends[:-1]]).astype(np.int64)[:len(ends)]
+    size = ends - starts
+    blank = (size == 1) | ((size == 2) & (before == ord('\r')))
+    return np.column_stack([starts, ends])[~blank]
+
+
+def key_hash(values):
+    return pd.util.hash_array(np.asarray(values, dtype=object).astype(str))
+
+
+def write_entries(path, entries, count):
+    """Write `entries` after the first `count` of a binary array file, dropping the rest."""
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        f.seek(count * entries.dtype.itemsize)
+        entries.tofile(f)
+        f.truncate()
+
+
+def write_index(folder, sources, marks):
+    """Index every source record by its key columns; returns the record and
+    header counts for the state."""
+    records, headers = {}, {}
+    for name, df in sources.items():
+        path = SOURCES[name][0]
+        with open(path, 'rb') as f:
+            bounds = record_bounds(f, 0, marks[name]['offset'])
+        if len(bounds) != len(df) + 1:
+            raise ValueError(f"{path}: found {len(bounds) - 1} CSV records for {len(df)} rows")
+        headers[name], bounds = int(bounds[0, 1]), bounds[1:]
+        records[name] = len(df)
+        for column in INDEX_KEYS[name]:
+            hashes = key_hash(df[column])
+            order = np.argsort(hashes, kind='stable')
+            entries = np.empty(len(df), dtype=ENTRY)
+            entries['record'] = order
+            entries['start'], entries['end'] = bounds[order, 0], bounds[order, 1]
+            np.save(os.path.join(folder, f'{name}.{column}.hash.npy'), hashes[order])
+            np.save(os.path.join(folder, f'{name}.{column}.npy'), entries)
+            open(os.path.join(folder, f'{name}.{column}.tail'), 'wb').close()
+    return records, headers
+
+
+def append_index(folder, state, name, df, bounds):
+    """Add the entries of records appended to a source to its index tails."""
+    first = state['records'][name]
+    for column in INDEX_KEYS[name]:
+        entries = np.empty(len(df), dtype=TAIL_ENTRY)
+        entries['hash'] = key_hash(df[column])
+        entries['record'] = np.arange(first, first + len(df))
+        entries['start'], entries['end'] = bounds[:, 0], bounds[:, 1]
+        tail = f'{name}.{column}'
+        write_entries(os.path.join(folder, tail + '.tail'), entries, state['tails'][tail])
+        state['tails'][tail] += len(df)
+    state['records'][name] += len(df)
+
+
+def lookup(folder, state, name, column, keys):
+    """Index entries of the records whose `column` hashes like one of `keys`, in file order."""
+    wanted = np.unique(key_hash(list(keys)))
+    hashes = np.load(os.path.join(folder, f'{name}.{column}.hash.npy'), mmap_mode='r')
+    entries = np.load(os.path.join(folder, f'{name}.{column}.npy'), mmap_mode='r')
+    lo = np.searchsorted(hashes, wanted, 'left')
+    hi = np.searchsorted(hashes, wanted, 'right')
+    found = [entries[a:b] for a, b in zip(lo, hi) if b > a]
+    tail = np.fromfile(os.path.join(folder, f'{name}.{column}.tail'), dtype=TAIL_ENTRY,
+                       count=state['tails'][f'{name}.{column}'])
+    tail = tail[np.isin(tail['hash'], wanted)]
+    appended = np.empty(len(tail), dtype=ENTRY)
+    for field in ENTRY.names:
+        appended[field] = tail[field]
+    found.append(appended)
+    found = np.concatenate(found)
+    return found[np.argsort(found['record'], kind='stable')]
+
+
+def read_records(state, name, entries, types):
+    """Parse the indexed records of a source CSV with the whole table's types."""
+    path = SOURCES[name][0]
+    parts = []
+    with open(path, 'rb') as f:
+        parts.append(f.read(state['headers'][name]))
+        for start, end in zip(entries['start'], entries['end']):
+            f.seek(start)
+            part = f.read(end - start)
+            parts.append(part if part.endswith(b'\n') else part + b'\n')
+    return read_csv_typed(name, types, source=io.BytesIO(b''.join(parts)))
+
+
+def collect_rows(folder, state, name, column, keys, types):
+    """Every row of a source whose `column` is one of `keys`, in file order."""
+    entries = lookup(folder, state, name, column, keys)
+    df = read_records(state, name, entries, types)
+    # hash collisions bring in a few other keys' rows
+    keep = df[column].isin(set(keys)).to_numpy()
+    if name == 'presenting_complain':
+        df[ROW] = entries['record']
+    return df[keep].reset_index(drop=True)
+
+
+def read_appended(state, name, types):
+    """Rows appended to a source since the last run, with their byte ranges;
+    None when the appended rows would change how the whole table reads."""
+    path, mark = SOURCES[name][0], state['tables'][name]
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.read(state['headers'][name])
+        bounds = record_bounds(f, mark['offset'], size)
+        f.seek(mark['offset'])
+        data = f.read(size - mark['offset'])
+    df = read_csv_raw(name, types, source=io.BytesIO(header + data))
+    if len(df) != len(bounds) or (len(df) and widened(df, name, types)):
+        return None
+    return apply_types(name, types, df), bounds
+
+
+def visit_keys(codes, dates):
+    return pd.DataFrame({
+        'MR_CODE': codes.to_numpy(),
+        'VISIT_DATE': pd.to_datetime(dates, errors='coerce').astype('datetime64[ns]').to_numpy(),
+    })
+
+
+def affected_visits(folder, state, appended, types):
+    """(MR_CODE, VISIT_DATE) groups the appended rows feed into, plus the
+    patients whose every visit changes (new registration rows, undated rows)."""
+    keys = [visit_keys(appended[name]['MR_CODE'], appended[name][column])
+            for name, column in VISIT_COLUMNS.items()]
+    med = appended['medication']
+    keys.append(visit_keys(
+        med['MR_CODE'], pd.to_datetime(med['MR_REG_DT_TIME'], errors='coerce').dt.floor('d')
+    ))
+    results = set(appended['lab_result_entry']['LRS_NO'])
+    if results:
+        requests = collect_rows(folder, state, 'lab_request', 'LRS_NO', results, types['lab_request'])
+        keys.append(visit_keys(requests['MR_CODE'], requests['MR_VISIT_DATE']))
+
+    keys = pd.concat(keys, ignore_index=True)
+    undated = keys['VISIT_DATE'].isna()
+    patients = set(appended['registration']['MR_CODE']) | set(keys.loc[undated, 'MR_CODE'])
+    return keys[~undated].drop_duplicates(), patients
+
+
+def collect_patients(folder, state, patients, types):
+    """Every source row of `patients` (and of their lab requests), in file order."""
+    sources = {}
+    for name in SOURCES:
+        if name == 'lab_result_entry':
+            column, keys = 'LRS_NO', set(sources['lab_request']['LRS_NO'])
+        else:
+            column, keys = 'MR_CODE', patients
+        sources[name] = collect_rows(folder, state, name, column, keys, types[name])
+    return sources
+
+
+def in_visits(df, visits, patients):
+    keys = pd.MultiIndex.from_arrays([
+        df['MR_CODE'].to_numpy(),
+        pd.to_datetime(df['VISIT_DATE']).astype('datetime64[ns]').to_numpy(),
+    ])
+    wanted = pd.MultiIndex.from_frame(visits)
+    return keys.isin(wanted) | df['MR_CODE'].isin(patients).to_numpy()
+
+
+# — Output rows —
+# to_csv renders a column by its dtype and, for dates, by whether any value
+# has a time of day. New rows are cast to render as they would inside the
+# whole table; if they would change how the whole table renders (say, a
+# blank in an int column) the table is rebuilt instead.
+
+def column_format(values):
+    if values.isna().all():
+        return None
+    kind = values.dtype.kind
+    if kind in 'iu':
+        return 'int'
+    if kind == 'f':
+        return 'float'
+    if kind == 'b':
+        return 'bool'
+    if kind == 'M':
+        values = values.dropna()
+        return 'date' if (values == values.dt.normalize()).all() else 'datetime'
+    return 'text'
+
+
+def output_format(df):
+    return {column: column_format(df[column]) for column in FINAL_COLS}
+
+
+def fit_output(fresh, formats, rows):
+    """Cast `fresh` to render as it would among the `rows` existing output rows,
+    updating `formats`; None if the whole table would render differently."""
+    for column in FINAL_COLS:
+        values, want = fresh[column], formats[column]
+        if want in ('int', 'bool') and values.isna().any():
+            return None
+        have = column_format(values)
+        if have is None or have == want:
+            continue
+        if want is None and rows and have == 'int':
+            # every existing row is blank here, so the whole column is float
+            fresh[column], formats[column] = values.astype('float64'), 'float'
+        elif want is None and have != 'bool':
+            formats[column] = have
+        elif (want, have) == ('float', 'int'):
+            fresh[column] = values.astype('float64')
+        elif (want, have) == ('datetime', 'date'):
+            fresh[column] = values.dt.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            return None
+    return fresh
+
+
+def write_output(df, out):
+    tmp = out + '.tmp'
+    df[FINAL_COLS].to_csv(tmp, index=False)
+    os.replace(tmp, out)
+
+
+def patch_output(out, folder, state, fresh):
+    """Upsert `fresh` (sorted by presenting-complaint row) into the output.
+
+    Output rows are in presenting-complaint order, so rows of new visits go
+    at the end. From the first replaced row on, the file is rewritten with
+    the untouched rows' bytes copied as they are; everything before it is
+    left alone.
+    """
+    count, size = state['output']['rows'], state['output']['size']
+    rows = np.memmap(os.path.join(folder, 'rows.bin'), dtype='<i8', mode='r', shape=(count,)) \
+        if count else np.empty(0, dtype=np.int64)
+    starts = np.memmap(os.path.join(folder, 'starts.bin'), dtype='<i8', mode='r', shape=(count,)) \
+        if count else np.empty(0, dtype=np.int64)
+
+    fresh_rows = fresh[ROW].to_numpy(dtype=np.int64)
+    lo = np.searchsorted(rows, fresh_rows, 'left')
+    hi = np.searchsorted(rows, fresh_rows, 'right')
+    first = int(lo[hi > lo].min()) if (hi > lo).any() else count
+    replaced = np.zeros(count - first, dtype=bool)
+    for a, b in zip(lo[hi > lo], hi[hi > lo]):
+        replaced[a - first:b - first] = True
+    old_rows = np.asarray(rows[first:])
+    old_bounds = np.column_stack([starts[first:], np.append(starts[first + 1:], size)[:count - first]])
+    offset = int(starts[first]) if first < count else size
+
+    text = fresh[FINAL_COLS].to_csv(index=False, header=False).encode()
+    new_bounds = record_bounds(io.BytesIO(text), 0, len(text))
+
+    # the new tail: kept rows (0) and fresh rows (1) in presenting-complaint order
+    kept = np.flatnonzero(~replaced)
+    source = np.concatenate([np.zeros(len(kept), dtype=int), np.ones(len(fresh), dtype=int)])
+    position = np.concatenate([kept, np.arange(len(fresh))])
+    order = np.argsort(np.concatenate([old_rows[kept], fresh_rows]), kind='stable')
+
+    tail_rows = np.concatenate([old_rows[kept], fresh_rows])[order]
+    tail_starts = np.empty(len(order), dtype=np.int64)
+    tmp = out + '.tail'
+    with open(out, 'rb') as old, open(tmp, 'wb') as new:
+        written = offset
+        for i, k in enumerate(order):
+            tail_starts[i] = written
+            if source[k]:
+                start, end = new_bounds[position[k]]
+                written += new.write(text[start:end])
+            else:
+                start, end = old_bounds[position[k]]
+                old.seek(start)
+                written += new.write(old.read(end - start))
+    with open(tmp, 'rb') as src, open(out, 'r+b') as dst:
+        dst.seek(offset)
+        shutil.copyfileobj(src, dst)
+        dst.truncate()
+    os.remove(tmp)
+
+    del rows, starts
+    write_entries(os.path.join(folder, 'rows.bin'), tail_rows, first)
+    write_entries(os.path.join(folder, 'starts.bin'), tail_starts, first)
+    state['output']['rows'] = first + len(order)
+    state['output']['size'] = written
+    return int(replaced.sum())
+
+
+def write_state(folder, state):
+    tmp = os.path.join(folder, 'state.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, os.path.join(folder, 'state.json'))
+
+
+def rebuild_with_state(out):
+    """Full in-memory build from the CSVs, recording watermarks and indexes."""
+    marks = {name: source_mark(name) for name in SOURCES}
+    raw = load_raw_sources(prefer_snapshot=False)
+    # types as read, before MR_CODE and LRS_NO are turned into text
+    types = {name: column_types(df, name) for name, df in raw.items()}
+    sources = prepare_sources(raw)
+    df = finish([unify(sources)], keep_row=True)
+    write_output(df, out)
+
+    folder = state_dir(out)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    try:
+        records, headers = write_index(folder, sources, marks)
+    except ValueError as e:
+        shutil.rmtree(folder, ignore_errors=True)
+        print(f"No incremental state: {e}.")
+        return df
+    with open(out, 'rb') as f:
+        bounds = record_bounds(f, 0, os.path.getsize(out))[1:]
+    df[ROW].to_numpy(dtype=np.int64).tofile(os.path.join(folder, 'rows.bin'))
+    bounds[:, 0].astype(np.int64).tofile(os.path.join(folder, 'starts.bin'))
+    write_state(folder, {
+        'version': STATE_VERSION,
+        'tables': marks,
+        'types': types,
+        'records': records,
+        'headers': headers,
+        'tails': {f'{name}.{column}': 0 for name in SOURCES for column in INDEX_KEYS[name]},
+        'output': {'rows': len(df), 'size': os.path.getsize(out), 'format': output_format(df)},
+    })
+    return df
+
+
+def load_state(out):
+    path = os.path.join(state_dir(out), 'state.json')
+    if not (os.path.exists(path) and os.path.exists(out)):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    if state.get('version') != STATE_VERSION or set(state['tables']) != set(SOURCES):
+        return None
+    # an output written since (or a run cut short) no longer matches the row index
+    if os.path.getsize(out) != state['output']['size']:
+        return None
+    return state
+
+
+def build_incremental(out):
+    """Recompute only the visits that rows appended since the last run touch,
+    and upsert them into `out`. Falls back to a full rebuild when there is no
+    usable state, a source was rewritten rather than appended to, or the new
+    rows would change how the whole table reads or renders.
+
+    Returns the upserted rows, or the whole table after a rebuild."""
+    state = load_state(out)
+    if state is None or not all(only_appended(n, m) for n, m in state['tables'].items()):
+        print("No usable watermark; rebuilding from the source CSVs.")
+        return rebuild_with_state(out)
+
+    folder, types = state_dir(out), state['types']
+    appended = {}
+    for name in SOURCES:
+        read = read_appended(state, name, types[name])
+        if read is None:
+            print(f"{name}: appended rows change the column types; rebuilding from the source CSVs.")
+            return rebuild_with_state(out)
+        appended[name], bounds = read
+        if len(bounds):
+            print(f"{name}: {len(bounds)} new rows")
+            append_index(folder, state, name, appended[name], bounds)
+    if not any(len(rows) for rows in appended.values()):
+        print("Sources unchanged since the last run.")
+        return None
+
+    visits, patients = affected_visits(folder, state, appended, types)
+    fresh = unify(collect_patients(folder, state, set(visits['MR_CODE']) | patients, types))
+    fresh = finish([fresh[in_visits(fresh, visits, patients)]], keep_row=True)
+    fresh = fit_output(fresh, state['output']['format'], state['output']['rows'])
+    if fresh is None:
+        print("New rows change how the table renders; rebuilding from the source CSVs.")
+        return rebuild_with_state(out)
+
+    replaced = patch_output(out, folder, state, fresh)
+    state['tables'] = {name: source_mark(name) for name in SOURCES}
+    write_state(folder, state)
+    print(f"Upserted {len(visits)} visits and {len(patients)} whole patients: "
+          f"{replaced} rows replaced by {len(fresh)}.")
+    return fresh
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=1,
+                        help='MR_CODE partitions to process one at a time (1 = whole tables)')
+    parser.add_argument('--chunksize', type=int, default=200_000,
+                        help='CSV rows read per block when partitioning')
+    parser.add_argument('--workdir', default=None,
+                        help='where partitions are spilled (default: system temp)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes unifying MR_CODE partitions in parallel')
+    parser.add_argument('--incremental', action='store_true',
+                        help='upsert only the visits touched by rows appended since the last run')
+    parser.add_argument('--full', action='store_true',
+                        help='rebuild from the CSVs and reset the --incremental watermarks')
+    parser.add_argument('--out', default=OUTPUT)
+    args = parser.parse_args()
+
+    if args.full:
+        rebuild_with_state(args.out)
+    elif args.incremental:
+        build_incremental(args.out)
+    else:
+        write_output(build(args.chunks, args.chunksize, args.workdir, args.workers), args.out)
+
+    print(f"✅ {args.out} generated successfully.")
+
+
+if __name__ == '__main__':
+    main()
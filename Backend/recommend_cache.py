@@ -0,0 +1,160 @@
+"""Cache of finished recommendations, keyed by rendered prompt and model.
+
+Backends share a small interface (`get`, `put`, `clear`, `__len__`) and
+evict by TTL and least-recent use. `MemoryBackend` lives in the process;
+`SqliteBackend` persists across restarts and between worker processes.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def prompt_key(model: str, prompts: dict) -> str:
+    """Stable hash of the model name and every rendered prompt message."""
+    rendered = {
+        name: [[getattr(m, 'type', ''), getattr(m, 'content', m)] for m in messages]
+        for name, messages in prompts.items()
+    }
+    payload = json.dumps({'model': model, 'prompts': rendered}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryBackend:
+    def __init__(self, max_entries: int = 512, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            stored_at, value = item
+            if time.time() - stored_at > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.time(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SqliteBackend:
+    def __init__(self, path: str, max_entries: int = 512, ttl: float = 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recommendations ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " stored_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS recommendations_used_at ON recommendations (used_at)"
+        )
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM recommendations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM recommendations WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE recommendations SET used_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recommendations (key, value, stored_at, used_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, default=str), now, now)
+            )
+            self._conn.execute("DELETE FROM recommendations WHERE stored_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM recommendations WHERE key IN ("
+                " SELECT key FROM recommendations ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM recommendations")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM recommendations").fetchone()[0]
+
+
+class RecommendationCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.backend.put(key, value)
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'entries': len(self.backend),
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def cache_from_env():
+    """RECOMMEND_CACHE=memory (default) | sqlite | off."""
+    kind = os.environ.get('RECOMMEND_CACHE', 'memory')
+    if kind == 'off':
+        return None
+    max_entries = int(os.environ.get('RECOMMEND_CACHE_SIZE', '512'))
+    ttl = float(os.environ.get('RECOMMEND_CACHE_TTL', '3600'))
+    if kind == 'sqlite':
+        path = os.environ.get('RECOMMEND_CACHE_PATH', 'recommend_cache.sqlite3')
+        return RecommendationCache(SqliteBackend(path, max_entries, ttl))
+    return RecommendationCache(MemoryBackend(max_entries, ttl))
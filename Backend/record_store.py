@@ -0,0 +1,188 @@
+import os
+import threading
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from snapshot import has_snapshot, parse_date_column, read_serving, snapshot_path
+
+
+def clean_df(df):
+    df.columns = df.columns.str.strip()
+    for col in df.select_dtypes(include=['object']).columns:
+        df[col] = df[col].str.strip()
+    return df
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    path: str
+    dtype: dict = field(default_factory=dict)
+    # source column parsed once into `date_target` (date-only)
+    date_column: str = None
+    date_target: str = 'VISIT_DATE_ONLY'
+    # column the per-patient index is keyed on
+    key_column: str = 'MR_CODE'
+
+
+# — Hospital tables served by the record routes —
+TABLES = {
+    'registration': TableSpec(
+        'mr_registiration.csv', {'MR_CODE': str}
+    ),
+    'presenting_complain': TableSpec(
+        'presinting_complain.csv', {'MR_CODE': str, 'MR_VISIT_DATE': str},
+        date_column='MR_VISIT_DATE'
+    ),
+    'vitals': TableSpec(
+        'vitals.csv', {'MR_CODE': str, 'MR_VISITDATE': str},
+        date_column='MR_VISITDATE'
+    ),
+    'diagnoses': TableSpec(
+        'Diagnosis.csv', {'MR_CODE': str, 'MR_VISIT_DATE': str},
+        date_column='MR_VISIT_DATE'
+    ),
+    'lab_request': TableSpec(
+        'lab_request.csv', {'MR_CODE': str, 'MR_VISIT_DATE': str, 'LRS_NO': str},
+        date_column='MR_VISIT_DATE'
+    ),
+    'lab_result': TableSpec(
+        'lab_result.csv', {'LRS_NO': str, 'INSERT_DT': str},
+        date_column='INSERT_DT', date_target='INSERT_DATE_ONLY', key_column='LRS_NO'
+    ),
+    'medication': TableSpec(
+        'medication.csv', {'MR_CODE': str}
+    ),
+}
+
+
+def load_table(spec: TableSpec, path: str) -> pd.DataFrame:
+    df = pd.read_csv(path, dtype=spec.dtype)
+    df = clean_df(df)
+    if spec.date_column:
+        df[spec.date_target] = parse_date_column(df[spec.date_column])
+    return df.replace({np.nan: None})
+
+
+def load_snapshot_table(name: str, spec: TableSpec, base_dir: str) -> pd.DataFrame:
+    # dates are already parsed in the snapshot; only whitespace is left to clean
+    df = read_serving(name, base_dir)
+    dates = df.pop(spec.date_target) if spec.date_column else None
+    df = clean_df(df)
+    if dates is not None:
+        df[spec.date_target] = dates
+    return df.replace({np.nan: None})
+
+
+EMPTY = np.empty(0, dtype=np.intp)
+
+
+class VisitIndex:
+    """Hash index of key (MR_CODE) -> visit date -> row offsets.
+
+    Built once per table load so a lookup is a couple of dict hits instead
+    of a boolean mask over every row.
+    """
+
+    def __init__(self, keys, dates=None):
+        frame = pd.DataFrame({'key': np.asarray(keys, dtype=object)})
+        self._by_key = frame.groupby('key', sort=False).indices
+        self._by_visit = {}
+        if dates is not None:
+            frame['date'] = np.asarray(dates, dtype=object)
+            for (key, date), pos in frame.groupby(['key', 'date'], sort=False).indices.items():
+                self._by_visit.setdefault(key, {})[date] = pos
+
+    def lookup(self, key, date=None) -> np.ndarray:
+        if date is None:
+            return self._by_key.get(key, EMPTY)
+        return self._by_visit.get(key, {}).get(date, EMPTY)
+
+    def lookup_many(self, keys, date=None) -> np.ndarray:
+        return self.lookup_pairs([(key, date) for key in keys])
+
+    def lookup_pairs(self, pairs) -> np.ndarray:
+        parts = [self.lookup(key, date) for key, date in pairs]
+        if not parts:
+            return EMPTY
+        return np.sort(np.concatenate(parts))
+
+
+def build_index(spec: TableSpec, df: pd.DataFrame) -> VisitIndex:
+    dates = df[spec.date_target] if spec.date_column else None
+    return VisitIndex(df[spec.key_column], dates)
+
+
+class RecordStore:
+    """Keeps every hospital table cleaned and date-parsed in memory.
+
+    A table is read on first use (or by `load_all` at startup) from its
+    Parquet snapshot when one exists, else from the CSV, and re-read only
+    when that file's mtime changes, so the record routes never parse
+    CSV text on the request path. Each loaded table carries a `VisitIndex`
+    for per-patient lookups.
+    """
+
+    def __init__(self, specs=None, base_dir='.'):
+        self.specs = dict(TABLES if specs is None else specs)
+        self.base_dir = base_dir
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def path(self, name: str) -> str:
+        if has_snapshot(name, self.base_dir):
+            return snapshot_path(name, self.base_dir)
+        return os.path.join(self.base_dir, self.specs[name].path)
+
+    def load_all(self):
+        for name in self.specs:
+            try:
+                self.table(name)
+            except FileNotFoundError:
+                print(f"Record store: {self.path(name)} not found, skipping.")
+
+    def _entry(self, name: str):
+        path = self.path(name)
+        version = (path, os.stat(path).st_mtime_ns)
+        cached = self._tables.get(name)
+        if cached is not None and cached[0] == version:
+            return cached
+
+        with self._lock:
+            cached = self._tables.get(name)
+            if cached is not None and cached[0] == version:
+                return cached
+            spec = self.specs[name]
+            if path.endswith('.parquet'):
+                df = load_snapshot_table(name, spec, self.base_dir)
+            else:
+                df = load_table(spec, path)
+            cached = (version, df, build_index(spec, df))
+            self._tables[name] = cached
+            return cached
+
+    def table(self, name: str) -> pd.DataFrame:
+        return self._entry(name)[1]
+
+    def index(self, name: str) -> VisitIndex:
+        return self._entry(name)[2]
+
+    def rows(self, name: str, key, visit_date=None) -> pd.DataFrame:
+        _, df, index = self._entry(name)
+        return df.iloc[index.lookup(key, visit_date)]
+
+    def rows_many(self, name: str, keys, visit_date=None) -> pd.DataFrame:
+        _, df, index = self._entry(name)
+        return df.iloc[index.lookup_many(keys, visit_date)]
+
+    def rows_batch(self, name: str, groups):
+        """Rows for many lookups with a single iloc.
+
+        `groups` is a list of [(key, visit_date), ...] lists; returns the
+        matched rows and how many of them belong to each group, in order.
+        """
+        _, df, index = self._entry(name)
+        parts = [index.lookup_pairs(group) for group in groups]
+        offsets = np.concatenate(parts) if parts else EMPTY
+        return df.iloc[offsets], [len(part) for part in parts]
@@ -0,0 +1,81 @@
+"""Production launcher: the Flask app over ASGI (uvicorn).
+
+    python serve.py --workers 4 --record-threads 32 --llm-threads 16
+    uvicorn serve:create_app --factory --workers 4     # same app, any ASGI server
+
+Each worker process runs the event loop plus two bounded thread pools.
+Record, user and stats routes run on the `records` pool; /recommend and
+/recommend/stream run on the `llm` pool. A burst of slow recommendations
+can fill only the `llm` pool, and requests beyond it wait on the loop
+without holding a thread, so record lookups keep their own threads. Model
+calls themselves still go through llm_stream's LLM_WORKERS pool.
+GET /server_stats shows how busy each pool is. `python app.py` remains
+the development server.
+
+Set SESSION_SECRET: login tokens are signed with it and must verify in
+every worker. Without it each worker warns and signs with its own random
+secret, so serve.py refuses to start more than one worker; tokens also
+stop working on restart.
+"""
+import os
+import argparse
+
+from flask import jsonify
+
+from asgi_bridge import PooledWSGI
+
+RECORD_THREADS = int(os.environ.get('ASGI_RECORD_THREADS', '32'))
+LLM_THREADS = int(os.environ.get('ASGI_LLM_THREADS', '16'))
+LLM_ROUTES = {'/recommend', '/recommend/stream'}
+
+
+def route_pool(path: str):
+    return 'llm' if path.rstrip('/') in LLM_ROUTES else None
+
+
+def create_app():
+    # imported here so the launcher process does not load the tables itself
+    from app import app as flask_app
+
+    server = PooledWSGI(
+        flask_app, {'records': RECORD_THREADS, 'llm': LLM_THREADS}, route_pool, default='records'
+    )
+    flask_app.add_url_rule('/server_stats', 'server_stats', lambda: jsonify(server.pool_stats()))
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1, help='worker processes')
+    parser.add_argument('--record-threads', type=int, default=RECORD_THREADS,
+                        help='threads per worker for record, user and stats routes')
+    parser.add_argument('--llm-threads', type=int, default=LLM_THREADS,
+                        help='threads per worker for /recommend requests')
+    parser.add_argument('--llm-workers', type=int,
+                        help='concurrent model calls per worker (LLM_WORKERS)')
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("serve.py needs uvicorn: pip install uvicorn")
+
+    if not os.environ.get('SESSION_SECRET') and args.workers > 1:
+        raise SystemExit("Set SESSION_SECRET: every worker must verify the others' login tokens")
+
+    # worker processes read their settings from the environment
+    os.environ['ASGI_RECORD_THREADS'] = str(args.record_threads)
+    os.environ['ASGI_LLM_THREADS'] = str(args.llm_threads)
+    if args.llm_workers:
+        os.environ['LLM_WORKERS'] = str(args.llm_workers)
+    uvicorn.run(
+        'serve:create_app', factory=True, host=args.host, port=args.port,
+        workers=args.workers, log_level=args.log_level, lifespan='on',
+    )
+
+
+if __name__ == '__main__':
+    main()
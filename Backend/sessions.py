@@ -0,0 +1,76 @@
+"""Signed session tokens and a server-side cache of authenticated users.
+
+`/validate_user` issues a token signed with SESSION_SECRET. Later calls
+present it and are resolved from the in-process cache without touching
+Cosmos; a worker that has not seen the session re-hydrates it with one
+point read by user id, and every worker re-reads a cached user after
+SESSION_RECHECK seconds, so a deleted user loses access everywhere within
+that time.
+
+Set SESSION_SECRET in every deployment: a token signed by one worker must
+verify on every other. Without it the store warns and signs with a random
+per-process secret, which is only correct for a single process and logs
+everyone out on restart.
+"""
+import os
+import time
+import secrets
+import threading
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(8 * 3600)))
+SESSION_RECHECK = int(os.environ.get('SESSION_RECHECK', '60'))
+
+
+class SessionStore:
+    def __init__(self, secret: str = None, ttl: int = SESSION_TTL, recheck: int = SESSION_RECHECK):
+        if secret is None:
+            secret = os.environ.get('SESSION_SECRET')
+        if not secret:
+            print("WARNING: SESSION_SECRET is not set; using a random secret. Login tokens "
+                  "will not verify in other worker processes and expire on restart.")
+            secret = secrets.token_hex(32)
+        self.ttl = ttl
+        self.recheck = recheck
+        self._serializer = URLSafeTimedSerializer(secret, salt='optimus-session')
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def issue(self, user: dict) -> str:
+        claims = {'sid': secrets.token_urlsafe(16), 'uid': str(user['userid'])}
+        self.remember(claims, user)
+        return self._serializer.dumps(claims)
+
+    def verify(self, token: str):
+        """Claims of a correctly signed, unexpired token, else None."""
+        try:
+            return self._serializer.loads(token, max_age=self.ttl)
+        except (BadSignature, SignatureExpired):
+            return None
+
+    def get(self, claims: dict):
+        with self._lock:
+            entry = self._sessions.get(claims['sid'])
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.time():
+                del self._sessions[claims['sid']]
+                return None
+            return user
+
+    def remember(self, claims: dict, user: dict):
+        now = time.time()
+        with self._lock:
+            # the token itself expires after `ttl`; the cached user after `recheck`
+            self._sessions[claims['sid']] = (now + min(self.ttl, self.recheck), user)
+            expired = [sid for sid, (expires_at, _) in self._sessions.items() if expires_at < now]
+            for sid in expired:
+                del self._sessions[sid]
+
+    def revoke_user(self, user_id: str):
+        """Drop the user's sessions here; other workers notice within `recheck`."""
+        with self._lock:
+            for sid in [s for s, (_, u) in self._sessions.items() if str(u.get('userid')) == str(user_id)]:
+                del self._sessions[sid]
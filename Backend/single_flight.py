@@ -0,0 +1,59 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key.
+
+    The first caller for a key (the leader) does the work; callers arriving
+    while it is in flight wait for the leader's result (or exception)
+    instead of starting their own.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def begin(self, key):
+        """Return (future, leader). A leader must call `finish` exactly once."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.followers += 1
+                return future, False
+            future = Future()
+            self._flights[key] = future
+            self.leaders += 1
+            return future, True
+
+    def finish(self, key, result=None, error: BaseException = None):
+        with self._lock:
+            future = self._flights.pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn, wait=None):
+        """Run `fn` once per in-flight key; returns (result, shared).
+
+        Followers get the leader's result through `wait(future)`, by
+        default `future.result()`; pass e.g. a deadline-bounded wait so a
+        stuck leader cannot hold its followers forever.
+        """
+        future, leader = self.begin(key)
+        if not leader:
+            return (wait or Future.result)(future), True
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, error=e)
+            raise
+        self.finish(key, result)
+        return result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
@@ -0,0 +1,213 @@
+"""Columnar (Parquet) snapshots of the hospital tables.
+
+    python snapshot.py                # convert every table that has a CSV
+    python snapshot.py vitals medication --out snapshots
+
+Each snapshot keeps the raw CSV columns, adds a typed `<COL>_TS` timestamp
+for every date column and the date-only column the record routes filter
+on, and is sorted by MR_CODE (LRS_NO for lab results) so Parquet row-group
+statistics make per-patient filters cheap. `app.py` and `main.py` read a
+snapshot when one exists and fall back to the CSV otherwise.
+"""
+import os
+import argparse
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # snapshots are optional; callers fall back to CSV
+    pa = pq = None
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'snapshots')
+TS_SUFFIX = '_TS'
+ROW_COLUMN = 'SOURCE_ROW'
+ROW_GROUP_SIZE = 64_000
+
+
+def parse_date_column(series, fmt='%m/%d/%Y'):
+    return pd.to_datetime(
+        series.str.split().str[0],
+        format=fmt,
+        errors='coerce'
+    ).dt.date
+
+
+@dataclass(frozen=True)
+class SnapshotSpec:
+    source: str
+    sort_key: str = 'MR_CODE'
+    # columns read as text so the raw value survives the round trip
+    text_columns: tuple = ('MR_CODE',)
+    # date columns stored as typed `<COL>_TS` next to the raw text
+    parse_dates: tuple = ()
+    # (source column, target) for the date-only column used by the record routes
+    date_only: tuple = None
+    # store parsed dates in place instead of as companions (derived tables)
+    typed_only: bool = False
+    csv_kwargs: dict = field(default_factory=dict)
+
+
+SNAPSHOTS = {
+    'registration': SnapshotSpec(
+        'mr_registiration.csv',
+        parse_dates=('MR_REG_DATE', 'MR_DOB')
+    ),
+    'presenting_complain': SnapshotSpec(
+        'presinting_complain.csv',
+        parse_dates=('MR_VISIT_DATE',),
+        date_only=('MR_VISIT_DATE', 'VISIT_DATE_ONLY')
+    ),
+    'vitals': SnapshotSpec(
+        'vitals.csv',
+        parse_dates=('MR_VISITDATE', 'VITAL_DATE'),
+        date_only=('MR_VISITDATE', 'VISIT_DATE_ONLY')
+    ),
+    'diagnoses': SnapshotSpec(
+        'Diagnosis.csv',
+        parse_dates=('MR_VISIT_DATE', 'MR_DATE_TIME'),
+        date_only=('MR_VISIT_DATE', 'VISIT_DATE_ONLY')
+    ),
+    'lab_request': SnapshotSpec(
+        'lab_request.csv',
+        text_columns=('MR_CODE', 'LRS_NO'),
+        parse_dates=('MR_VISIT_DATE',),
+        date_only=('MR_VISIT_DATE', 'VISIT_DATE_ONLY')
+    ),
+    'lab_result': SnapshotSpec(
+        'lab_result.csv', sort_key='LRS_NO',
+        text_columns=('LRS_NO',),
+        parse_dates=('INSERT_DT',),
+        date_only=('INSERT_DT', 'INSERT_DATE_ONLY')
+    ),
+    'lab_result_entry': SnapshotSpec(
+        'LAB_RRESULT_ENTERY.csv', sort_key='LRS_NO',
+        text_columns=('LRS_NO',),
+        parse_dates=('INSERT_DT',)
+    ),
+    'medication': SnapshotSpec(
+        'medication.csv',
+        parse_dates=('INSERT_DT', 'MR_REG_DT_TIME')
+    ),
+    'training': SnapshotSpec(
+        'cleaned_unified_training_table.csv',
+        parse_dates=('MR_REG_DATE', 'MR_DOB', 'VISIT_DATE'),
+        typed_only=True
+    ),
+}
+
+
+def snapshot_path(name: str, base_dir: str = '.') -> str:
+    return os.path.join(base_dir, SNAPSHOT_DIR, f'{name}.parquet')
+
+
+def has_snapshot(name: str, base_dir: str = '.') -> bool:
+    return pq is not None and os.path.exists(snapshot_path(name, base_dir))
+
+
+def build_snapshot(name: str, base_dir: str = '.') -> pd.DataFrame:
+    spec = SNAPSHOTS[name]
+    dtype = {col: str for col in spec.text_columns}
+    if not spec.typed_only:
+        dtype.update({col: str for col in spec.parse_dates})
+    df = pd.read_csv(
+        os.path.join(base_dir, spec.source),
+        dtype=dtype,
+        parse_dates=list(spec.parse_dates) if spec.typed_only else False,
+        low_memory=False,
+        **spec.csv_kwargs
+    )
+    df.columns = df.columns.str.strip()
+
+    if not spec.typed_only:
+        for col in spec.parse_dates:
+            df[col + TS_SUFFIX] = pd.to_datetime(df[col], errors='coerce')
+    if spec.date_only:
+        source, target = spec.date_only
+        df[target] = parse_date_column(df[source].str.strip())
+
+    df[ROW_COLUMN] = range(len(df))
+    return df.sort_values(spec.sort_key, kind='stable', na_position='last')
+
+
+def write_snapshot(name: str, base_dir: str = '.', out_dir: str = None) -> str:
+    df = build_snapshot(name, base_dir)
+    path = snapshot_path(name, base_dir) if out_dir is None else os.path.join(out_dir, f'{name}.parquet')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp_path = path + '.tmp'
+    pq.write_table(
+        table, tmp_path,
+        row_group_size=ROW_GROUP_SIZE,
+        sorting_columns=[pq.SortingColumn(table.schema.get_field_index(SNAPSHOTS[name].sort_key))],
+    )
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_snapshot(name: str, columns=None, filters=None, base_dir: str = '.') -> pd.DataFrame:
+    """Raw snapshot read with column projection and predicate pushdown."""
+    return pq.read_table(snapshot_path(name, base_dir), columns=columns, filters=filters).to_pandas()
+
+
+def read_serving(name: str, base_dir: str = '.') -> pd.DataFrame:
+    """Record-route view: raw text columns plus the date-only column."""
+    spec = SNAPSHOTS[name]
+    schema = pq.read_schema(snapshot_path(name, base_dir))
+    typed = {col + TS_SUFFIX for col in spec.parse_dates}
+    columns = [c for c in schema.names if c not in typed and c != ROW_COLUMN]
+    return read_snapshot(name, columns=columns, base_dir=base_dir)
+
+
+def read_typed(name: str, columns=None, filters=None, base_dir: str = '.') -> pd.DataFrame:
+    """Pipeline view: date columns typed, rows in source-file order.
+
+    `columns` and `filters` use the source column names; typed companions
+    are substituted transparently.
+    """
+    spec = SNAPSHOTS[name]
+    if spec.typed_only:
+        rename = {}
+    else:
+        rename = {col + TS_SUFFIX: col for col in spec.parse_dates}
+    source_of = {v: k for k, v in rename.items()}
+
+    if columns is None:
+        schema = pq.read_schema(snapshot_path(name, base_dir))
+        derived = set(source_of) | ({spec.date_only[1]} if spec.date_only else set())
+        columns = [c for c in schema.names if c not in derived and c != ROW_COLUMN]
+    read_cols = [source_of.get(c, c) for c in columns] + [ROW_COLUMN]
+    if filters is not None:
+        filters = [(source_of.get(col, col), op, val) for col, op, val in filters]
+
+    df = read_snapshot(name, columns=read_cols, filters=filters, base_dir=base_dir)
+    df = df.sort_values(ROW_COLUMN, kind='stable').drop(columns=ROW_COLUMN)
+    return df.rename(columns=rename).reset_index(drop=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert hospital CSVs into Parquet snapshots")
+    parser.add_argument("tables", nargs="*", default=list(SNAPSHOTS),
+                        help="Tables to convert (default: all)")
+    parser.add_argument("--base_dir", default=".", help="Directory holding the source CSVs")
+    parser.add_argument("--out", default=None, help=f"Output directory (default: <base_dir>/{SNAPSHOT_DIR})")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if pq is None:
+        raise SystemExit("pyarrow is required to write snapshots")
+    for name in args.tables:
+        source = os.path.join(args.base_dir, SNAPSHOTS[name].source)
+        if not os.path.exists(source):
+            print(f"Skipping {name}: {source} not found.")
+            continue
+        print(f"✔ {name} -> {write_snapshot(name, args.base_dir, args.out)}")
+
+
+if __name__ == '__main__':
+    main()
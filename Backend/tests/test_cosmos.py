@@ -0,0 +1,63 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from cosmos_memory import InMemoryContainer
+from cosmos_pool import ContainerPool, LoopThread
+
+
+@pytest.fixture
+def loop():
+    loop = LoopThread(name='test-loop')
+    yield loop
+    loop.loop.call_soon_threadsafe(loop.loop.stop)
+
+
+def test_every_thread_shares_one_loop_and_container(loop):
+    pool = ContainerPool(container=InMemoryContainer())
+
+    async def write(i):
+        container = await pool.container()
+        await container.upsert_item({'id': str(i)})
+        return threading.current_thread().name, id(container)
+
+    with ThreadPoolExecutor(8) as threads:
+        seen = set(threads.map(lambda i: loop.run(write(i), timeout=5), range(32)))
+    assert seen == {('test-loop', id(pool._container))}
+
+
+def test_replace_is_guarded_by_etag(loop):
+    container = InMemoryContainer([{'id': 'c', 'n': 1}])
+
+    async def bump():
+        current = await container.read_item('c', partition_key='c')
+        await container.replace_item('c', {'id': 'c', 'n': 2}, etag=current['_etag'],
+                                     match_condition=MatchConditions.IfNotModified)
+        with pytest.raises(exceptions.CosmosAccessConditionFailedError):
+            await container.replace_item('c', {'id': 'c', 'n': 3}, etag=current['_etag'],
+                                         match_condition=MatchConditions.IfNotModified)
+        return (await container.read_item('c', partition_key='c'))['n']
+
+    assert loop.run(bump(), timeout=5) == 2
+
+
+def test_query_filters_and_projects():
+    container = InMemoryContainer([
+        {'id': '1', 'type': 'user', 'email': 'a'},
+        {'id': '2', 'email': 'b'},
+        {'id': 'x', 'type': 'counter'},
+    ])
+
+    async def ids(query, **values):
+        parameters = [{'name': f'@{k}', 'value': v} for k, v in values.items()]
+        return sorted([item async for item in container.query_items(query, parameters)], key=str)
+
+    query = "SELECT c.id FROM c WHERE (NOT IS_DEFINED(c.type) OR c.type = @t)"
+    assert asyncio.run(ids(query, t='user')) == [{'id': '1'}, {'id': '2'}]
+    assert asyncio.run(ids("SELECT * FROM c WHERE c.email = @e", e='b'))[0]['id'] == '2'
+    with pytest.raises(exceptions.CosmosResourceNotFoundError):
+        asyncio.run(container.read_item('missing', partition_key='missing'))
@@ -0,0 +1,92 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from llm_batching import (
+    BatchCall, BatchedLLM, FakeBackend, LlamaCppBackend, MicroBatcher, OllamaBackend, render_prompt,
+)
+from llm_stream import SectionBudget, decode, new_usage
+
+
+def test_concurrent_calls_share_batches_by_options():
+    backend = FakeBackend(latency=0.05, reply=lambda prompt, options: f"{options.get('format')}:{prompt}")
+    batcher = MicroBatcher(backend, window=0.05, max_batch=8)
+    plain, as_json = BatchedLLM(batcher), BatchedLLM(batcher, format='json')
+    calls = [(plain, f'p{i}') for i in range(6)] + [(as_json, f'j{i}') for i in range(4)]
+    with ThreadPoolExecutor(len(calls)) as pool:
+        answers = list(pool.map(lambda call: call[0].invoke(call[1]), calls))
+    assert answers == [f'None:p{i}' for i in range(6)] + [f'json:j{i}' for i in range(4)]
+    assert sum(backend.batches) == 10 and len(backend.batches) < 10
+    assert batcher.stats()['calls'] == 10
+
+
+def test_answers_carry_token_counts_and_options_are_hashable():
+    batcher = MicroBatcher(FakeBackend(latency=0), window=0)
+    llm = BatchedLLM(batcher, stop=['\n6.'], num_predict=None)
+    assert llm.options == {'stop': ('\n6.',)}
+    answer = llm.invoke('hello there')
+    assert answer == 'echo: hello there' and answer.tokens == 3
+
+
+def test_stream_yields_text_as_it_is_decoded():
+    batcher = MicroBatcher(FakeBackend(latency=0, reply=lambda prompt, options: 'one two three'), window=0)
+    assert list(BatchedLLM(batcher).stream('q')) == ['one ', 'two ', 'three']
+
+
+def test_watchdog_cuts_a_batched_runaway_trace():
+    def reply(prompt, options):
+        return '1. A\n2. B' if options.get('reasoning') is False else '<think> ' + 'hmm ' * 2000
+    backend = FakeBackend(latency=0, per_token=0.001, reply=reply)
+    batcher = MicroBatcher(backend, window=0)
+    usage = new_usage()
+    out = ''.join(decode(BatchedLLM(batcher), 'q', usage, SectionBudget(10, 50),
+                         BatchedLLM(batcher, reasoning=False)))
+    assert out == '1. A\n2. B'
+    assert usage['forced'] and usage['think_tokens'] < 20
+    assert backend.cancelled == 1
+
+
+def http_client(handler):
+    return httpx.Client(transport=httpx.MockTransport(handler))
+
+
+def test_ollama_streams_and_tags_separate_reasoning():
+    def handler(request):
+        assert json.loads(request.content)['stream'] is True
+        parts = [{'thinking': 'plan'}, {'response': '1. A'}, {'response': '', 'done': True, 'eval_count': 7}]
+        return httpx.Response(200, text='\n'.join(json.dumps(p) for p in parts))
+    backend = OllamaBackend('m')
+    backend._client = http_client(handler)
+    call = BatchCall('q')
+    backend.generate_batch([call], {'reasoning': True})
+    assert list(call) == ['<think>', 'plan', '</think>', '1. A'] and call.tokens == 7
+
+
+def test_llamacpp_streams_each_prompt_of_a_batch():
+    def handler(request):
+        body = json.loads(request.content)
+        assert body['stream'] is True and len(body['prompt']) == 2
+        parts = [{'index': 1, 'content': 'b'}, {'index': 0, 'content': 'a'},
+                 {'index': 0, 'content': '', 'stop': True, 'tokens_predicted': 1},
+                 {'index': 1, 'content': '', 'stop': True, 'tokens_predicted': 1}]
+        return httpx.Response(200, text=''.join(f'data: {json.dumps(p)}\n\n' for p in parts))
+    backend = LlamaCppBackend()
+    backend._client = http_client(handler)
+    calls = [BatchCall('p0'), BatchCall('p1')]
+    backend.generate_batch(calls, {})
+    assert [''.join(call) for call in calls] == ['a', 'b']
+
+
+def test_fake_backend_renders_like_ollama_llm():
+    messages = [SystemMessage('system'), HumanMessage('question')]
+    assert FakeBackend().render(messages) == render_prompt(messages) == "System: system\nHuman: question"
+
+
+def test_llamacpp_thinking_prompts():
+    opened = "<|Assistant|><think>\n"
+    assert LlamaCppBackend._thinking(opened, None) == (opened, True)
+    assert LlamaCppBackend._thinking("<|Assistant|>", None) == ("<|Assistant|>", False)
+    prompt, tag = LlamaCppBackend._thinking("<|Assistant|>", False)
+    assert prompt.endswith("</think>\n\n") and "<think>" in prompt and not tag
@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from llm_scheduler import ROUTINE, URGENT, DeadlineExceeded, LLMScheduler, QueueFull, Ticket
+
+
+@pytest.fixture
+def busy():
+    """A one-worker scheduler whose worker is held until the test releases it."""
+    scheduler = LLMScheduler(1, max_queue=2, name='test')
+    release, started = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit(hold)
+    assert started.wait(5)
+    yield scheduler
+    release.set()
+
+
+def test_full_queue_rejects_same_priority(busy):
+    busy.submit_many([(lambda: 1,), (lambda: 2,)], Ticket(ROUTINE))
+    with pytest.raises(QueueFull) as e:
+        busy.submit(lambda: 3, ticket=Ticket(ROUTINE))
+    assert e.value.retry_after >= 1
+    with pytest.raises(QueueFull):
+        busy.check(1, ROUTINE)
+    assert busy.stats()['rejected'] == 2
+
+
+def test_urgent_request_evicts_routine_request_whole(busy):
+    routine = busy.submit_many([(lambda: 1,), (lambda: 2,)], Ticket(ROUTINE))
+    urgent = busy.submit(lambda: 'urgent', ticket=Ticket(URGENT))
+    for future in routine:
+        assert isinstance(future.exception(1), QueueFull)
+    stats = busy.stats()
+    assert stats['evicted'] == 2
+    assert stats['queued_by_priority'] == {'urgent': 1, 'routine': 0}
+    assert not urgent.done()
+
+
+def test_calls_queued_past_their_deadline_are_dropped(busy):
+    ticket = Ticket(ROUTINE, timeout=0.05)
+    future = busy.submit(lambda: 'late', ticket=ticket)
+    with pytest.raises(DeadlineExceeded):
+        ticket.result(future)
+
+
+def test_admission_is_all_or_nothing(busy):
+    busy.submit(lambda: 1, ticket=Ticket(ROUTINE))
+    with pytest.raises(QueueFull):
+        busy.submit_many([(lambda: 2,), (lambda: 3,)], Ticket(ROUTINE))
+    assert busy.depth() == 1
+
+
+def test_results_and_ticket_info():
+    scheduler = LLMScheduler(2, name='test')
+    ticket = Ticket(URGENT, timeout=5)
+    futures = scheduler.submit_many([(pow, 2, 3), (pow, 3, 2)], ticket)
+    assert [ticket.result(f) for f in futures] == [8, 9]
+    assert ticket.info()['priority'] == 'urgent'
+    assert ticket.info()['queue_depth'] == 0
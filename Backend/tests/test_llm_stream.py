@@ -0,0 +1,83 @@
+import pytest
+
+from llm_stream import (
+    SectionBudget, StopFilter, ThinkStripper, UnfinishedReasoning, clean_response, decode, new_usage,
+)
+
+TEXTS = [
+    "<think>plan the list</think>1. A\n2. B",
+    "no reasoning at all",
+    "<think>a</think>x<think>b</think>y",
+    "<think>never closed",
+    "a < b <th and </think> stays",
+]
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize('text', TEXTS)
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 1000])
+def test_think_stripper_matches_clean_response_at_any_split(text, size):
+    stripper = ThinkStripper()
+    out = ''.join(stripper.feed(chunk) for chunk in chunked(text, size)) + stripper.flush()
+    assert out.strip() == clean_response(text)
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 1000])
+def test_stop_filter_ends_at_first_stop_across_chunks(size):
+    stops = StopFilter(('\n6.', '\n6)'))
+    text = "1. A\n2. B\n3. C\n4. D\n5. E\n6. F\n7. G"
+    out = ''.join(stops.feed(chunk) for chunk in chunked(text, size)) + stops.flush()
+    assert out == "1. A\n2. B\n3. C\n4. D\n5. E"
+    assert stops.stopped
+
+
+def test_stop_filter_releases_a_partial_stop_that_was_not_one():
+    stops = StopFilter(('\n6.',))
+    assert stops.feed("5. E\n6") == "5. E"
+    assert stops.feed("0 mg") == "\n60 mg"
+    assert not stops.stopped
+
+
+class Scripted:
+    """Streams `text` in two-character chunks and records whether it was closed."""
+
+    def __init__(self, text):
+        self.text = text
+        self.closed = False
+        self.prompts = []
+
+    def stream(self, messages):
+        self.prompts.append(messages)
+        try:
+            yield from chunked(self.text, 2)
+        finally:
+            self.closed = True
+
+
+ANSWER = "1. A\n2. B\n3. C\n4. D\n5. E\n6. F"
+BUDGET = SectionBudget(10, 50, ('\n6.',))
+
+
+def test_decode_counts_tokens_and_stops_after_five_items():
+    llm, usage = Scripted("<think>short</think>" + ANSWER), new_usage()
+    assert ''.join(decode(llm, 'prompt', usage, BUDGET)) == ANSWER[:ANSWER.index('\n6.')]
+    assert llm.closed
+    assert usage['think_tokens'] and usage['tokens'] > usage['think_tokens']
+    assert not usage['forced']
+
+
+@pytest.mark.parametrize('reasoning', ["<think>" + "x " * 40 + "</think>" + ANSWER, "<think>truncated"])
+def test_runaway_or_unfinished_reasoning_is_never_returned(reasoning):
+    llm, force, usage = Scripted(reasoning), Scripted(ANSWER), new_usage()
+    out = ''.join(decode(llm, 'prompt', usage, BUDGET, force))
+    assert out == ANSWER[:ANSWER.index('\n6.')]
+    assert usage['forced'] and llm.closed
+    assert force.prompts[0].startswith('prompt') and force.prompts[0] != 'prompt'
+
+
+def test_unfinished_reasoning_without_a_force_model_raises():
+    with pytest.raises(UnfinishedReasoning):
+        ''.join(decode(Scripted("<think>" + "x " * 40), 'prompt', new_usage(), BUDGET))
@@ -0,0 +1,23 @@
+import datetime
+
+from record_store import RecordStore
+
+VISIT = datetime.date(2023, 9, 11)
+
+
+def test_lab_request_numbers_stay_text_and_key_lab_results(tmp_path):
+    (tmp_path / 'lab_request.csv').write_text(
+        "MR_CODE,MR_VISIT_DATE,LRS_NO,LAB_TEST\n"
+        "0100,9/11/2023 12:00:00 AM,0061,LFT\n"
+        "0100,9/11/2023 12:00:00 AM,,CBC\n"
+    )
+    (tmp_path / 'lab_result.csv').write_text(
+        "LRS_NO,INSERT_DT,PARAMETER,RESULT\n"
+        "0061,9/11/2023 1:00:00 PM,HB,3.88\n"
+        "61,9/11/2023 1:00:00 PM,HB,9.99\n"
+    )
+    store = RecordStore(base_dir=str(tmp_path))
+    requests = store.rows('lab_request', '0100', VISIT)
+    assert requests['LRS_NO'].tolist() == ['0061', None]
+    results = store.rows_many('lab_result', requests['LRS_NO'].unique(), VISIT)
+    assert results['RESULT'].tolist() == [3.88]
@@ -0,0 +1,96 @@
+import importlib
+import sys
+
+import pandas as pd
+import pytest
+
+from training_store import TRAINING_CSV
+
+VISIT = {'mr_code': '1001', 'visit_date': '1/2/2023'}
+DOCTOR = {'name': 'doc', 'password': 'pw', 'email': 'Doc@Hospital.com', 'department': 'NICU'}
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    """The Flask app on an InMemoryContainer, the fake LLM backend and a
+    one-visit training table."""
+    base = tmp_path_factory.mktemp('records')
+    pd.DataFrame({
+        'MR_CODE': [1001], 'MR_SEX': ['F'], 'AGE_AT_VISIT': [3],
+        'PRESENTING_COMPLAIN': ['FEVER'], 'VISIT_DATE': ['2023-01-02'],
+    }).to_csv(base / TRAINING_CSV, index=False)
+
+    patch = pytest.MonkeyPatch()
+    patch.chdir(base)
+    for name, value in {'COSMOS_BACKEND': 'memory', 'LLM_BACKEND': 'fake', 'SESSION_SECRET': 'test',
+                        'RECOMMEND_CACHE': 'memory', 'LLM_WARM': '0'}.items():
+        patch.setenv(name, value)
+    sys.modules.pop('app', None)
+    module = importlib.import_module('app')
+    yield module
+    patch.undo()
+    sys.modules.pop('app', None)
+
+
+@pytest.fixture(scope='module')
+def client(app_module):
+    client = app_module.app.test_client()
+    assert client.post('/add_user', json=DOCTOR).json['status'] == 'success'
+    return client
+
+
+@pytest.fixture
+def token(client):
+    return client.post('/validate_user', json={'email': DOCTOR['email'], 'password': 'pw'}).json['token']
+
+
+def test_add_user_allocates_sequential_ids(client):
+    first = client.post('/add_user', json={**DOCTOR, 'email': 'a@hospital.com'}).json
+    second = client.post('/add_user', json={**DOCTOR, 'email': 'b@hospital.com'}).json
+    assert second['user_id'] == first['user_id'] + 1
+    assert first['department'] == 'NICU'
+
+
+def test_validate_user_issues_a_token(client):
+    response = client.post('/validate_user', json={'email': 'doc@hospital.com ', 'password': 'pw'})
+    assert response.status_code == 200
+    body = response.json
+    assert body['user']['department'] == 'NICU'
+    assert body['user']['token'] == body['token']
+
+
+def test_validate_user_rejects_a_wrong_password(client):
+    response = client.post('/validate_user', json={'email': DOCTOR['email'], 'password': 'nope'})
+    assert response.status_code == 401
+    assert response.json['status'] == 'failure'
+
+
+def test_recommend_with_a_token_then_from_the_cache(client, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    first = client.post('/recommend', json=VISIT, headers=headers)
+    assert first.status_code == 200
+    result = first.json[0]
+    assert result['status'] == 'success' and not result['cached']
+    assert all(result[section] for section in ('diagnoses', 'lab_requests', 'medications'))
+    again = client.post('/recommend', json=VISIT, headers=headers).json[0]
+    assert again['cached'] and again['diagnoses'] == result['diagnoses']
+
+
+def test_recommend_with_email_and_password(client):
+    response = client.post('/recommend', json={**VISIT, 'email': DOCTOR['email'], 'password': 'pw'})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('auth', [
+    {'headers': {'Authorization': 'Bearer forged'}},
+    {'json': {'user': {'userid': '1', 'department': 'NICU'}}},
+    {'json': {'email': DOCTOR['email'], 'password': 'nope'}},
+])
+def test_recommend_rejects_unauthenticated_requests(client, auth):
+    response = client.post('/recommend', json={**VISIT, **auth.get('json', {})}, headers=auth.get('headers'))
+    assert response.status_code == 401
+
+
+def test_recommend_rejects_a_bad_timeout(client, token):
+    response = client.post('/recommend', json={**VISIT, 'token': token, 'timeout': 'soon'})
+    assert response.status_code == 400
@@ -0,0 +1,59 @@
+import pytest
+
+import sessions
+from sessions import SessionStore
+
+USER = {'userid': '42', 'username': 'a', 'department': 'NICU'}
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sessions.time, 'time', clock)
+    return clock
+
+
+def test_missing_secret_warns_and_signs_per_process(monkeypatch, capsys):
+    monkeypatch.delenv('SESSION_SECRET', raising=False)
+    store = SessionStore()
+    assert 'SESSION_SECRET' in capsys.readouterr().out
+    assert store.verify(store.issue(USER))['uid'] == '42'
+    assert SessionStore().verify(store.issue(USER)) is None
+
+
+def test_token_verifies_across_stores_sharing_the_secret():
+    token = SessionStore('s').issue(USER)
+    other = SessionStore('s')
+    claims = other.verify(token)
+    assert claims['uid'] == '42'
+    assert other.get(claims) is None  # not cached in this worker yet
+    assert SessionStore('different').verify(token) is None
+
+
+def test_revoke_drops_every_session_of_the_user():
+    store = SessionStore('s')
+    first, second = store.verify(store.issue(USER)), store.verify(store.issue(USER))
+    other = store.verify(store.issue({**USER, 'userid': '7'}))
+    store.revoke_user('42')
+    assert store.get(first) is None and store.get(second) is None
+    assert store.get(other)['userid'] == '7'
+
+
+def test_cached_user_is_rechecked_and_token_expires(clock):
+    store = SessionStore('s', ttl=100, recheck=10)
+    claims = store.verify(store.issue(USER))
+    assert store.get(claims) == USER
+    clock.now += 11
+    assert store.get(claims) is None  # re-read from Cosmos after `recheck`
+
+    token = store.issue(USER)
+    clock.now += 101
+    assert store.verify(token) is None
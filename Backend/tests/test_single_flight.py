@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+from llm_scheduler import DeadlineExceeded, Ticket
+from single_flight import SingleFlight
+
+
+def test_followers_share_the_leaders_result():
+    flights, release = SingleFlight(), threading.Event()
+    calls, results = [], []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return 'sections'
+
+    leader = threading.Thread(target=lambda: results.append(flights.do('k', work)))
+    leader.start()
+    while not flights.in_flight():
+        pass
+    follower = threading.Thread(target=lambda: results.append(flights.do('k', work)))
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(calls) == 1
+    assert sorted(results) == [('sections', False), ('sections', True)]
+
+
+def test_follower_gives_up_at_its_deadline():
+    flights, release = SingleFlight(), threading.Event()
+    leader = threading.Thread(target=flights.do, args=('k', lambda: release.wait(5)))
+    leader.start()
+    while not flights.in_flight():
+        pass
+    with pytest.raises(DeadlineExceeded):
+        flights.do('k', lambda: None, wait=Ticket(timeout=0.05).result)
+    release.set()
+    leader.join(5)
+
+
+def test_leader_error_reaches_followers():
+    flights = SingleFlight()
+    future, leader = flights.begin('k')
+    follower, is_leader = flights.begin('k')
+    assert leader and not is_leader
+    flights.finish('k', error=RuntimeError('boom'))
+    with pytest.raises(RuntimeError):
+        follower.result(1)
+    assert flights.in_flight() == 0
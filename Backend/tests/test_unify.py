@@ -0,0 +1,65 @@
+import main
+from bench_unify import write_synthetic
+
+
+def test_chunked_build_matches_whole_tables_with_blanks_in_one_chunk(tmp_path, monkeypatch):
+    # write_synthetic leaves VITAL_PAIN and INT_CODE blank in the last row only
+    write_synthetic(tmp_path, 60)
+    monkeypatch.chdir(tmp_path)
+
+    whole = main.build().to_csv(index=False)
+    chunked = main.build(chunks=16, chunksize=5, workdir=str(tmp_path)).to_csv(index=False)
+    assert chunked == whole
+    assert '|1.0' in whole
+
+
+def append(path, *lines):
+    with open(path, 'a') as f:
+        f.write(''.join(line + '\n' for line in lines))
+
+
+def full_output(folder):
+    main.write_output(main.build(), str(folder / 'full.csv'))
+    return (folder / 'full.csv').read_bytes()
+
+
+def test_incremental_upserts_appended_rows_in_place(tmp_path, monkeypatch):
+    write_synthetic(tmp_path, 40)
+    monkeypatch.chdir(tmp_path)
+    out = tmp_path / 'out.csv'
+    main.rebuild_with_state(str(out))
+    before = out.read_bytes()
+
+    # a new visit for a known patient and a new patient only add rows at the end
+    append('presinting_complain.csv', '100003,3/2/2024 12:00:00 AM,cough,"2\ndays"')
+    append('vitals.csv', '100003,3/2/2024 12:00:00 AM,3/2/2024 12:00:00 AM,120,80,37.1,90,20,150,60,97,3')
+    append('medication.csv', '100003,3/2/2024 12:00:00 AM,3/2/2024 9:00:00 AM,ORS,,2')
+    append('mr_registiration.csv', '200000,2/2/2024,M,1/1/2010')
+    append('presinting_complain.csv', '200000,3/3/2024 12:00:00 AM,rash,1 days')
+    assert len(main.build_incremental(str(out))) == 2
+    patched = out.read_bytes()
+    assert patched.startswith(before)
+    assert patched == full_output(tmp_path)
+
+    # a result for the first patient's lab request changes a visit at the top
+    append('LAB_RRESULT_ENTERY.csv', '1,6/8/2023 1:00:00 PM,ESR,12.5,CRP')
+    assert len(main.build_incremental(str(out))) < 5
+    assert out.read_bytes() == full_output(tmp_path)
+    assert main.build_incremental(str(out)) is None
+
+
+def test_incremental_rebuilds_when_appended_rows_change_column_types(tmp_path, monkeypatch):
+    write_synthetic(tmp_path, 30)
+    monkeypatch.chdir(tmp_path)
+    out = tmp_path / 'out.csv'
+    main.rebuild_with_state(str(out))
+
+    # a blank pulse turns the whole VITAL_PULSE column float
+    append('presinting_complain.csv', '100002,3/2/2024 12:00:00 AM,cough,2 days')
+    append('vitals.csv', '100002,3/2/2024 12:00:00 AM,3/2/2024 12:00:00 AM,120,80,37.1,,20,150,60,97,3')
+    main.build_incremental(str(out))
+    assert out.read_bytes() == full_output(tmp_path)
+
+    append('vitals.csv', '100002,3/2/2024 12:00:00 AM,3/2/2024 12:00:00 AM,121,80,37.1,,20,150,60,97,3')
+    main.build_incremental(str(out))
+    assert out.read_bytes() == full_output(tmp_path)
@@ -0,0 +1,53 @@
+import asyncio
+
+from cosmos_memory import InMemoryContainer
+from user_ids import USER_FILTER, USER_ID_COUNTER, USER_TYPE_PARAM, allocate_user_ids
+
+
+class InterleavingContainer(InMemoryContainer):
+    """Yields to the loop between reading and replacing, as a real round trip does."""
+
+    def __init__(self, items=None):
+        super().__init__(items)
+        self.conflicts = 0
+
+    async def read_item(self, item, partition_key, **kwargs):
+        result = await super().read_item(item, partition_key, **kwargs)
+        await asyncio.sleep(0)
+        return result
+
+    async def replace_item(self, item, body, **kwargs):
+        try:
+            return await super().replace_item(item, body, **kwargs)
+        except Exception:
+            self.conflicts += 1
+            raise
+
+
+def test_concurrent_allocations_never_share_an_id():
+    container = InterleavingContainer([{'id': '7', 'type': 'user'}, {'id': '3'}])
+
+    async def allocate_all():
+        return await asyncio.gather(*(allocate_user_ids(container, count) for count in [1, 2, 1, 3] * 10))
+
+    ranges = asyncio.run(allocate_all())
+    ids = [i for r in ranges for i in r]
+    assert container.conflicts > 0
+    assert len(ids) == len(set(ids)) == 70
+    assert sorted(ids) == list(range(8, 78))
+
+
+def test_counter_seed_ignores_non_user_documents():
+    container = InMemoryContainer([
+        {'id': '5', 'type': 'user'},
+        {'id': '9'},  # created before documents were typed
+        {'id': '12345', 'type': 'email_index', 'user_id': '5'},
+    ])
+    assert asyncio.run(allocate_user_ids(container)) == range(10, 11)
+
+    async def user_ids():
+        query = f"SELECT c.id FROM c WHERE {USER_FILTER}"
+        return sorted([item['id'] async for item in container.query_items(query, [USER_TYPE_PARAM])])
+
+    assert asyncio.run(user_ids()) == ['5', '9']
+    assert asyncio.run(container.read_item(USER_ID_COUNTER, USER_ID_COUNTER))['type'] == 'counter'
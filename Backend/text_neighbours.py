@@ -0,0 +1,166 @@
+"""Nearest-neighbour search over L2-normalised sparse rows (TF-IDF vectors).
+
+Both indexes answer `search(Q, k)` with two (queries, k) arrays: row
+positions in the indexed matrix, best first (ties go to the lower row, as
+`np.argmax` would), and their cosine similarities. Slots beyond a query's
+matches are -1 / 0.0.
+
+`ExactIndex` computes similarities with blocked sparse matrix products,
+so only terms shared by a query and a row cost anything. `LSHIndex`
+buckets rows by random-hyperplane signatures (SimHash) over several
+tables and reranks the bucket candidates exactly; it can be saved and
+loaded so later runs skip hashing the indexed rows.
+"""
+import numpy as np
+from scipy import sparse
+
+QUERY_BLOCK = 512
+# cells of one dense similarity block (float64): 128 MiB
+DENSE_CELLS = 1 << 24
+
+
+def top_k_sparse(sims, k):
+    """Best `k` columns per row of a sparse similarity matrix."""
+    sims = sparse.csr_matrix(sims)
+    sims.eliminate_zeros()
+    m = sims.shape[0]
+    counts = np.diff(sims.indptr)
+    rows = np.repeat(np.arange(m), counts)
+    order = np.lexsort((sims.indices, -sims.data, rows))
+    cols, vals = sims.indices[order], sims.data[order]
+    rank = np.arange(len(rows)) - np.repeat(sims.indptr[:-1], counts)
+    keep = rank < k
+
+    idx = np.full((m, k), -1, dtype=np.int64)
+    best = np.zeros((m, k), dtype=np.float64)
+    idx[rows[keep], rank[keep]] = cols[keep]
+    best[rows[keep], rank[keep]] = vals[keep]
+    return idx, best
+
+
+def top_k_dense(sims, k):
+    """`top_k_sparse` for a dense block: only entries reaching each row's
+    k-th best score are ranked, so ties still go to the lower column."""
+    k_eff = min(k, sims.shape[1])
+    if k_eff == 0:
+        return top_k_sparse(sparse.csr_matrix(sims.shape), k)
+    kth = -np.partition(-sims, k_eff - 1, axis=1)[:, k_eff - 1:k_eff]
+    return top_k_sparse(sparse.csr_matrix(np.where(sims >= kth, sims, 0)), k)
+
+
+def stack_results(parts, k):
+    if not parts:
+        return np.empty((0, k), dtype=np.int64), np.empty((0, k), dtype=np.float64)
+    return np.vstack([p[0] for p in parts]), np.vstack([p[1] for p in parts])
+
+
+class ExactIndex:
+    kind = 'exact'
+
+    def __init__(self, X, block: int = QUERY_BLOCK):
+        self.X = sparse.csr_matrix(X, dtype=np.float64)
+        self._XT = self.X.T.tocsr()
+        # query rows per block, capped so a dense block stays within DENSE_CELLS
+        self.block = max(1, min(block, DENSE_CELLS // max(1, self.X.shape[0])))
+
+    def search(self, Q, k: int = 1):
+        Q = sparse.csr_matrix(Q, dtype=np.float64)
+        parts = [
+            top_k_dense((Q[start:start + self.block] @ self._XT).toarray(), k)
+            for start in range(0, Q.shape[0], self.block)
+        ]
+        return stack_results(parts, k)
+
+
+class LSHIndex:
+    """Random-projection LSH: `tables` hash tables of `bits`-bit signatures.
+
+    A bucket contributes at most `max_bucket` candidates (its lowest rows),
+    which bounds the rerank cost when many rows share a text. Queries with
+    no candidate fall back to the exact search when `exact_fallback` is set.
+    The defaults favour recall over speed: see remove_sparcity's docstring
+    for measured agreement with `ExactIndex`.
+    """
+    kind = 'lsh'
+
+    def __init__(self, X, bits: int = 6, tables: int = 32, max_bucket: int = 1024,
+                 seed: int = 0, exact_fallback: bool = True, block: int = QUERY_BLOCK,
+                 fingerprint: str = '', _planes=None, _codes=None):
+        self.X = sparse.csr_matrix(X, dtype=np.float64)
+        self.bits = bits
+        self.tables = tables
+        self.max_bucket = max_bucket
+        self.seed = seed
+        self.exact_fallback = exact_fallback
+        self.block = block
+        self.fingerprint = fingerprint
+        if _planes is None:
+            rng = np.random.default_rng(seed)
+            _planes = rng.standard_normal((self.X.shape[1], bits * tables)).astype(np.float32)
+        self.planes = _planes
+        self.codes = self.signatures(self.X) if _codes is None else _codes
+        self._order = np.argsort(self.codes, axis=0, kind='stable')
+        self._sorted = np.take_along_axis(self.codes, self._order, axis=0)
+        self._exact = None
+
+    def signatures(self, X, block: int = 65_536):
+        weights = np.int64(1) << np.arange(self.bits, dtype=np.int64)
+        out = np.empty((X.shape[0], self.tables), dtype=np.int64)
+        for start in range(0, X.shape[0], block):
+            proj = np.asarray(X[start:start + block] @ self.planes)
+            signs = (proj > 0).reshape(len(proj), self.tables, self.bits)
+            out[start:start + block] = (signs * weights).sum(axis=2)
+        return out
+
+    def candidates(self, qcodes):
+        """(query, row) pairs sharing a bucket in any table, deduplicated."""
+        pairs = []
+        for t in range(self.tables):
+            lo = np.searchsorted(self._sorted[:, t], qcodes[:, t], 'left')
+            hi = np.searchsorted(self._sorted[:, t], qcodes[:, t], 'right')
+            counts = np.minimum(hi - lo, self.max_bucket)
+            queries = np.repeat(np.arange(len(qcodes)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            rows = self._order[np.repeat(lo, counts) + offsets, t]
+            pairs.append(queries * self.X.shape[0] + rows)
+        pairs = np.unique(np.concatenate(pairs)) if pairs else np.empty(0, dtype=np.int64)
+        return pairs // self.X.shape[0], pairs % self.X.shape[0]
+
+    def _search_block(self, Q, k):
+        queries, rows = self.candidates(self.signatures(Q))
+        sims = np.asarray(Q[queries].multiply(self.X[rows]).sum(axis=1)).ravel()
+        matrix = sparse.csr_matrix((sims, (queries, rows)), shape=(Q.shape[0], self.X.shape[0]))
+        return top_k_sparse(matrix, k)
+
+    def search(self, Q, k: int = 1):
+        Q = sparse.csr_matrix(Q, dtype=np.float64)
+        idx, sims = stack_results([
+            self._search_block(Q[start:start + self.block], k)
+            for start in range(0, Q.shape[0], self.block)
+        ], k)
+        missed = np.flatnonzero((idx[:, 0] < 0) & (Q.getnnz(axis=1) > 0))
+        if self.exact_fallback and len(missed):
+            if self._exact is None:
+                self._exact = ExactIndex(self.X, self.block)
+            idx[missed], sims[missed] = self._exact.search(Q[missed], k)
+        return idx, sims
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            data=self.X.data, indices=self.X.indices, indptr=self.X.indptr,
+            shape=np.array(self.X.shape), planes=self.planes, codes=self.codes,
+            params=np.array([self.bits, self.tables, self.max_bucket, self.seed]),
+            fingerprint=np.array(self.fingerprint),
+        )
+
+    @classmethod
+    def load(cls, path: str, exact_fallback: bool = True, block: int = QUERY_BLOCK):
+        with np.load(path) as saved:
+            X = sparse.csr_matrix(
+                (saved['data'], saved['indices'], saved['indptr']), shape=tuple(saved['shape'])
+            )
+            bits, tables, max_bucket, seed = (int(v) for v in saved['params'])
+            return cls(X, bits, tables, max_bucket, seed, exact_fallback, block,
+                       fingerprint=str(saved['fingerprint']),
+                       _planes=saved['planes'], _codes=saved['codes'])
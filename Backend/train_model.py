@@ -1,24 +1,68 @@
+"""Fine-tune the lab-test recommendation model.
 
+    python train_model.py                              # dynamic padding, length-grouped batches
+    python train_model.py --packing                    # pack cases into max_seq_length blocks
+    python train_model.py --no-group_by_length --num_proc 4
+    python train_model.py --smoke --smoke_report smoke.json   # CPU only, no download
+
+The training CSV is streamed in `--chunksize` row blocks into an on-disk
+Arrow dataset, then tokenized without padding in `--num_proc` processes.
+The tokenized (and, with `--packing`, packed) dataset is saved under
+`--cache_dir`, keyed by the CSV contents, the tokenizer, the chat
+template, `--max_seq_length` and `--packing`, so later runs load it
+instead of preprocessing again. Batches are padded only to their longest
+case (rounded up to a multiple of 8). With `--group_by_length` (on by
+default) each batch holds cases of similar length.
+
+`--smoke` needs no GPU and downloads nothing. It writes a synthetic
+training table, trains a small BPE tokenizer on it and builds a
+randomly initialised two-layer Llama. It then reports throughput for
+building records (`load_medical_data`), tokenization, collation (with the
+share of padding), and tokens/sec over `--smoke_steps` CPU optimizer
+steps, so pipeline regressions show up without a GPU run.
+"""
 import os
+import json
+import time
+import random
+import hashlib
 import argparse
+import tempfile
 import multiprocessing
 from pathlib import Path
 import subprocess
 
+try:
+    # unsloth patches transformers, so it is imported first; it refuses to load without a GPU
+    from unsloth import FastLanguageModel, to_sharegpt, standardize_sharegpt, apply_chat_template
+except (ImportError, NotImplementedError):
+    FastLanguageModel = None
+
 import torch
 import pandas as pd
-from datasets import Dataset
-from unsloth import FastLanguageModel, to_sharegpt, standardize_sharegpt, apply_chat_template
+from datasets import Dataset, load_from_disk
+from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+from torch.utils.data import DataLoader
 from transformers import (
     TrainingArguments,
     DataCollatorForSeq2Seq,
     EarlyStoppingCallback,
+    LlamaConfig,
+    LlamaForCausalLM,
+    PreTrainedTokenizerFast,
 )
 from trl import SFTTrainer
 from transformers.trainer_callback import TrainerCallback
+from transformers.trainer_pt_utils import LengthGroupedSampler
 from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
 from huggingface_hub import snapshot_download
 
+from etl_common import as_text, file_digest
+
+CHAT_TEMPLATE = "You are a clinical support system.\nPatient Case:\n{INPUT}\nRecommended Tests:\n{OUTPUT}"
+# bump when the record format or tokenization changes, to invalidate cached datasets
+DATASET_VERSION = 1
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Fine-tune LLM for lab-test recommendation")
@@ -33,26 +77,285 @@ def parse_args():
     parser.add_argument("--seed", type=int, default=42)
     parser.add_argument("--offline", action="store_true",
                         help="Load model from local cache without downloading")
+    parser.add_argument("--max_seq_length", type=int, default=1024,
+                        help="Truncate (or pack) tokenized cases to this many tokens")
+    parser.add_argument("--cache_dir", type=Path, default=Path("tokenized_cache"),
+                        help="Where tokenized datasets are saved for reuse")
+    parser.add_argument("--chunksize", type=int, default=50_000,
+                        help="CSV rows read per block while building the dataset")
+    parser.add_argument("--num_proc", type=int, default=None,
+                        help="Tokenization processes (default: CPU count - 2)")
+    parser.add_argument("--group_by_length", action=argparse.BooleanOptionalAction, default=True,
+                        help="Batch cases of similar token length together")
+    parser.add_argument("--packing", action="store_true",
+                        help="Pack whole cases into max_seq_length blocks instead of padding")
+    parser.add_argument("--smoke", action="store_true",
+                        help="CPU-only pipeline benchmark: synthetic CSV, tiny random model")
+    parser.add_argument("--smoke_rows", type=int, default=5000,
+                        help="Rows of the synthetic training table")
+    parser.add_argument("--smoke_steps", type=int, default=5,
+                        help="Optimizer steps timed in the smoke run")
+    parser.add_argument("--smoke_report", type=Path,
+                        help="Also write the smoke throughput figures to this JSON file")
     return parser.parse_args()
 
 
-def load_medical_data(csv_path: Path) -> Dataset:
-    df = pd.read_csv(csv_path)
-    df.dropna(subset=["LAB_REQUESTS", "PRESENTING_COMPLAIN"], inplace=True)
+# — Records —
+
+def format_instructions(df: pd.DataFrame) -> pd.Series:
+    """The patient-info prompt of every row."""
+    # `DIAGNOSIS or FINAL_DIAGNOSIS`: only a falsy diagnosis ('' or 0) falls back
+    diagnosis = df["DIAGNOSIS"].where(df["DIAGNOSIS"].astype(bool), df["FINAL_DIAGNOSIS"])
+    return (
+        "Patient Info:\n"
+        + "- Sex: " + as_text(df["MR_SEX"]) + "; Age: " + as_text(df["AGE_AT_VISIT"]) + "\n"
+        + "- Complaint: " + as_text(df["PRESENTING_COMPLAIN"]) + "\n"
+        + "- Vitals: BP " + as_text(df["BP_SYSTOLIC"]) + "/" + as_text(df["BP_DIASTOLIC"])
+        + " mmHg, Temp " + as_text(df["TEMP"]) + "°C\n"
+        + "- Diagnosis: " + as_text(diagnosis)
+    )
+
+
+def iter_records(csv_path: str, chunksize: int, digest: str = ""):
+    """Instruction records, one CSV block at a time. `digest` only keys the cache."""
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+        chunk = chunk.dropna(subset=["LAB_REQUESTS", "PRESENTING_COMPLAIN"])
+        if chunk.empty:
+            continue
+        records = pd.DataFrame({
+            "instruction": format_instructions(chunk).to_numpy(dtype=object),
+            "input": "",
+            "output": as_text(chunk["LAB_REQUESTS"]).to_numpy(dtype=object),
+        })
+        yield from records.to_dict("records")
+
+
+def load_medical_data(csv_path: Path, chunksize: int = 50_000, cache_dir: Path = None) -> Dataset:
+    """Stream the CSV into an Arrow dataset without holding the table in memory."""
+    digest = file_digest(csv_path, os.path.getsize(csv_path))
+    return Dataset.from_generator(
+        iter_records,
+        gen_kwargs={"csv_path": str(csv_path), "chunksize": chunksize, "digest": digest},
+        cache_dir=str(cache_dir) if cache_dir else None,
+    )
+
+
+# — Tokenized dataset —
+
+def dataset_key(args, tokenizer) -> str:
+    """Digest of everything the tokenized dataset depends on."""
+    key = hashlib.sha256()
+    for part in (
+        DATASET_VERSION,
+        file_digest(args.data, os.path.getsize(args.data)),
+        tokenizer.name_or_path, len(tokenizer), tokenizer.eos_token,
+        CHAT_TEMPLATE, args.max_seq_length, args.packing,
+    ):
+        key.update(str(part).encode("utf-8") + b"\0")
+    return key.hexdigest()[:16]
+
 
-    def format_inst(row):
-        return (
-            f"Patient Info:\n"
-            f"- Sex: {row['MR_SEX']}; Age: {row['AGE_AT_VISIT']}\n"
-            f"- Complaint: {row['PRESENTING_COMPLAIN']}\n"
-            f"- Vitals: BP {row['BP_SYSTOLIC']}/{row['BP_DIASTOLIC']} mmHg, Temp {row['TEMP']}°C\n"
-            f"- Diagnosis: {row.get('DIAGNOSIS') or row.get('FINAL_DIAGNOSIS')}"
+def tokenize_batch(batch, tokenizer, max_length):
+    """Unpadded token ids; labels are the ids, masked to -100 only when padded."""
+    out = tokenizer(batch["text"], truncation=True, max_length=max_length)
+    out["labels"] = [list(ids) for ids in out["input_ids"]]
+    out["length"] = [len(ids) for ids in out["input_ids"]]
+    return out
+
+
+def pack_batch(batch, block):
+    """Greedily pack whole cases, in order, into sequences of at most `block` tokens.
+
+    A case never spans two sequences, and each keeps the EOS token the chat
+    template appends, so cases stay separated inside a sequence.
+    """
+    packed = {"input_ids": [], "attention_mask": [], "labels": [], "length": []}
+    ids, labels = [], []
+    for case_ids, case_labels in zip(batch["input_ids"], batch["labels"]):
+        if ids and len(ids) + len(case_ids) > block:
+            packed["input_ids"].append(ids)
+            packed["labels"].append(labels)
+            ids, labels = [], []
+        ids.extend(case_ids)
+        labels.extend(case_labels)
+    if ids:
+        packed["input_ids"].append(ids)
+        packed["labels"].append(labels)
+    packed["attention_mask"] = [[1] * len(seq) for seq in packed["input_ids"]]
+    packed["length"] = [len(seq) for seq in packed["input_ids"]]
+    return packed
+
+
+def tokenize_dataset(ds: Dataset, tokenizer, max_length: int, packing: bool, num_proc: int) -> Dataset:
+    """Tokenize the `text` column (then pack it, with `packing`) in `num_proc` processes."""
+    ds = ds.map(
+        tokenize_batch, fn_kwargs={"tokenizer": tokenizer, "max_length": max_length},
+        batched=True, batch_size=1000, num_proc=num_proc, remove_columns=ds.column_names,
+        desc="Tokenizing",
+    )
+    if packing:
+        ds = ds.map(
+            pack_batch, fn_kwargs={"block": max_length},
+            batched=True, batch_size=1000, num_proc=num_proc, remove_columns=ds.column_names,
+            desc="Packing",
         )
+    return ds
+
+
+def prepare_dataset(args, tokenizer, num_proc: int) -> Dataset:
+    """The tokenized training set, loaded from `--cache_dir` when already built."""
+    path = args.cache_dir / f"tokenized-{dataset_key(args, tokenizer)}"
+    if (path / "dataset_info.json").exists():
+        print(f"Loading tokenized dataset from {path}")
+        return load_from_disk(str(path))
+
+    raw_ds = load_medical_data(args.data, args.chunksize, args.cache_dir / "raw")
+    ds = to_sharegpt(raw_ds, merged_prompt="{instruction}\n\nContext:\n{input}", output_column_name="output")
+    ds = standardize_sharegpt(ds)
+    ds = apply_chat_template(ds, tokenizer, CHAT_TEMPLATE)
+    ds = tokenize_dataset(ds, tokenizer, args.max_seq_length, args.packing, num_proc)
+
+    ds.save_to_disk(str(path))
+    lengths = ds["length"]
+    (path / "stats.json").write_text(json.dumps({
+        "examples": len(ds), "tokens": int(sum(lengths)),
+        "max_length": int(max(lengths, default=0)), "packing": args.packing,
+    }, indent=2))
+    print(f"Saved tokenized dataset ({len(ds)} sequences) to {path}")
+    return load_from_disk(str(path))
+
+
+# — Smoke run —
+
+SMOKE_COMPLAINTS = ["fever", "cough", "loose motions", "vomiting", "abdominal pain",
+                    "headache", "shortness of breath", "rash", "burning micturition"]
+SMOKE_TESTS = ["CBC", "LFT", "RFT", "ESR", "CRP", "TSH", "URINE R/E", "BLOOD C/S", "SERUM ELECTROLYTES"]
 
-    records = []
-    for _, row in df.iterrows():
-        records.append({"instruction": format_inst(row), "input": "", "output": row["LAB_REQUESTS"]})
-    return Dataset.from_pandas(pd.DataFrame(records))
+
+def write_synthetic_table(path: Path, rows: int, seed: int = 0):
+    """A unified_training_table.csv with the columns the records are built from."""
+    rng = random.Random(seed)
+    table = []
+    for i in range(rows):
+        table.append({
+            "MR_CODE": 100000 + i // 3,
+            "VISIT_DATE": f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "MR_SEX": rng.choice("MF"),
+            "AGE_AT_VISIT": round(rng.uniform(0, 16), 1),
+            "PRESENTING_COMPLAIN": ", ".join(rng.sample(SMOKE_COMPLAINTS, rng.randint(1, 3))),
+            "BP_SYSTOLIC": rng.choice([rng.randint(80, 140), None]),
+            "BP_DIASTOLIC": rng.randint(50, 90),
+            "TEMP": round(rng.uniform(36, 40), 1),
+            "DIAGNOSIS": f"DX{rng.randint(1, 300)}",
+            "FINAL_DIAGNOSIS": f"FDX{rng.randint(1, 300)}",
+            "LAB_REQUESTS": "; ".join(rng.sample(SMOKE_TESTS, rng.randint(1, 5))) if rng.random() < 0.9 else None,
+        })
+    pd.DataFrame(table).to_csv(path, index=False)
+
+
+def render_text(batch, eos_token):
+    """CHAT_TEMPLATE filled in directly, standing in for unsloth's chat-template step."""
+    return {"text": [
+        CHAT_TEMPLATE.format(INPUT=f"{inst}\n\nContext:\n{inp}", OUTPUT=out) + eos_token
+        for inst, inp, out in zip(batch["instruction"], batch["input"], batch["output"])
+    ]}
+
+
+def smoke_tokenizer(texts, vocab_size: int = 2000) -> PreTrainedTokenizerFast:
+    """A small byte-level BPE tokenizer trained on the synthetic texts."""
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.train_from_iterator(texts, trainers.BpeTrainer(
+        vocab_size=vocab_size, special_tokens=["<pad>", "<eos>", "<unk>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    ))
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, pad_token="<pad>", eos_token="<eos>", unk_token="<unk>"
+    )
+
+
+def smoke_model(tokenizer, max_length: int) -> LlamaForCausalLM:
+    """A randomly initialised two-layer Llama, small enough for CPU steps."""
+    config = LlamaConfig(
+        vocab_size=len(tokenizer), hidden_size=128, intermediate_size=256,
+        num_hidden_layers=2, num_attention_heads=4, num_key_value_heads=4,
+        max_position_embeddings=max_length,
+        pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id,
+    )
+    return LlamaForCausalLM(config)
+
+
+def timed_rate(label, count, started, unit="examples"):
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed else float("inf")
+    print(f"{label:<12} {elapsed:8.2f}s  {count:>9} {unit:<8} {rate:12.1f}/s")
+    return {"seconds": round(elapsed, 4), unit: count, f"{unit}_per_sec": round(rate, 1)}
+
+
+def smoke(args, num_proc: int):
+    """Time records, tokenization, collation and a few CPU optimizer steps."""
+    torch.manual_seed(args.seed)
+    report = {"rows": args.smoke_rows, "num_proc": num_proc, "packing": args.packing,
+              "group_by_length": args.group_by_length, "batch_size": args.batch_size}
+    with tempfile.TemporaryDirectory(prefix="smoke-train-") as scratch:
+        scratch = Path(scratch)
+        csv_path = scratch / "unified_training_table.csv"
+        write_synthetic_table(csv_path, args.smoke_rows, args.seed)
+
+        started = time.perf_counter()
+        raw_ds = load_medical_data(csv_path, args.chunksize, scratch / "raw")
+        report["records"] = timed_rate("records", len(raw_ds), started)
+
+        tokenizer = smoke_tokenizer(list(raw_ds["instruction"]) + list(raw_ds["output"]))
+        started = time.perf_counter()
+        ds = raw_ds.map(render_text, fn_kwargs={"eos_token": tokenizer.eos_token},
+                        batched=True, num_proc=num_proc, remove_columns=raw_ds.column_names)
+        ds = tokenize_dataset(ds, tokenizer, args.max_seq_length, args.packing, num_proc)
+        report["tokenize"] = timed_rate("tokenize", len(raw_ds), started)
+
+        lengths = list(ds["length"])
+        sampler = None
+        if args.group_by_length:
+            sampler = LengthGroupedSampler(args.batch_size, lengths=lengths,
+                                           generator=torch.Generator().manual_seed(args.seed))
+        loader = DataLoader(
+            ds.remove_columns("length"), batch_size=args.batch_size, sampler=sampler,
+            collate_fn=DataCollatorForSeq2Seq(tokenizer, pad_to_multiple_of=8),
+        )
+        started = time.perf_counter()
+        padded = real = 0
+        for batch in loader:
+            padded += batch["input_ids"].numel()
+            real += int(batch["attention_mask"].sum())
+        report["collate"] = timed_rate("collate", len(ds), started)
+        report["collate"]["pad_fraction"] = round(1 - real / padded, 4) if padded else 0.0
+        print(f"{'':<12} {report['collate']['pad_fraction']:.1%} of batch tokens are padding")
+
+        if len(ds) == 0:
+            raise SystemExit("The smoke table produced no training records.")
+        model = smoke_model(tokenizer, args.max_seq_length)
+        model.train()
+        optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr)
+        steps, tokens, loss, batches = 0, 0, None, iter(loader)
+        started = time.perf_counter()
+        while steps < args.smoke_steps:
+            batch = next(batches, None)
+            if batch is None:
+                batches = iter(loader)
+                continue
+            loss = model(**batch).loss
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+            tokens += int(batch["attention_mask"].sum())
+            steps += 1
+        report["train"] = timed_rate("train", tokens, started, unit="tokens")
+        report["train"].update(steps=steps, loss=None if loss is None else round(float(loss), 4))
+
+    if args.smoke_report:
+        args.smoke_report.write_text(json.dumps(report, indent=2))
+        print(f"Smoke report saved to {args.smoke_report}")
+    return report
 
 
 class SavePeftModelCallback(TrainerCallback):
@@ -72,19 +375,19 @@ def main():
     torch.manual_seed(args.seed)
 
     os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    cpu_workers = max(1, multiprocessing.cpu_count() - 2)
+    num_proc = args.num_proc or cpu_workers
+    print(f"Using {num_proc} tokenization processes.")
+    if args.smoke:
+        smoke(args, num_proc)
+        return
+
     torch.backends.cudnn.benchmark = True
     torch.backends.cuda.matmul.allow_tf32 = True
     torch.backends.cudnn.allow_tf32 = True
 
     assert torch.cuda.is_available(), "CUDA is required for GPU training"
-    cpu_workers = max(1, multiprocessing.cpu_count() - 2)
-    print(f"Using {cpu_workers} data loader workers.")
-
-
-    raw_ds = load_medical_data(args.data)
-    ds = to_sharegpt(raw_ds, merged_prompt="{instruction}\n\nContext:\n{input}", output_column_name="output")
-    ds = standardize_sharegpt(ds)
-    chat_template = "You are a clinical support system.\nPatient Case:\n{INPUT}\nRecommended Tests:\n{OUTPUT}"
+    assert FastLanguageModel is not None, "unsloth is required for GPU training"
 
     name = args.model_name
     try:
@@ -101,7 +404,7 @@ def main():
             model_name=path, max_seq_length=2048, load_in_4bit=True,
             device_map="auto", local_files_only=True
         )
-]
+
     if hasattr(tokenizer, "unsloth_push_to_hub"):
         delattr(tokenizer, "unsloth_push_to_hub")
 
@@ -112,11 +415,8 @@ def main():
     )
     model.gradient_checkpointing_enable()
 
-    ds = apply_chat_template(ds, tokenizer, chat_template)
-    ds = ds.map(
-        lambda b: tokenizer(b['text'], truncation=True, padding='max_length', max_length=1024),
-        batched=True, num_proc=min(1, cpu_workers), remove_columns=ds.column_names  # reduced to 1 for Windows stability
-    )
+    ds = prepare_dataset(args, tokenizer, num_proc)
+    # pads each batch to its longest sequence; padded label positions become -100
     collator = DataCollatorForSeq2Seq(tokenizer, pad_to_multiple_of=8)
 
     fp16 = torch.cuda.is_available() and not torch.cuda.is_bf16_supported()
@@ -139,8 +439,10 @@ def main():
         logging_steps=50,
         save_steps=200,
         save_total_limit=3,
-        dataloader_num_workers=0,  
+        dataloader_num_workers=0,
         gradient_checkpointing=True,
+        group_by_length=args.group_by_length,
+        length_column_name="length",
         seed=args.seed,
     )
 
@@ -150,13 +452,13 @@ def main():
         train_dataset=ds,
         eval_dataset=ds.select(range(min(500, len(ds)))),
         data_collator=collator,
-        packing=False,  
+        packing=False,  # already packed by prepare_dataset when --packing is set
     )
     trainer.train()
 
     model.save_pretrained(args.output_dir)
     tokenizer.save_pretrained(args.output_dir)
-]
+
     mf = args.output_dir / "Modelfile"
     mf.write_text(f"""FROM {args.output_dir}
 SYSTEM You are a medical expert specializing in lab-test recommendations.
@@ -0,0 +1,113 @@
+"""Per-visit lookups over the unified training table.
+
+`FrameTrainingTable` keeps the table as a pandas DataFrame in each process.
+`MmapTrainingTable` serves it from files written by
+
+    python training_store.py --out training_mmap
+
+an uncompressed Arrow IPC file sorted by (MR_CODE, VISIT_DATE) plus two
+`.npy` key arrays. All three are memory-mapped, so every worker process
+shares one page-cache copy and a visit is a binary search and a zero-copy
+slice. Point the app at them with `TRAINING_MMAP=training_mmap`.
+"""
+import os
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from record_store import VisitIndex
+from snapshot import has_snapshot, read_typed
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+TRAINING_CSV = 'cleaned_unified_training_table.csv'
+# columns sent to the model for a visit
+TRAINING_COLUMNS = ['MR_CODE', 'MR_SEX', 'AGE_AT_VISIT', 'PRESENTING_COMPLAIN']
+
+
+def load_training_frame(columns=None) -> pd.DataFrame:
+    if has_snapshot('training'):
+        return read_typed('training', columns=columns)
+    parse_dates = [c for c in ("MR_REG_DATE", "MR_DOB", "VISIT_DATE") if columns is None or c in columns]
+    return pd.read_csv(TRAINING_CSV, usecols=columns, parse_dates=parse_dates)
+
+
+class FrameTrainingTable:
+    def __init__(self, df: pd.DataFrame, columns):
+        self.df = df
+        self.columns = list(columns)
+        self.index = VisitIndex(df['MR_CODE'].astype(str), df['VISIT_DATE'].dt.date)
+
+    def lookup(self, mr_code: str, visit_date) -> list:
+        sub = self.df.iloc[self.index.lookup(mr_code, visit_date)]
+        return sub[self.columns].to_dict(orient='records')
+
+
+def mmap_paths(prefix) -> dict:
+    prefix = str(prefix)
+    return {
+        'table': prefix + '.arrow',
+        'codes': prefix + '.codes.npy',
+        'days':  prefix + '.days.npy',
+    }
+
+
+def write_mmap(df: pd.DataFrame, prefix, columns) -> dict:
+    paths = mmap_paths(prefix)
+    os.makedirs(os.path.dirname(paths['table']) or '.', exist_ok=True)
+
+    codes = df['MR_CODE'].astype(str).to_numpy(dtype=str)
+    days = df['VISIT_DATE'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    order = np.lexsort((days, codes))
+
+    table = pa.Table.from_pandas(df[list(columns)].iloc[order], preserve_index=False)
+    with pa.OSFile(paths['table'], 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    np.save(paths['codes'], codes[order])
+    np.save(paths['days'], days[order])
+    return paths
+
+
+class MmapTrainingTable:
+    def __init__(self, prefix, columns):
+        paths = mmap_paths(prefix)
+        self.columns = list(columns)
+        self.table = pa.ipc.open_file(pa.memory_map(paths['table'], 'r')).read_all()
+        self.codes = np.load(paths['codes'], mmap_mode='r')
+        self.days = np.load(paths['days'], mmap_mode='r')
+
+    def lookup(self, mr_code: str, visit_date) -> list:
+        lo = int(np.searchsorted(self.codes, mr_code, side='left'))
+        hi = int(np.searchsorted(self.codes, mr_code, side='right'))
+        if lo == hi:
+            return []
+        day = np.datetime64(visit_date, 'D').astype(np.int64)
+        days = self.days[lo:hi]
+        start = lo + int(np.searchsorted(days, day, side='left'))
+        stop = lo + int(np.searchsorted(days, day, side='right'))
+        return self.table.slice(start, stop - start).select(self.columns).to_pylist()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write the memory-mapped training table")
+    parser.add_argument("--out", type=Path, default=Path("training_mmap"),
+                        help="Output path prefix")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    df = load_training_frame(TRAINING_COLUMNS + ['VISIT_DATE'])
+    paths = write_mmap(df, args.out, TRAINING_COLUMNS)
+    print(f"✔ {len(df)} rows -> {paths['table']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Numeric user ids handed out from a counter document in the user container.
+
+The container also holds the email index, so every document carries a
+`type` and user queries filter on USER_FILTER.
+"""
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+USER_ID_COUNTER = 'user-id-counter'
+# users created before documents were typed have no `type`; any query over
+# users must include USER_FILTER with USER_TYPE_PARAM
+USER_FILTER = "(NOT IS_DEFINED(c.type) OR c.type = @user_type)"
+USER_TYPE_PARAM = {"name": "@user_type", "value": "user"}
+
+
+async def seed_user_id_counter(container):
+    # one-off scan so numbering continues after the users created before the counter
+    query = f"SELECT c.id FROM c WHERE {USER_FILTER}"
+    items = container.query_items(query=query, parameters=[USER_TYPE_PARAM], partition_key=None)
+    max_id = 0
+    async for item in items:
+        id_str = item.get('id')
+        if id_str and id_str.isdigit():
+            max_id = max(max_id, int(id_str))
+    try:
+        await container.create_item({'id': USER_ID_COUNTER, 'type': 'counter', 'next_id': max_id + 1})
+    except exceptions.CosmosResourceExistsError:
+        pass  # another signup seeded it first
+
+
+async def allocate_user_ids(container, count: int = 1) -> range:
+    """Reserve `count` consecutive numeric ids from the counter document.
+
+    The bump is an ETag-guarded replace, so concurrent signups retry
+    instead of handing out the same id.
+    """
+    while True:
+        try:
+            counter = await container.read_item(item=USER_ID_COUNTER, partition_key=USER_ID_COUNTER)
+        except exceptions.CosmosResourceNotFoundError:
+            await seed_user_id_counter(container)
+            continue
+        first = int(counter['next_id'])
+        try:
+            await container.replace_item(
+                item=USER_ID_COUNTER,
+                body={'id': USER_ID_COUNTER, 'type': 'counter', 'next_id': first + count},
+                etag=counter['_etag'],
+                match_condition=MatchConditions.IfNotModified
+            )
+        except exceptions.CosmosAccessConditionFailedError:
+            continue
+        return range(first, first + count)
@@ -13,6 +13,7 @@ import 'screen/medication_screen.dart';
 import 'screen/delete_user_screen.dart';
 import 'screen/registration_screen.dart';
 import 'screen/add_user_screen.dart';
+import 'screen/visit_summary_screen.dart';
 
 void main() {
   runApp(const MyApp());
@@ -49,6 +50,7 @@ class MyApp extends StatelessWidget {
         '/deleteUser': (context) => DeleteUserPage(),
         '/registration': (context) => const RegistrationPage(),
         '/addUser': (context) => AddUserPage(),
+        '/visitSummary': (context) => const VisitSummaryPage(),
       },
     );
   }
@@ -45,13 +45,20 @@ class _DashboardScreenState extends State<DashboardScreen> {
     _user = ModalRoute.of(context)!.settings.arguments as Map<String, dynamic>;
   }
 
+  // opens every panel of the visit from one /visit_summary request
   void _searchRecords() {
-    final mrCode = _mrCodeController.text;
-    final visitDate = _dateController.text;
-    ScaffoldMessenger.of(context).showSnackBar(
-      SnackBar(
-        content: Text('Searching MR: $mrCode  Date: $visitDate'),
-      ),
+    final mrCode = _mrCodeController.text.trim();
+    final visitDate = _dateController.text.trim();
+    if (mrCode.isEmpty || visitDate.isEmpty) {
+      ScaffoldMessenger.of(context).showSnackBar(
+        const SnackBar(content: Text('Enter the MR code and visit date')),
+      );
+      return;
+    }
+    Navigator.pushNamed(
+      context,
+      '/visitSummary',
+      arguments: {'mrCode': mrCode, 'visitDate': visitDate},
     );
   }
 
@@ -174,7 +181,7 @@ class _DashboardScreenState extends State<DashboardScreen> {
                     controller: _dateController,
                     decoration: InputDecoration(
                       labelText: 'Visit Date',
-                      hintText: 'dd/mm/yyyy',
+                      hintText: 'mm/dd/yyyy',
                       prefixIcon: const Icon(Icons.calendar_today),
                       border: OutlineInputBorder(borderRadius: BorderRadius.circular(8)),
                       filled: true,
@@ -4,6 +4,7 @@ import 'package:flutter/material.dart';
 import 'package:intl/intl.dart';
 import 'package:flutter_markdown/flutter_markdown.dart';
 
+import '../services/auth_service.dart';
 import '../services/recommendation_service.dart';
 
 class RecommendationPage extends StatefulWidget {
@@ -15,7 +16,7 @@ class RecommendationPage extends StatefulWidget {
 
 class _RecommendationPageState extends State<RecommendationPage> {
   final TextEditingController _mrCodeController = TextEditingController();
-  late final Map<String, dynamic> _user;
+  Map<String, dynamic>? _user;
   DateTime _selectedDate = DateTime.now();
 
   bool _isLoading = false;
@@ -31,7 +32,7 @@ class _RecommendationPageState extends State<RecommendationPage> {
     super.didChangeDependencies();
     // Expect you to push this page with:
     // Navigator.pushNamed(context, "/recommendations", arguments: userMap);
-    _user = ModalRoute.of(context)!.settings.arguments as Map<String, dynamic>;
+    _user ??= ModalRoute.of(context)!.settings.arguments as Map<String, dynamic>;
   }
 
   /// Formats the raw API field into a user friendly Markdown string.
@@ -64,6 +65,46 @@ class _RecommendationPageState extends State<RecommendationPage> {
     }
   }
 
+  /// Streams one request into the section cards; true if anything failed.
+  Future<bool> _streamSections(
+      String visitDate, Map<String, ValueNotifier<String>> notifiers) async {
+    bool failed = false;
+    final finished = <String>{};
+    // sections arrive as soon as each one finishes on the server
+    await for (final event in RecommendationService().streamRecommendations(
+      mrCode: _mrCodeController.text.trim(),
+      visitDate: visitDate,
+      user: _user!,
+    )) {
+      if (event['event'] == 'done' && event['status'] == 'error') {
+        failed = true;
+      }
+      if (event['event'] == 'error' && event['section'] == null) {
+        // the whole request failed: queue full, deadline passed, ...
+        failed = true;
+        final retryAfter = event['retry_after'];
+        final message = retryAfter == null
+            ? 'Error: ${event['text']}'
+            : 'Error: ${event['text']} (retry in ${retryAfter}s)';
+        notifiers.forEach((section, notifier) {
+          if (!finished.contains(section)) notifier.value = message;
+        });
+        setState(() => _errorMessage = message);
+        continue;
+      }
+      final notifier = notifiers[event['section']];
+      if (notifier == null) continue;
+      if (event['event'] == 'section') {
+        finished.add(event['section']);
+        notifier.value = _formatField(event['text']);
+      } else if (event['event'] == 'error') {
+        failed = true;
+        notifier.value = 'Error: ${event['text']}';
+      }
+    }
+    return failed;
+  }
+
   Future<void> _fetchRecommendations() async {
     final visitDate = DateFormat('M/d/yyyy').format(_selectedDate);
 
@@ -72,26 +113,30 @@ class _RecommendationPageState extends State<RecommendationPage> {
       _errorMessage = null;
     });
 
-    try {
-      // now you get back a List<dynamic>
-      final List<dynamic> resultList = await RecommendationService()
-          .fetchRecommendations(
-        mrCode: _mrCodeController.text.trim(),
-        visitDate: visitDate,
-        user: _user,
-      );
-
-      // take the first (and only) element and cast to a map
-      final Map<String, dynamic> rec = resultList.first as Map<String, dynamic>;
-
-
-      _diagnosesNotifier.value   = _formatField(rec['diagnoses']);
-      _labRequestsNotifier.value = _formatField(rec['lab_requests']);
-      _medicationsNotifier.value = _formatField(rec['medications']);
+    final notifiers = {
+      'diagnoses': _diagnosesNotifier,
+      'lab_requests': _labRequestsNotifier,
+      'medications': _medicationsNotifier,
+    };
+    for (final notifier in notifiers.values) {
+      notifier.value = 'Loading...';
+    }
 
-      ScaffoldMessenger.of(context).showSnackBar(
-        const SnackBar(content: Text("✅ Recommendations loaded")),
-      );
+    try {
+      bool failed;
+      try {
+        failed = await _streamSections(visitDate, notifiers);
+      } on SessionExpiredException {
+        // token expired or the server restarted: log in again and retry once
+        _user = await AuthService.loginUser(_user!['email'], _user!['password']);
+        failed = await _streamSections(visitDate, notifiers);
+      }
+
+      if (!failed) {
+        ScaffoldMessenger.of(context).showSnackBar(
+          const SnackBar(content: Text("✅ Recommendations loaded")),
+        );
+      }
     } catch (e) {
       setState(() => _errorMessage = "Error: ${e.toString()}");
       print("Error fetching recommendations: $e");
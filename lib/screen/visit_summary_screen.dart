@@ -0,0 +1,145 @@
+import 'package:flutter/material.dart';
+import '../services/visit_summary_service.dart';
+
+/// Every record panel of one visit, loaded with a single `/visit_summary`
+/// request. Push with:
+/// Navigator.pushNamed(context, '/visitSummary',
+///     arguments: {'mrCode': mrCode, 'visitDate': visitDate});
+class VisitSummaryPage extends StatefulWidget {
+  const VisitSummaryPage({super.key});
+
+  @override
+  State<VisitSummaryPage> createState() => _VisitSummaryPageState();
+}
+
+class _VisitSummaryPageState extends State<VisitSummaryPage> {
+  // panel key in the response -> title shown on the page
+  static const Map<String, String> panels = {
+    'registration': 'Registration',
+    'presenting_complain': 'Presenting Complaint',
+    'vitals': 'Vitals',
+    'diagnoses': 'Diagnosis',
+    'lab_requests': 'Lab Requests',
+    'lab_results': 'Lab Results',
+    'medications': 'Medications',
+  };
+
+  String? mrCode;
+  String? visitDate;
+  bool isLoading = true;
+  String? errorMessage;
+  Map<String, dynamic> summary = {};
+
+  @override
+  void didChangeDependencies() {
+    super.didChangeDependencies();
+    if (mrCode != null) return;
+    final args = ModalRoute.of(context)!.settings.arguments as Map<String, dynamic>;
+    mrCode = args['mrCode'];
+    visitDate = args['visitDate'];
+    _fetchSummary();
+  }
+
+  Future<void> _fetchSummary() async {
+    setState(() {
+      isLoading = true;
+      errorMessage = null;
+    });
+
+    try {
+      final result = await VisitSummaryService().fetchVisitSummary(
+        mrCode: mrCode!,
+        visitDate: visitDate!,
+      );
+      setState(() {
+        summary = result;
+      });
+    } catch (e) {
+      setState(() {
+        errorMessage = e.toString();
+      });
+    } finally {
+      setState(() {
+        isLoading = false;
+      });
+    }
+  }
+
+  Widget _buildTable(List<dynamic> rows) {
+    if (rows.isEmpty) {
+      return const Padding(
+        padding: EdgeInsets.all(12.0),
+        child: Text('No Data Available'),
+      );
+    }
+
+    final columns = (rows.first as Map<String, dynamic>).keys.toList();
+    return SingleChildScrollView(
+      scrollDirection: Axis.horizontal,
+      child: DataTable(
+        columns: columns
+            .map((key) => DataColumn(
+                  label: Text(
+                    key,
+                    style: const TextStyle(fontWeight: FontWeight.bold),
+                  ),
+                ))
+            .toList(),
+        rows: rows.map((item) {
+          final rowMap = item as Map<String, dynamic>;
+          return DataRow(
+            cells: columns
+                .map((key) => DataCell(Text(rowMap[key]?.toString() ?? '')))
+                .toList(),
+          );
+        }).toList(),
+      ),
+    );
+  }
+
+  Widget _buildBody() {
+    if (isLoading) {
+      return const Center(child: CircularProgressIndicator());
+    }
+    if (errorMessage != null) {
+      return Center(
+        child: Text(errorMessage!, style: const TextStyle(color: Colors.red)),
+      );
+    }
+    if (summary.isEmpty) {
+      return const Center(child: Text('No records found for this visit'));
+    }
+
+    return ListView(
+      children: panels.entries.map((panel) {
+        final rows = List<dynamic>.from(summary[panel.key] ?? []);
+        return Card(
+          margin: const EdgeInsets.symmetric(vertical: 6),
+          shape: RoundedRectangleBorder(borderRadius: BorderRadius.circular(12)),
+          child: ExpansionTile(
+            initiallyExpanded: rows.isNotEmpty,
+            title: Text(
+              '${panel.value} (${rows.length})',
+              style: const TextStyle(fontWeight: FontWeight.bold),
+            ),
+            children: [_buildTable(rows)],
+          ),
+        );
+      }).toList(),
+    );
+  }
+
+  @override
+  Widget build(BuildContext context) {
+    return Scaffold(
+      appBar: AppBar(
+        title: Text('Visit ${mrCode ?? ''} — ${visitDate ?? ''}'),
+        centerTitle: true,
+      ),
+      body: Padding(
+        padding: const EdgeInsets.all(16.0),
+        child: _buildBody(),
+      ),
+    );
+  }
+}
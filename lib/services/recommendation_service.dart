@@ -1,9 +1,25 @@
 import 'dart:convert';
 import 'package:http/http.dart' as http;
 
+/// Thrown when the server rejects the session token (HTTP 401); the caller
+/// should log in again with `/validate_user` and retry.
+class SessionExpiredException implements Exception {
+  final String message;
+  SessionExpiredException(this.message);
+
+  @override
+  String toString() => "Session expired: $message";
+}
+
 class RecommendationService {
   final String baseUrl = "http://127.0.0.1:5000"; // adjust if needed
 
+  /// The server only trusts the session token from `/validate_user`.
+  Map<String, String> _headers(Map<String, dynamic> user) => {
+        "Content-Type": "application/json",
+        if (user["token"] != null) "Authorization": "Bearer ${user["token"]}",
+      };
+
   Future<List<dynamic>> fetchRecommendations({
     required String mrCode,
     required String visitDate,
@@ -12,11 +28,10 @@ class RecommendationService {
     final uri = Uri.parse("$baseUrl/recommend");
     final response = await http.post(
       uri,
-      headers: {"Content-Type": "application/json"},
+      headers: _headers(user),
       body: json.encode({
         "mr_code": mrCode,
         "visit_date": visitDate,
-        "user": user,
       }),
     );
 
@@ -25,8 +40,56 @@ class RecommendationService {
 
    // debug
       return decoded;
+    } else if (response.statusCode == 401) {
+      throw SessionExpiredException(response.body);
     } else {
       throw Exception("Failed (${response.statusCode}): ${response.body}");
     }
   }
+
+  /// Streams recommendation events from `/recommend/stream`.
+  ///
+  /// Each event is a map with `event` (`delta`, `section`, `error` or
+  /// `done`), `section` and `text`. A `section` event carries the complete
+  /// cleaned answer for that section, so the UI can render it right away.
+  Stream<Map<String, dynamic>> streamRecommendations({
+    required String mrCode,
+    required String visitDate,
+    required Map<String, dynamic> user,
+  }) async* {
+    final client = http.Client();
+    try {
+      final request = http.Request("POST", Uri.parse("$baseUrl/recommend/stream"))
+        ..headers.addAll(_headers(user))
+        ..body = json.encode({
+          "mr_code": mrCode,
+          "visit_date": visitDate,
+        });
+      final response = await client.send(request);
+
+      if (response.statusCode != 200) {
+        final body = await response.stream.bytesToString();
+        if (response.statusCode == 401) throw SessionExpiredException(body);
+        throw Exception("Failed (${response.statusCode}): $body");
+      }
+
+      String event = "message";
+      final lines = response.stream
+          .transform(utf8.decoder)
+          .transform(const LineSplitter());
+      await for (final line in lines) {
+        if (line.startsWith("event:")) {
+          event = line.substring(6).trim();
+        } else if (line.startsWith("data:")) {
+          final Map<String, dynamic> data =
+              json.decode(line.substring(5).trim()) as Map<String, dynamic>;
+          yield {"event": event, ...data};
+        } else if (line.isEmpty) {
+          event = "message";
+        }
+      }
+    } finally {
+      client.close();
+    }
+  }
 }
@@ -0,0 +1,35 @@
+import 'dart:convert';
+import 'package:http/http.dart' as http;
+
+class VisitSummaryService {
+  /// Base URL of your Flask backend
+  final String baseUrl = "http://127.0.0.1:5000";
+
+  /// Fetches every record panel for one patient visit in a single request.
+  ///
+  /// The returned map has the keys `registration`, `presenting_complain`,
+  /// `vitals`, `diagnoses`, `lab_requests`, `lab_results` and `medications`,
+  /// each holding a list of records. Returns an empty map when the visit has
+  /// no records.
+  Future<Map<String, dynamic>> fetchVisitSummary({
+    required String mrCode,
+    required String visitDate,
+  }) async {
+    try {
+      final response = await http.get(
+        Uri.parse("$baseUrl/visit_summary?mr_code=$mrCode&visit_date=$visitDate"),
+      );
+
+      if (response.statusCode == 200) {
+        return Map<String, dynamic>.from(json.decode(response.body));
+      } else if (response.statusCode == 404) {
+        // No records found
+        return {};
+      } else {
+        throw Exception("Error fetching visit summary: ${response.statusCode}");
+      }
+    } catch (e) {
+      throw Exception("Connection Error: $e");
+    }
+  }
+}